@@ -23,5 +23,12 @@ DEFAULT_THRESHOLDS = {
     "current": {"phase_a": 8.0}
 }
 
+# --- Удержание значений (deadband на станциях) ---
+# Stations with deadband reporting (rpi_3/config.json "deadband") send a value only when it
+# changes or every deadband.heartbeat_sec; the last value is held in between. Gaps up to this
+# age are not drawn as breaks. Keep it at 1.5 x the stations' heartbeat_sec (60 s shipped -> 90 s)
+# and change both together; 0 = breaks at 1.5 x the average sample interval, no held values.
+HELD_VALUE_MAX_AGE_SEC = 90
+
 # --- Файл для хранения пользовательских порогов ---
 SETTINGS_FILE = "thresholds.json"
\ No newline at end of file
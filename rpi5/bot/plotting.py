@@ -3,7 +3,7 @@ import numpy as np
 import pandas as pd
 import datetime
 from io import BytesIO
-from config import MOSCOW_TZ
+from config import MOSCOW_TZ, HELD_VALUE_MAX_AGE_SEC
 
 def generate_multi_sensor_plot(data_dict, title, ylabel, thresholds=None, time_range=None):
     """
@@ -65,6 +65,7 @@ def generate_multi_sensor_plot(data_dict, title, ylabel, thresholds=None, time_r
         else:
             avg_interval = 0
         gap_threshold = 1.5 * avg_interval if avg_interval > 0 else 60
+        gap_threshold = max(gap_threshold, HELD_VALUE_MAX_AGE_SEC)  # Held values are not gaps
         for j in range(len(times) - 1):
             new_times.append(times[j])
             new_values.append(values[j])
@@ -77,7 +78,9 @@ def generate_multi_sensor_plot(data_dict, title, ylabel, thresholds=None, time_r
             new_times.append(times[-1])
             new_values.append(values[-1])
 
-        plt.plot(new_times, new_values, label=sensor_name, color=colors(i))
+        # Held values (deadband reporting) stay constant until the next sample
+        plt.plot(new_times, new_values, label=sensor_name, color=colors(i),
+                 drawstyle='steps-post' if HELD_VALUE_MAX_AGE_SEC else 'default')
         has_plot_elements = True
 
         # Рисуем порог, если задан
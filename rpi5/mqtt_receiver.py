@@ -7,6 +7,8 @@ from influxdb_client import InfluxDBClient, Point
 from influxdb_client.client.write_api import SYNCHRONOUS
 import time  # Import time for timestamp conversion
 
+from payload_codec import decode_payload, PayloadDecodeError
+
 # InfluxDB Configuration
 # Replace with your actual InfluxDB details
 INFLUX_URL = "http://localhost:8086"
@@ -21,6 +23,20 @@ MQTT_BROKER = "192.168.1.117"  # Or "192.168.0.93" if broker is on RPi Zero, or
 #MQTT_BROKER = "192.168.0.93"  # Or "192.168.0.93" if broker is on RPi Zero, or actual broker IP
 MQTT_PORT = 1883
 MQTT_TOPIC = "sensors/data"  # Topic subscribed to
+MQTT_SCHEMA_TOPIC = MQTT_TOPIC + "/schema/+"  # Retained payload schemas of the stations (packed payloads)
+SUBSCRIBE_COMBINED = True  # Combined payloads on MQTT_TOPIC
+# Edge rollups (stations with rollups enabled): <topic>/rollup/1s, <topic>/rollup/60s, ...
+# Stored as "<group>_rollup" measurements tagged with window_sec, like buffered rollup records.
+MQTT_ROLLUP_TOPIC = MQTT_TOPIC + "/rollup/+"
+SUBSCRIBE_ROLLUPS = True
+# Per-sensor topics <prefix>/<device_id>/<group>/<sensor> (stations with mqtt.sensor_topics enabled),
+# e.g. ["sensors/+/temperature/#"] to store only temperatures. Do not combine a group with
+# SUBSCRIBE_COMBINED, or its values are written twice.
+SENSOR_TOPIC_SUBSCRIPTIONS = []
+SENSOR_GROUPS = ("vibration", "temperature", "current")
+
+# Payload schemas announced by the stations: (device_id, schema_id) -> compiled slot list
+schema_cache = {}
 
 # === Initialize InfluxDB client ===
 try:
@@ -52,14 +68,179 @@ def safe_float(value):
 def on_message(client, userdata, msg):
     """
     Called when a new MQTT message is received.
-    Parses the message, extracts sensor data and writes it to InfluxDB.
-    Handles the specific nested JSON structure from the RPi Zero sender.
+    Decodes the payload (a single record, plain JSON or framed MessagePack, or a batch
+    envelope of records replayed from the sender's offline buffer) and processes every record.
     """
+    if mqtt.topic_matches_sub(MQTT_SCHEMA_TOPIC, msg.topic):
+        process_schema(msg)
+        return
+    if any(mqtt.topic_matches_sub(sub, msg.topic) for sub in SENSOR_TOPIC_SUBSCRIPTIONS):
+        process_sensor_topic(msg)
+        return
+
     try:
-        # Decode payload and parse JSON
-        payload_str = msg.payload.decode("utf-8")
-        data = json.loads(payload_str)
+        records = decode_payload(msg.payload)
+    except PayloadDecodeError as e:
+        print(f"Error decoding payload on topic {msg.topic}: {e}")
+        return
+
+    if len(records) == 1 and isinstance(records[0], dict):
+        process_payload(records[0])
+        return
+
+    # Batch: collect the points of all records and write them in one request
+    print(f"Received batch of {len(records)} records on topic {msg.topic}")
+    pending_points = []
+    for data in records:
+        if not isinstance(data, dict):
+            print(f"Warning: Skipping non-object record: {data!r}")
+            continue
+        process_payload(data, pending_points)
+    if pending_points and write_api is not None:
+        try:
+            write_api.write(bucket=INFLUX_BUCKET, org=INFLUX_ORG, record=pending_points)
+            print(f" - Wrote {len(pending_points)} points from batch")
+        except Exception as e:
+            print(f"Error writing batch to InfluxDB: {e}")
+
+
+def write_point(point, pending_points=None):
+    """Writes a point to InfluxDB, or appends it to pending_points when the caller writes a batch."""
+    if pending_points is not None:
+        pending_points.append(point)
+    else:
+        write_api.write(bucket=INFLUX_BUCKET, org=INFLUX_ORG, record=point)
+
+
+def process_sensor_topic(msg):
+    """
+    Writes a per-sensor message (topic <prefix>/<device_id>/<group>/<sensor>, JSON body
+    {"timestamp", "value"} or {"timestamp", <metrics or error>}) as a one-sensor payload.
+    """
+    topic_levels = msg.topic.split("/")
+    if len(topic_levels) < 4 or topic_levels[-2] not in SENSOR_GROUPS or not msg.payload:
+        return
+    device_id, group, sensor = topic_levels[-3], topic_levels[-2], topic_levels[-1]
+    try:
+        message = json.loads(msg.payload.decode("utf-8"))
+    except (UnicodeDecodeError, ValueError) as e:
+        print(f"Error decoding sensor message on topic {msg.topic}: {e}")
+        return
+    if not isinstance(message, dict):
+        return
+    timestamp = message.pop("timestamp", time.time())
+    if msg.retain:
+        return  # Last value from before we subscribed; it was stored when it was published
+    sensor_data = message if group == "vibration" or "error" in message else message.get("value")
+    process_payload({"device_id": device_id, "timestamp": timestamp, group: {sensor: sensor_data}})
+
+
+def process_schema(msg):
+    """
+    Caches a schema announcement ({"device_id", "schema_id", "fields": [...]}, see
+    rpi_3/payload_schema.py). Every version seen is kept, so packed records that were
+    sent just before a reconfiguration still decode.
+    """
+    if not msg.payload:
+        return  # Retained schema cleared
+    try:
+        schema = json.loads(msg.payload.decode("utf-8"))
+        device_id = schema["device_id"]
+        schema_id = schema["schema_id"]
+        slots = []
+        for field in schema["fields"]:
+            group, sensor, name, scale = field["group"], field["sensor"], field["field"], field["scale"]
+            if group == "vibration":
+                measurement, field_key = "vibration_metrics", name
+            else:
+                measurement, field_key = group, sensor  # One point per group, one field per sensor
+            slots.append((measurement, sensor if group == "vibration" else None, field_key, scale))
+    except (UnicodeDecodeError, ValueError, KeyError, TypeError) as e:
+        print(f"Error decoding payload schema on topic {msg.topic}: {e}")
+        return
+    if (device_id, schema_id) not in schema_cache:
+        print(f"Cached payload schema {schema_id} of '{device_id}' ({len(slots)} fields)")
+    schema_cache[(device_id, schema_id)] = slots
 
+
+def process_packed(data, pending_points=None):
+    """
+    Writes a packed record ({"device_id", "timestamp", "schema_id", "values", "extra"}): the value
+    array is turned into points directly using the cached schema of the device; "extra" holds
+    error and stale entries in the normal payload layout and goes through process_payload().
+    """
+    device_id = data.get("device_id", "unknown_device")
+    slots = schema_cache.get((device_id, data.get("schema_id")))
+    if slots is None:
+        print(f"Warning: Unknown payload schema {data.get('schema_id')} from '{device_id}', record dropped.")
+        return
+    timestamp_ns = int(data.get("timestamp", time.time()) * 1e9)
+
+    points = {}  # (measurement, sensor_name) -> Point
+    for (measurement, sensor_name, field_key, scale), value in zip(slots, data.get("values", [])):
+        if value is None:
+            continue
+        point = points.get((measurement, sensor_name))
+        if point is None:
+            point = Point(measurement).tag("device_id", device_id).time(timestamp_ns)
+            if sensor_name is not None:
+                point.tag("sensor_name", sensor_name)
+            points[(measurement, sensor_name)] = point
+        if isinstance(value, list):
+            # FFT peaks: flat [freq, amp, ...] list, scale [freq_scale, amp_scale]
+            peaks = [{"freq": value[i] / scale[0], "amp": value[i + 1] / scale[1]}
+                     for i in range(0, len(value) - 1, 2) if value[i] is not None and value[i + 1] is not None]
+            point.field("fft_peaks_json", json.dumps(peaks))
+        else:
+            point.field(field_key, value / scale)
+    for point in points.values():
+        write_point(point, pending_points)
+    print(f" - Wrote {len(points)} packed points for '{device_id}'")
+
+    extra = data.get("extra")
+    if isinstance(extra, dict) and extra:
+        process_payload(dict(extra, device_id=device_id, timestamp=data.get("timestamp")), pending_points)
+
+
+def process_rollup(device_id, timestamp_ns, rollup, pending_points=None):
+    """
+    Writes a rollup record: one point per sensor in the measurement "<group>_rollup"
+    (e.g. "vibration_rollup"), tagged with sensor_name and window_sec, with the fields
+    "<field>_min", "<field>_mean", "<field>_max" and "count" (samples aggregated per field).
+    Single-value sensors (temperature, current) use the field name "value".
+    """
+    window_sec = rollup.get("window_sec", 0)
+    for group, sensors in rollup.get("metrics", {}).items():
+        if not isinstance(sensors, dict):
+            continue
+        for sensor_name, fields in sensors.items():
+            if not isinstance(fields, dict):
+                continue
+            point = Point(f"{group}_rollup").tag("device_id", device_id).tag("sensor_name", sensor_name) \
+                .tag("window_sec", str(window_sec)).time(timestamp_ns)
+            count = 0
+            for field, stats in fields.items():
+                if not isinstance(stats, dict):
+                    continue
+                for stat in ("min", "mean", "max"):
+                    if stat in stats:
+                        point.field(f"{field}_{stat}", safe_float(stats[stat]))
+                count = max(count, int(stats.get("count", 0)))
+            if point._fields:
+                point.field("count", count)
+                write_point(point, pending_points)
+    print(f" - Wrote {window_sec} s rollup ({rollup.get('count', 0)} samples) for '{device_id}'")
+
+
+def process_payload(data, pending_points=None):
+    """
+    Extracts sensor data from one payload record and writes it to InfluxDB.
+    Handles the specific nested JSON structure from the RPi Zero sender.
+    Sensors missing from a record (left out by the station's deadband filter) hold their last
+    value: no point is written for them.
+    :param pending_points: If a list is given, points are appended to it instead of being written.
+    """
+    try:
         # Extract primary identifiers and timestamp
         device_id = data.get("device_id", "unknown_device")
         timestamp_float = data.get("timestamp", time.time())  # Use current time if timestamp is missing
@@ -72,22 +253,37 @@ def on_message(client, userdata, msg):
             print("InfluxDB write API not initialized. Skipping data write.")
             return
 
+        # === Packed records (value arrays of an announced schema) ===
+        if "schema_id" in data and "values" in data:
+            process_packed(data, pending_points)
+            return
+
+        # === Rollup records (old backlog compacted on the sender) ===
+        if isinstance(data.get("rollup"), dict):
+            process_rollup(device_id, timestamp_ns, data["rollup"], pending_points)
+            return
+
         # === Process Temperature Data ===
         temp_data = data.get("temperature", {})
         # Expected format: {"sensor_name_1": value, "sensor_name_2": value, ...}
+        # A probe whose read missed its deadline is sent as {"value": last_good, "age_sec": ..., "stale": true}
         if isinstance(temp_data, dict) and temp_data:  # Check if it's a non-empty dictionary
             # Create a point for temperature measurements
             point_temp = Point("temperature").tag("device_id", device_id).time(timestamp_ns)
 
             # Iterate through each temperature sensor reported in the payload
             for sensor_name, value in temp_data.items():
+                if isinstance(value, dict) and "value" in value:
+                    # Stale cached value: store it with its age so gaps in fresh reads stay visible
+                    point_temp.field(f"{sensor_name}_age_sec", safe_float(value.get("age_sec")))
+                    value = value.get("value")
                 # Add each sensor's value as a field, using the sensor name as the field key
                 # Use safe_float to handle potential non-numeric values or errors reported
                 point_temp.field(sensor_name, safe_float(value))
 
             # Write the point if it has any fields added
             if point_temp._fields:
-                write_api.write(bucket=INFLUX_BUCKET, org=INFLUX_ORG, record=point_temp)
+                write_point(point_temp, pending_points)
                 print(f" - Wrote temperature data for '{device_id}'")
             else:
                 print(f" - No valid temperature fields found for '{device_id}'")
@@ -152,7 +348,7 @@ def on_message(client, userdata, msg):
 
                     # Write the point if it has any fields added (either metrics or error status)
                     if point_vib._fields:
-                        write_api.write(bucket=INFLUX_BUCKET, org=INFLUX_ORG, record=point_vib)
+                        write_point(point_vib, pending_points)
                         print(f" - Wrote vibration data for sensor '{sensor_name}' on device '{device_id}'")
                     else:
                         print(f" - No valid vibration fields found for sensor '{sensor_name}' on device '{device_id}'")
@@ -165,7 +361,7 @@ def on_message(client, userdata, msg):
                     error_state = metrics_dict.get("error")
                     error_details = metrics_dict.get("details", "")
                     point_vib_error.field("status_error", f"{error_state}: {error_details}")
-                    write_api.write(bucket=INFLUX_BUCKET, org=INFLUX_ORG, record=point_vib_error)
+                    write_point(point_vib_error, pending_points)
                     print(
                         f" - Wrote vibration error status for sensor '{sensor_name}' on device '{device_id}': {error_state}")
 
@@ -208,7 +404,7 @@ def on_message(client, userdata, msg):
 
             # Write the point if it has any fields added (either values or status errors)
             if point_current._fields:
-                write_api.write(bucket=INFLUX_BUCKET, org=INFLUX_ORG, record=point_current)
+                write_point(point_current, pending_points)
                 print(f" - Wrote current data for '{device_id}'")
             else:
                 print(f" - No valid current fields found for '{device_id}'")
@@ -216,8 +412,6 @@ def on_message(client, userdata, msg):
         # Add print for overall message processing success (optional, can be verbose)
         # print(f"Finished processing data from '{device_id}'.")
 
-    except json.JSONDecodeError:
-        print(f"Error decoding JSON payload: {msg.payload}")
     except Exception as e:
         print(f"Error processing MQTT message: {e}")
         # traceback.print_exc() # Uncomment for detailed debugging
@@ -230,8 +424,17 @@ def on_connect(client, userdata, flags, rc):
     """
     if rc == 0:
         print("Connected to MQTT broker.")
-        client.subscribe(MQTT_TOPIC)
-        print(f"Subscribed to topic: {MQTT_TOPIC}")
+        if SUBSCRIBE_COMBINED:
+            client.subscribe(MQTT_TOPIC, qos=1)  # Alarms and replayed backlog are sent at QoS 1, live data at QoS 0
+            print(f"Subscribed to topic: {MQTT_TOPIC}")
+        if SUBSCRIBE_ROLLUPS:
+            client.subscribe(MQTT_ROLLUP_TOPIC, qos=1)
+            print(f"Subscribed to topic: {MQTT_ROLLUP_TOPIC}")
+        for sensor_topic in SENSOR_TOPIC_SUBSCRIPTIONS:
+            client.subscribe(sensor_topic)
+            print(f"Subscribed to topic: {sensor_topic}")
+        client.subscribe(MQTT_SCHEMA_TOPIC, qos=1)  # Retained: the current schemas arrive right away
+        print(f"Subscribed to topic: {MQTT_SCHEMA_TOPIC}")
     else:
         print(f"MQTT connection failed with code {rc}. Reason: {mqtt.connack_string(rc)}")
 
@@ -0,0 +1,111 @@
+# payload_codec.py
+# -*- coding: utf-8 -*-
+"""
+Decoding of MQTT payloads sent by the stations (see rpi_3/payload_codec.py for the format).
+
+Plain payloads are a JSON object. Framed payloads start with a 4-byte header
+(magic 0xA5, format version, kind, encoding) followed by the encoded body.
+MessagePack bodies use the compact key table below (the same table as the sender's);
+msgpack is optional and only needed for stations configured with mqtt.encoding "msgpack".
+"""
+
+import json
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+    print("msgpack not found. MessagePack payloads cannot be decoded.")
+
+FRAME_MAGIC = 0xA5
+SUPPORTED_VERSIONS = (1,)
+
+KIND_BATCH = 1
+KIND_RECORD = 2
+KIND_PACKED = 3
+
+ENCODING_JSON = 0
+ENCODING_ZLIB_JSON = 1
+ENCODING_MSGPACK = 2
+ENCODING_ZLIB_MSGPACK = 3
+
+# Wire codes of field names in MessagePack bodies (index = code), append-only, see rpi_3/payload_codec.py
+COMPACT_KEYS = (
+    "device_id", "timestamp", "vibration", "temperature", "current", "general",
+    "total_rms", "rms_x", "rms_y", "rms_z", "peak_x", "peak_y", "peak_z",
+    "peak_to_peak_x", "peak_to_peak_y", "peak_to_peak_z", "fft_peaks",
+    "error", "details", "value", "age_sec", "stale",
+    "rollup", "window_sec", "count", "metrics", "min", "mean", "max",
+    "schema_id", "values", "extra",
+)
+FFT_PEAKS_KEY = "fft_peaks"
+
+
+class PayloadDecodeError(ValueError):
+    pass
+
+
+def _expand_pairs(pairs):
+    """msgpack object_pairs_hook: restores field names and FFT peak dicts of one map."""
+    expanded = {}
+    for key, value in pairs:
+        if key.__class__ is int:
+            if key >= len(COMPACT_KEYS):
+                raise PayloadDecodeError(f"Unknown compact key code {key}")
+            key = COMPACT_KEYS[key]
+            if key == FFT_PEAKS_KEY and value.__class__ is list:
+                value = [{"freq": peak[0], "amp": peak[1]} if peak.__class__ is list else peak for peak in value]
+        expanded[key] = value
+    return expanded
+
+
+def decode_body(body, encoding):
+    if encoding in (ENCODING_ZLIB_JSON, ENCODING_ZLIB_MSGPACK):
+        body = zlib.decompress(body)
+    elif encoding not in (ENCODING_JSON, ENCODING_MSGPACK):
+        raise PayloadDecodeError(f"Unknown payload encoding {encoding}")
+    if encoding in (ENCODING_MSGPACK, ENCODING_ZLIB_MSGPACK):
+        if msgpack is None:
+            raise PayloadDecodeError("MessagePack payload received but msgpack is not installed")
+        return msgpack.unpackb(body, raw=False, strict_map_key=False, object_pairs_hook=_expand_pairs)
+    return json.loads(body.decode("utf-8"))
+
+
+def decode_payload(payload):
+    """
+    Decodes an MQTT payload into a list of records (payload dicts).
+    :param payload: Raw message bytes.
+    :raises PayloadDecodeError: Unknown frame version, kind or encoding, or a corrupt body.
+    """
+    if not payload:
+        raise PayloadDecodeError("Empty payload")
+    if payload[0] != FRAME_MAGIC:
+        # Plain JSON payload: one record
+        try:
+            return [json.loads(payload.decode("utf-8"))]
+        except (UnicodeDecodeError, ValueError) as e:
+            raise PayloadDecodeError(f"Invalid JSON payload: {e}")
+
+    if len(payload) < 4:
+        raise PayloadDecodeError("Truncated frame header")
+    version, kind, encoding = payload[1], payload[2], payload[3]
+    if version not in SUPPORTED_VERSIONS:
+        raise PayloadDecodeError(f"Unsupported frame version {version}")
+    try:
+        body = decode_body(payload[4:], encoding)
+    except PayloadDecodeError:
+        raise
+    except (zlib.error, UnicodeDecodeError, ValueError) as e:
+        raise PayloadDecodeError(f"Corrupt frame body: {e}")
+
+    if kind == KIND_BATCH:
+        if not isinstance(body, list):
+            raise PayloadDecodeError("Batch frame body is not a list")
+        return body
+    if kind in (KIND_RECORD, KIND_PACKED):
+        if not isinstance(body, dict):
+            raise PayloadDecodeError("Record frame body is not an object")
+        # Packed records ({"schema_id", "values", ...}) are resolved against the device schema by the receiver
+        return [body]
+    raise PayloadDecodeError(f"Unknown frame kind {kind}")
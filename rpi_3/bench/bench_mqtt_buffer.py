@@ -0,0 +1,72 @@
+# bench_mqtt_buffer.py
+# -*- coding: utf-8 -*-
+"""
+Offline buffer insert benchmark (creates and removes a scratch database in the working directory).
+
+Run from rpi_3:
+    python bench/bench_mqtt_buffer.py [prefill]
+"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mqtt_buffer_sqlite import SQLiteMessageQueue  # noqa: E402
+
+
+def benchmark(prefill=100000, inserts=2000, db_file="mqtt_buffer_bench.db"):
+    """Insert cost with a full buffer of `prefill` messages: COUNT(*)-based trimming vs. rowid range trimming."""
+    payload = {"device_id": "station_1", "timestamp": time.time(),
+               "temperature": {"engine_temp": 41.25}, "current": {"phase_a": 3.217}}
+    payload_str = json.dumps(payload)
+
+    def prefill_db(path):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        queue = SQLiteMessageQueue(path, max_messages=prefill, ram_max_messages=1000, spill_after_sec=60.0)
+        with queue._lock, queue._conn:
+            queue._conn.executemany('INSERT INTO buffered_messages (timestamp, payload) VALUES (?, ?)',
+                                    ((time.time(), payload_str) for _ in range(prefill)))
+            queue._tail_id = queue._conn.execute('SELECT MAX(id) FROM buffered_messages').fetchone()[0]
+            queue._next_id = queue._tail_id + 1
+        return queue
+
+    # Previous approach: COUNT(*) and ORDER BY ... LIMIT subquery after every insert
+    queue = prefill_db(db_file)
+    start = time.perf_counter()
+    for _ in range(inserts):
+        with queue._conn:
+            queue._conn.execute('INSERT INTO buffered_messages (timestamp, payload) VALUES (?, ?)', (time.time(), payload_str))
+            count = queue._conn.execute('SELECT COUNT(*) FROM buffered_messages').fetchone()[0]
+            if count > queue.max_messages:
+                queue._conn.execute(
+                    'DELETE FROM buffered_messages WHERE id IN (SELECT id FROM buffered_messages ORDER BY id ASC LIMIT ?)',
+                    (count - queue.max_messages,))
+    count_based_ms = 1000.0 * (time.perf_counter() - start) / inserts
+    queue.close()
+
+    # Rowid range trimming, one message per transaction (worst case, no batching)
+    queue = prefill_db(db_file)
+    start = time.perf_counter()
+    for _ in range(inserts):
+        queue.put(payload)
+        queue.spill()
+    range_based_ms = 1000.0 * (time.perf_counter() - start) / inserts
+    remaining = queue._conn.execute('SELECT COUNT(*) FROM buffered_messages').fetchone()[0]
+    queue.close()
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_file + suffix):
+            os.remove(db_file + suffix)
+
+    print(f"Buffer of {prefill} messages, {inserts} inserts (one per transaction):")
+    print(f"  COUNT(*) trimming:    {count_based_ms:.3f} ms per insert")
+    print(f"  rowid range trimming: {range_based_ms:.3f} ms per insert ({remaining} messages kept)")
+
+
+if __name__ == "__main__":
+    benchmark(prefill=int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
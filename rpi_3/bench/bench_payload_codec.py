@@ -0,0 +1,51 @@
+# bench_payload_codec.py
+# -*- coding: utf-8 -*-
+"""
+Size and encode/decode time of a typical station payload per wire encoding.
+
+Run from rpi_3:
+    python bench/bench_payload_codec.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import payload_codec  # noqa: E402
+from payload_codec import (encode_record, decode_body, WIRE_JSON, WIRE_MSGPACK,  # noqa: E402
+                           ENCODING_JSON, ENCODING_MSGPACK)
+
+MSGPACK_AVAILABLE = payload_codec.msgpack is not None
+
+
+def benchmark(iterations=2000):
+    """Size and encode/decode time of a typical station payload per wire encoding."""
+    peaks = [{"freq": 12.5 * (i + 1), "amp": 0.0123 * (5 - i)} for i in range(5)]
+    vibration_metrics = {"rms_x": 0.01234, "rms_y": 0.01543, "rms_z": 0.98765, "total_rms": 0.99876,
+                         "peak_to_peak_x": 0.0456, "peak_to_peak_y": 0.0512, "peak_to_peak_z": 0.0823,
+                         "fft_peaks": peaks}
+    payload = {"device_id": "station_1", "timestamp": time.time(),
+               "vibration": {"engine": dict(vibration_metrics), "gearbox": dict(vibration_metrics)},
+               "temperature": {"engine_temp": 41.25, "gearbox_temp": 38.5, "ambient_temp": 22.0},
+               "current": {"phase_a": 3.217, "phase_b": 3.198, "phase_c": 3.224}}
+    formats = [("json", lambda: encode_record(payload, WIRE_JSON), ENCODING_JSON, 0)]
+    if MSGPACK_AVAILABLE:
+        formats.append(("msgpack", lambda: encode_record(payload, WIRE_MSGPACK), ENCODING_MSGPACK, 4))
+    else:
+        print("msgpack not installed, only JSON is measured.")
+    for name, encode, encoding, header_len in formats:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            data = encode()
+        encode_us = 1e6 * (time.perf_counter() - start) / iterations
+        start = time.perf_counter()
+        for _ in range(iterations):
+            decode_body(data[header_len:], encoding)
+        decode_us = 1e6 * (time.perf_counter() - start) / iterations
+        print(f"{name:8s} {len(data):5d} bytes, encode {encode_us:.1f} us, decode {decode_us:.1f} us")
+
+
+if __name__ == "__main__":
+    benchmark()
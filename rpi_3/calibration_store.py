@@ -0,0 +1,117 @@
+# calibration_store.py
+# -*- coding: utf-8 -*-
+"""
+Persisted calibration profiles for MPU6050 and current sensors.
+
+Calibration results are stored in a versioned JSON file, keyed by sensor bus/address
+(and ADC channel for current sensors), each with the time it was measured.
+On start, fresh profiles are reused instead of recalibrating; stale or missing
+profiles (or a forced calibration) trigger a new calibration.
+
+File layout:
+{
+    "version": 1,
+    "profiles": {
+        "mpu6050/bus1/0x68": {"timestamp": 1700000000.0, "data": {"accel_offset": {"x": ..., "y": ..., "z": ...}}},
+        "current/bus1/0x48/ch0": {"timestamp": 1700000000.0, "data": {"offset_v": 1.6502}}
+    }
+}
+"""
+
+import json
+import os
+import time
+import threading
+
+CALIBRATION_FILE = "calibration.json"
+CALIBRATION_FORMAT_VERSION = 1
+DEFAULT_MAX_AGE_HOURS = 168.0  # One week
+
+
+def mpu_profile_key(bus, address):
+    """Profile key for an MPU6050 sensor."""
+    return f"mpu6050/bus{bus}/0x{int(address):02x}"
+
+
+def current_profile_key(bus, address, adc_channel):
+    """Profile key for one ADS1115 current channel."""
+    return f"current/bus{bus}/0x{int(address):02x}/ch{adc_channel}"
+
+
+class CalibrationStore:
+    def __init__(self, filepath=CALIBRATION_FILE, max_age_hours=DEFAULT_MAX_AGE_HOURS):
+        """
+        :param filepath: Path to the calibration profile file.
+        :param max_age_hours: Profiles older than this are considered stale and not reused.
+                              0 or negative disables the age check.
+        """
+        self.filepath = filepath
+        self.max_age_sec = float(max_age_hours) * 3600.0
+        self._profiles = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Loads profiles from file. Unknown versions or broken files are ignored (full recalibration)."""
+        with self._lock:
+            self._profiles = {}
+            if not os.path.exists(self.filepath):
+                print(f"Calibration file '{self.filepath}' not found. Sensors will be calibrated.")
+                return
+            try:
+                with open(self.filepath, 'r') as f:
+                    stored = json.load(f)
+                if stored.get('version') != CALIBRATION_FORMAT_VERSION:
+                    print(f"Calibration file '{self.filepath}' has version {stored.get('version')}, "
+                          f"expected {CALIBRATION_FORMAT_VERSION}. Ignoring stored profiles.")
+                    return
+                self._profiles = stored.get('profiles', {}) or {}
+                print(f"Loaded {len(self._profiles)} calibration profile(s) from {self.filepath}.")
+            except Exception as e:
+                print(f"Error loading calibration file '{self.filepath}': {e}. Ignoring stored profiles.")
+                self._profiles = {}
+
+    def get(self, key):
+        """Returns stored calibration data for key, or None if missing or stale."""
+        with self._lock:
+            profile = self._profiles.get(key)
+        if not profile or 'data' not in profile:
+            return None
+        age_sec = time.time() - float(profile.get('timestamp', 0.0))
+        if self.max_age_sec > 0 and age_sec > self.max_age_sec:
+            print(f"Calibration profile '{key}' is stale ({age_sec / 3600.0:.1f} h old).")
+            return None
+        return profile['data']
+
+    def put(self, key, data):
+        """Stores calibration data for key with the current timestamp (saved on save())."""
+        with self._lock:
+            self._profiles[key] = {"timestamp": time.time(), "data": data}
+            self._dirty = True
+
+    def save(self):
+        """Writes profiles to file atomically if anything changed."""
+        with self._lock:
+            if not self._dirty:
+                return True
+            tmp_path = f"{self.filepath}.tmp"
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump({"version": CALIBRATION_FORMAT_VERSION, "profiles": self._profiles}, f, indent=4)
+                os.replace(tmp_path, self.filepath)
+                self._dirty = False
+                print(f"Calibration profiles saved to {self.filepath}")
+                return True
+            except Exception as e:
+                print(f"Error saving calibration profiles to {self.filepath}: {e}")
+                return False
+
+
+def create_calibration_store(config):
+    """Creates a CalibrationStore from the 'calibration' section of the configuration."""
+    calib_cfg = config.get('calibration', {})
+    return CalibrationStore(
+        filepath=calib_cfg.get('profile_file', CALIBRATION_FILE),
+        max_age_hours=calib_cfg.get('max_age_hours', DEFAULT_MAX_AGE_HOURS)
+    )
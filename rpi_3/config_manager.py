@@ -7,6 +7,9 @@ import traceback
 # --- Configuration File Path ---
 CONFIG_FILE = "config.json"
 
+# --- Timing shared by the publish loop and the I2C probe ---
+MPU_UPDATE_CALL_INTERVAL_SEC = 0.004  # ~4ms (250Hz call rate for update_buffer)
+
 # --- Default Configuration ---
 def get_default_config():
     """Returns a dictionary with default configuration values."""
@@ -16,7 +19,36 @@ def get_default_config():
             "broker": "192.168.0.93",
             "port": 1883,
             "topic": "sensors/data",
-            "qos": 1
+            "protocol": "5", # "5" or "3.1.1"; message expiry of the live class needs MQTT v5
+            "delivery": { # QoS / expiry per message class (see delivery.py); expiry_sec 0 = none
+                "live": {"qos": 0, "expiry_sec": 5}, # Periodic measurements
+                "deadband": {"qos": 1, "expiry_sec": 0}, # Periodic measurements with the deadband on
+                "alarm": {"qos": 1, "expiry_sec": 0}, # Payloads that change an alarm/error state
+                "rollup": {"qos": 1, "expiry_sec": 0}, # Edge rollups
+                "sensor_topic": {"qos": 0, "expiry_sec": 0}, # Retained per-sensor topics
+                "schema": {"qos": 1, "expiry_sec": 0}, # Retained payload schema
+                "replay": {"qos": 1} # Offline buffer backlog
+            },
+            "max_inflight": 0, # In-flight QoS 1 messages (0 = all replay windows + headroom)
+            "keepalive_sec": 15,
+            "reconnect": { # Exponential backoff with full jitter (see mqtt_utils.MqttConnectionManager)
+                "initial_delay_sec": 1.0,
+                "max_delay_sec": 60.0,
+                "multiplier": 2.0,
+                "connect_timeout_sec": 10.0, # Max wait for CONNACK
+                "stable_after_sec": 30.0 # A connection that lasted this long resets the backoff
+            },
+            "encoding": "json", # Live payload format: "json" or compact "msgpack" (needs the msgpack package)
+            "schema": {
+                "enabled": False # Retained schema on <topic>/schema/<device_id>, live data sent as packed value arrays
+            },
+            "sensor_topics": {
+                "enabled": False, # Also publish every sensor on <prefix>/<device_id>/<group>/<sensor> (JSON, retained)
+                "prefix": "sensors",
+                "retain": True, # QoS/expiry: mqtt.delivery.sensor_topic
+                "intervals_sec": {"vibration": 1.0, "temperature": 5.0, "current": 1.0}, # Per-group publish rate
+                "sensor_intervals_sec": {} # Per-sensor overrides, e.g. "engine": 0.5
+            }
         },
         "intervals": {
             "temperature_sec": 5.0,
@@ -31,9 +63,24 @@ def get_default_config():
                 "n_peaks": 5
             },
             "ds18b20": [
-                # Example:
-                # {"name": "engine_temp", "id": "28-000001111111"},
+                # Example ("resolution": 9-12 bit, "alarm_c": level for fast adaptive polling, both optional):
+                # {"name": "engine_temp", "id": "28-000001111111", "resolution": 11, "alarm_c": 80.0},
             ],
+            "ds18b20_settings": {
+                "bulk_read": True, # One conversion for all sensors of a bus via therm_bulk_read
+                "read_workers": 4, # I/O threads for probe reads
+                "read_timeout_sec": 2.0, # Deadline per read; a missed read publishes the cached value
+                "max_stale_age_sec": 60.0, # Cached values older than this are reported as read_timeout
+                "latency_report_interval_sec": 300.0, # Per-probe read latency report, 0 disables
+                "adaptive": { # Poll fast while temperatures change or near alarm_c, back off when stable
+                    "enabled": True,
+                    "min_interval_sec": 1.0,
+                    "max_interval_sec": 30.0,
+                    "change_threshold_c": 0.25,
+                    "backoff_factor": 1.5,
+                    "alarm_margin_c": 5.0
+                }
+            },
              "current": {
                 "adc": {
                    "bus": 1,
@@ -42,15 +89,102 @@ def get_default_config():
                 },
                 "channels": [
                    # {"name": "phase_a", "adc_channel": 0},
+                ],
+                "samples_per_reading": 500, # ADC conversions per channel for one RMS value
+                "adcs": [
+                   # Additional ADS1115 devices, each with its own channels:
+                   # {"bus": 1, "address": "0x49", "gain": 1.0,
+                   #  "channels": [{"name": "motor2_phase_a", "adc_channel": 0}]},
                 ]
              }
         },
+        "i2c": {
+             "report_interval_sec": 60.0, # Bus utilization report per bus/device (0 disables)
+             "probe_on_start": False, # Measure device latency and check configured rates against bus capacity
+             "auto_reduce": False, # Reduce rates of overloaded buses instead of only warning
+             "max_bus_utilization": 0.8,
+             "probe_samples": 100
+        },
+        "startup": {
+             "parallel_init": True, # Initialize/calibrate sensors as concurrent per-device tasks
+             "max_workers": 8,
+             "max_tasks_per_bus": 4 # Concurrent init tasks sharing one I2C bus
+        },
         "calibration": {
              "mpu": True,
-             "current": True
+             "current": True,
+             "profile_file": "calibration.json", # Stored calibration results, reused on start
+             "max_age_hours": 168.0 # Older profiles are considered stale and sensors are recalibrated
+        },
+        "deadband": {
+             "enabled": False, # Send slow values only when they change (see deadband.py); the receiver holds them
+             "heartbeat_sec": 60.0, # Max silence of a filtered sensor
+             "report_interval_sec": 300.0,
+             "groups": {"temperature": {"delta": 0.1}, "current": {"delta": 0.05}}, # Groups without entry are not filtered
+             "sensors": {} # Per-sensor overrides, e.g. "engine_temp": {"delta": 0.2, "heartbeat_sec": 30.0}
+        },
+        "rollups": {
+             "enabled": False, # Publish 1 s / 1 min min/mean/max/count aggregates (see edge_rollups.py)
+             "windows_sec": [1, 60], # Published on <topic>/rollup/<window>s
+             "topic_suffix": "rollup",
+             "buffer_min_window_sec": 60 # Rollups of at least this window are buffered while offline
+        },
+        "alarm_thresholds": {
+             # Alarm levels per sensor ({group: {sensor: value}}, vibration compares total_rms).
+             # Payloads where a sensor enters/leaves alarm or error state are replayed first after an outage.
+             # Example: "vibration": {"engine": 0.5}, "current": {"phase_a": 4.2}
+        },
+        "buffer": {
+             "db_file": "mqtt_buffer.db", # Offline store-and-forward buffer (SQLite, WAL mode)
+             "max_messages": 0, # Message count limit (0 = only the byte budget applies)
+             "max_bytes": 67108864, # Disk budget of the buffer (64 MB); oldest rows are dropped beyond it
+             "compact_threshold": 0.75, # Above this fraction of max_bytes old backlog is compacted into rollups
+             "compaction_window_sec": 60, # Rollup window (min/mean/max) of compacted backlog
+             "compaction_interval_sec": 30.0,
+             "compaction_chunk_rows": 1000, # Raw rows compacted per step
+             "ram_max_messages": 500, # RAM write-behind tier; a full tier is spilled to SQLite in one transaction
+             "spill_after_sec": 30.0, # Outages longer than this are persisted; shorter ones cost no disk I/O
+             "synchronous": "NORMAL", # SQLite synchronous mode: OFF, NORMAL or FULL
+             "replay_page_size": 100, # Buffered messages read per page when the backlog is replayed
+             "storage_encoding": "zlib_json", # Stored payloads: "zlib_json" (compressed blob) or "json" (text)
+             "inflight_window": 20, # Replayed messages awaiting PUBACK; larger windows replay faster
+             "ack_timeout_sec": 10.0, # Unacknowledged replayed messages are resent after this time
+             "replay_batch_size": 50, # Buffered records per replay envelope (1 = one plain JSON message each)
+             "replay_compression": True, # zlib-compress replay envelopes
+             "drain_max_records_per_sec": 100, # Backlog replay rate limit, live traffic counts against it (0 = unlimited)
+             "drain_max_bytes_per_sec": 32768,
+             "flush_check_interval_sec": 1.0 # How often the flush coordinator checks for a backlog
         }
     }
 
+def get_adc_configs(current_config_data):
+    """
+    Returns a list of (adc_cfg, channels_list) pairs for all configured ADS1115 devices.
+    The legacy single 'adc' + 'channels' block comes first (if it has channels),
+    followed by every entry of the 'adcs' list. Channel lists are returned by reference,
+    so calibration results written into them end up in the configuration.
+    """
+    adc_blocks = []
+    if not current_config_data:
+        return adc_blocks
+
+    legacy_adc = current_config_data.get('adc')
+    legacy_channels = current_config_data.get('channels')
+    if legacy_adc and legacy_channels:
+        adc_blocks.append((legacy_adc, legacy_channels))
+
+    for adc_entry in current_config_data.get('adcs', []) or []:
+        if not isinstance(adc_entry, dict):
+            continue
+        adc_entry.setdefault('channels', [])
+        adc_blocks.append((adc_entry, adc_entry['channels']))
+    return adc_blocks
+
+
+def get_all_current_channels(current_config_data):
+    """Returns a flat list of channel configs across all ADS1115 devices."""
+    return [ch for _, channels in get_adc_configs(current_config_data) for ch in channels]
+
 # --- Configuration File Handling ---
 # load_config and save_config остаются без изменений, они достаточно гибки.
 # merge_dicts также можно оставить без изменений, полагаясь на .get() в коде потребителя.
@@ -364,10 +498,12 @@ def configure_calibration_settings(calib_config_data):
         print(f"\nCurrent Calibration Settings:")
         print(f"  Calibrate MPU6050 on start: {'Yes' if calib_mpu else 'No'}")
         print(f"  Calibrate Current Sensors on start: {'Yes' if calib_current else 'No'}")
+        print(f"  Reuse stored calibration profiles younger than: {calib_config_data.get('max_age_hours', 168.0)} h")
 
         print("\nOptions:")
         print("1. Toggle MPU6050 Calibration (on/off)")
         print("2. Toggle Current Sensor Calibration (on/off)")
+        print("3. Set Calibration Profile Max Age (hours, 0 = never stale)")
         print("B. Back to main menu")
 
         choice = input("Enter choice: ").strip().upper()
@@ -378,6 +514,14 @@ def configure_calibration_settings(calib_config_data):
         elif choice == '2':
             calib_config_data['current'] = not calib_current # Toggle
             print(f"Current sensor calibration on start set to: {'Yes' if calib_config_data['current'] else 'No'}")
+        elif choice == '3':
+            try:
+                max_age = float(input("Max profile age in hours: ").strip())
+                if max_age >= 0:
+                    calib_config_data['max_age_hours'] = max_age
+                    print(f"Calibration profile max age set to {max_age} h.")
+                else: print("Max age must be non-negative.")
+            except ValueError: print("Invalid input.")
         elif choice == 'B':
             break
         else:
@@ -427,7 +571,7 @@ def configure_current_channel_offsets(current_config_data):
     """
     Menu to view/edit offsets and scales for each current channel.
     """
-    channels = current_config_data.get('channels', [])
+    channels = get_all_current_channels(current_config_data)
     while True:
         print("\nCurrent channel offsets and scales:")
         for idx, ch in enumerate(channels):
@@ -498,7 +642,7 @@ def manual_calibrate_current_channels(current_config_data):
     For each channel, prompts the user to input the sensor reading (current reported by the system)
     and the actual measured current (from a multimeter). Then, calculates and updates the scale factor.
     """
-    channels = current_config_data.get('channels', [])
+    channels = get_all_current_channels(current_config_data)
     if not channels:
         print("No current sensor channels configured.")
         return
@@ -553,6 +697,7 @@ def configure_current_sensors_menu(current_config_data):
         print("\nOptions:\n1. Set ADC\n2. Add/Edit Channel")
         if channels_list: print("3. Remove Channel")
         print("4. Channel Offsets/Scales Advanced")
+        print(f"5. Additional ADC Devices ({len(current_config_data.get('adcs', []) or [])} configured)")
         print("B. Back to main menu")
         choice = input("Enter choice: ").strip().upper()
 
@@ -588,6 +733,65 @@ def configure_current_sensors_menu(current_config_data):
             except ValueError: print("Invalid input.")
         elif choice == '4':
             configure_current_channel_offsets(current_config_data)
+        elif choice == '5':
+            configure_additional_adcs(current_config_data.setdefault('adcs', []))
+        elif choice == 'B': break
+        else: print("Invalid choice.")
+
+
+def configure_additional_adcs(adc_list):
+    """Menu to configure additional ADS1115 devices and their channels. Modifies adc_list in place."""
+    print("\n--- Configure Additional ADC Devices ---")
+    while True:
+        print("\nAdditional ADS1115 devices:")
+        if not adc_list: print("  No additional ADC devices configured.")
+        for i, adc in enumerate(adc_list):
+            channel_names = ", ".join(f"{ch.get('name')}@{ch.get('adc_channel')}" for ch in adc.get('channels', []))
+            print(f"  {i+1}. Bus={adc.get('bus')}, Address={adc.get('address')}, Gain={adc.get('gain')}, "
+                  f"Channels: {channel_names or 'none'}")
+        print("\nOptions:\n1. Add ADC Device")
+        if adc_list: print("2. Add/Edit Channel on ADC\n3. Remove Channel from ADC\n4. Remove ADC Device")
+        print("B. Back to previous menu")
+        choice = input("Enter choice: ").strip().upper()
+
+        if choice == '1':
+            try:
+                bus = int(input("I2C Bus (default 1): ").strip() or "1")
+                addr = hex(int(input("I2C Address (e.g., 0x49): ").strip(), 0))
+                gain = float(input("Gain (default 1.0): ").strip() or "1.0")
+                if any(int(a.get('address', '0'), 0) == int(addr, 0) and a.get('bus', 1) == bus for a in adc_list):
+                    print("An ADC with this bus/address is already configured.")
+                    continue
+                adc_list.append({"bus": bus, "address": addr, "gain": gain, "channels": []})
+                print("ADC device added.")
+            except ValueError: print("Invalid input for ADC config.")
+        elif choice in ('2', '3', '4') and adc_list:
+            try:
+                idx = int(input("ADC device number: ")) - 1
+                if not (0 <= idx < len(adc_list)): print("Invalid number."); continue
+            except ValueError: print("Invalid input."); continue
+            adc = adc_list[idx]
+            channels = adc.setdefault('channels', [])
+            if choice == '2':
+                name = input("Channel name (e.g., motor2_phase_a): ").strip()
+                adc_idx_str = input("ADC channel index (0-3): ").strip()
+                if name and adc_idx_str:
+                    try:
+                        adc_idx = int(adc_idx_str)
+                        if not (0 <= adc_idx <= 3): print("ADC index out of range."); continue
+                        found_channel = next((ch for ch in channels if ch.get('name') == name), None)
+                        if found_channel: found_channel['adc_channel'] = adc_idx; print(f"Channel '{name}' updated.")
+                        else: channels.append({"name": name, "adc_channel": adc_idx}); print(f"Channel '{name}' added.")
+                    except ValueError: print("Invalid ADC index.")
+                else: print("Name and ADC index required.")
+            elif choice == '3':
+                try:
+                    ch_idx = int(input("Channel number to remove (1-based): ")) - 1
+                    if 0 <= ch_idx < len(channels): channels.pop(ch_idx); print("Channel removed.")
+                    else: print("Invalid number.")
+                except ValueError: print("Invalid input.")
+            else:
+                adc_list.pop(idx); print("ADC device removed.")
         elif choice == 'B': break
         else: print("Invalid choice.")
 
@@ -0,0 +1,139 @@
+# deadband.py
+# -*- coding: utf-8 -*-
+"""
+Deadband / heartbeat filter for outgoing payloads.
+
+A sensor entry is only sent when it moved by more than its deadband since the value that was
+last sent, or when it was not sent for heartbeat_sec. Between those, the receiver holds the
+last value. Error entries and "general" entries always pass, and so does every sensor of a
+payload that changes the alarm/error state (force=True), so events are never filtered.
+filter() only decides; the caller commits what was actually published or buffered (commit()),
+so a rejected publish does not hold a changed value back until the heartbeat.
+
+Config ("deadband" section):
+{
+    "enabled": true,
+    "heartbeat_sec": 60.0,                   # Max silence of a filtered sensor
+    "groups": {                              # Groups without an entry are not filtered
+        "temperature": {"delta": 0.1},
+        "current": {"delta": 0.05},
+        "vibration": {"delta": 0.002, "fields": {"total_rms": 0.001}}   # Per-field deltas
+    },
+    "sensors": {"engine_temp": {"delta": 0.2, "heartbeat_sec": 30.0}}  # Per-sensor overrides
+}
+A vibration entry is sent whole when any of its scalar fields moved by more than its delta.
+"""
+
+import math
+import time
+
+FILTERED_GROUPS = ("vibration", "temperature", "current")
+DEFAULT_HEARTBEAT_SEC = 60.0
+DEFAULT_REPORT_INTERVAL_SEC = 300.0
+IGNORED_FIELDS = ("age_sec",)  # Grows on its own while a value is stale
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+class DeadbandFilter:
+    def __init__(self, config):
+        deadband_config = config.get('deadband', {})
+        self.heartbeat_sec = float(deadband_config.get('heartbeat_sec', DEFAULT_HEARTBEAT_SEC))
+        self.groups = deadband_config.get('groups', {})
+        self.sensors = deadband_config.get('sensors', {})
+        self.report_interval_sec = deadband_config.get('report_interval_sec', DEFAULT_REPORT_INTERVAL_SEC)
+        self._last_sent = {}  # (group, sensor) -> (time, entry)
+        self._sent = 0
+        self._suppressed = 0
+        self._report_time = time.time()
+
+    def _settings(self, group, sensor):
+        """(delta, field_deltas, heartbeat_sec) of a sensor, or None if it is not filtered."""
+        group_settings = self.groups.get(group)
+        sensor_settings = self.sensors.get(sensor, {})
+        if group_settings is None and not sensor_settings:
+            return None
+        settings = dict(group_settings or {})
+        settings.update(sensor_settings)
+        return (float(settings.get('delta', 0.0)), settings.get('fields', {}),
+                float(settings.get('heartbeat_sec', self.heartbeat_sec)))
+
+    @staticmethod
+    def _changed(previous, entry, delta, field_deltas):
+        if _is_number(entry) and _is_number(previous):
+            return abs(entry - previous) > delta
+        if isinstance(entry, dict) and isinstance(previous, dict):
+            for field, value in entry.items():
+                if field in IGNORED_FIELDS:
+                    continue
+                previous_value = previous.get(field)
+                if _is_number(value) and _is_number(previous_value):
+                    if abs(value - previous_value) > field_deltas.get(field, delta):
+                        return True
+                elif not isinstance(value, list) and value != previous_value:
+                    return True  # State/flag changed (lists such as FFT peaks are not compared)
+            return False
+        return entry != previous
+
+    def filter(self, payload, now=None, force=False):
+        """
+        Returns a copy of payload without the sensor entries that are inside their deadband,
+        or None if nothing is left to send.
+        :param force: Send every entry (alarm/error state change); commit() restarts the deadbands from it.
+        """
+        now = time.time() if now is None else now
+        filtered = dict(payload)
+        remaining = 0
+        for group in FILTERED_GROUPS:
+            group_data = payload.get(group)
+            if not isinstance(group_data, dict):
+                continue
+            kept = {}
+            for sensor, entry in group_data.items():
+                settings = self._settings(group, sensor)
+                send = force or settings is None or sensor == "general" or \
+                    (isinstance(entry, dict) and "error" in entry)
+                if not send:
+                    delta, field_deltas, heartbeat_sec = settings
+                    last = self._last_sent.get((group, sensor))
+                    send = last is None or now - last[0] >= heartbeat_sec or \
+                        self._changed(last[1], entry, delta, field_deltas)
+                if send:
+                    kept[sensor] = entry
+                    self._sent += 1
+                else:
+                    self._suppressed += 1
+            filtered[group] = kept
+            remaining += len(kept)
+        self._maybe_report(now)
+        return filtered if remaining else None
+
+    def commit(self, filtered, now=None):
+        """Records the entries of a filtered payload as delivered (published or buffered)."""
+        now = time.time() if now is None else now
+        for group in FILTERED_GROUPS:
+            group_data = filtered.get(group)
+            if not isinstance(group_data, dict):
+                continue
+            for sensor, entry in group_data.items():
+                self._last_sent[(group, sensor)] = (now, entry)
+
+    def _maybe_report(self, now):
+        if not self.report_interval_sec or now - self._report_time < self.report_interval_sec:
+            return
+        total = self._sent + self._suppressed
+        if total:
+            print(f"Deadband: sent {self._sent} of {total} sensor values "
+                  f"({100.0 * self._suppressed / total:.1f}% suppressed) in the last {now - self._report_time:.0f} s")
+        self._sent = 0
+        self._suppressed = 0
+        self._report_time = now
+
+
+def create_deadband_filter(config):
+    """Returns a DeadbandFilter, or None if deadband.enabled is not set."""
+    if not config.get('deadband', {}).get('enabled', False):
+        return None
+    return DeadbandFilter(config)
@@ -0,0 +1,109 @@
+# delivery.py
+# -*- coding: utf-8 -*-
+"""
+Delivery classes: QoS and MQTT v5 message expiry per message type.
+
+    live          Periodic measurements. QoS 0 with a short expiry: a lost sample is replaced
+                  by the next one a third of a second later, and a late one is worth nothing.
+    deadband      Live payloads while the deadband filter is on (deadband.py). QoS 1: a changed
+                  value is sent only once, a lost message would hide it until the heartbeat.
+    alarm         Live payloads that change an alarm/error state. QoS 1.
+    rollup        Edge rollups (edge_rollups.py). QoS 1.
+    sensor_topic  Retained per-sensor topics (sensor_topics.py). QoS 0 without expiry: the
+                  retained value is the current state and is refreshed at the sensor's rate.
+    schema        Retained payload schema (payload_schema.py). QoS 1: packed records are
+                  dropped by the receiver until it has the schema.
+    replay        Offline buffer backlog. QoS 1, confirmed through the replay windows.
+
+Config ("mqtt" section):
+{
+    "protocol": "5",               # "5" or "3.1.1"; expiry needs MQTT v5 and is ignored on 3.1.1
+    "max_inflight": 0,             # paho in-flight QoS 1 messages (0 = all replay windows + headroom)
+    "delivery": {
+        "live": {"qos": 0, "expiry_sec": 5},
+        "deadband": {"qos": 1, "expiry_sec": 0},
+        "alarm": {"qos": 1, "expiry_sec": 0},   # 0 = no expiry
+        "rollup": {"qos": 1, "expiry_sec": 0},
+        "sensor_topic": {"qos": 0, "expiry_sec": 0},
+        "schema": {"qos": 1, "expiry_sec": 0},
+        "replay": {"qos": 1}
+    }
+}
+"""
+
+try:
+    from paho.mqtt.properties import Properties
+    from paho.mqtt.packettypes import PacketTypes
+    MQTT5_PROPERTIES_AVAILABLE = True
+except ImportError:
+    MQTT5_PROPERTIES_AVAILABLE = False
+
+from mqtt_buffer_sqlite import LANES, INFLIGHT_WINDOW
+
+DELIVERY_LIVE = "live"
+DELIVERY_DEADBAND = "deadband"
+DELIVERY_ALARM = "alarm"
+DELIVERY_ROLLUP = "rollup"
+DELIVERY_SENSOR_TOPIC = "sensor_topic"
+DELIVERY_SCHEMA = "schema"
+DELIVERY_REPLAY = "replay"
+
+DEFAULT_DELIVERY_CLASSES = {
+    DELIVERY_LIVE: {"qos": 0, "expiry_sec": 5},
+    DELIVERY_DEADBAND: {"qos": 1, "expiry_sec": 0},
+    DELIVERY_ALARM: {"qos": 1, "expiry_sec": 0},
+    DELIVERY_ROLLUP: {"qos": 1, "expiry_sec": 0},
+    DELIVERY_SENSOR_TOPIC: {"qos": 0, "expiry_sec": 0},
+    DELIVERY_SCHEMA: {"qos": 1, "expiry_sec": 0},
+    DELIVERY_REPLAY: {"qos": 1, "expiry_sec": 0},
+}
+DEFAULT_PROTOCOL = "5"
+INFLIGHT_HEADROOM = 10  # In-flight slots for alarms and rollups besides the replay windows
+
+
+def is_mqtt5(config):
+    return str(config.get('mqtt', {}).get('protocol', DEFAULT_PROTOCOL)) == "5"
+
+
+def max_inflight_from_config(config):
+    """
+    paho's in-flight limit for QoS 1 messages. Replayed messages beyond it would wait in paho's
+    queue while their ack timeout runs, so by default every lane's replay window fits.
+    """
+    max_inflight = config.get('mqtt', {}).get('max_inflight', 0)
+    if max_inflight:
+        return int(max_inflight)
+    window = config.get('buffer', {}).get('inflight_window', INFLIGHT_WINDOW)
+    return len(LANES) * max(int(window), 1) + INFLIGHT_HEADROOM
+
+
+class DeliveryClass:
+    def __init__(self, name, qos, expiry_sec=0, mqtt5=False):
+        self.name = name
+        self.qos = int(qos)
+        self.expiry_sec = int(expiry_sec or 0)
+        self.properties = None
+        if mqtt5 and self.expiry_sec > 0 and MQTT5_PROPERTIES_AVAILABLE:
+            self.properties = Properties(PacketTypes.PUBLISH)
+            self.properties.MessageExpiryInterval = self.expiry_sec
+
+    def publish(self, mqtt_client, topic, data, retain=False):
+        """Publishes with the QoS (and expiry) of this class. :return: paho MQTTMessageInfo."""
+        if self.properties is not None:
+            return mqtt_client.publish(topic, data, qos=self.qos, retain=retain, properties=self.properties)
+        return mqtt_client.publish(topic, data, qos=self.qos, retain=retain)
+
+
+class DeliveryClasses:
+    """The delivery classes of the config (defaults for classes without an entry)."""
+    def __init__(self, config):
+        mqtt5 = is_mqtt5(config)
+        delivery_config = config.get('mqtt', {}).get('delivery', {})
+        self.classes = {}
+        for name, defaults in DEFAULT_DELIVERY_CLASSES.items():
+            settings = dict(defaults)
+            settings.update(delivery_config.get(name, {}))
+            self.classes[name] = DeliveryClass(name, settings['qos'], settings['expiry_sec'], mqtt5)
+
+    def get(self, name):
+        return self.classes[name]
@@ -0,0 +1,95 @@
+# edge_rollups.py
+# -*- coding: utf-8 -*-
+"""
+Edge-side rollups for long-term trending.
+
+Every payload of the publish loop (before deadband filtering) is fed into one streaming
+RollupAccumulator per window (default 1 s and 60 s). When a payload falls into the next
+window, the finished rollup record (rollup.py format: min/mean/max/count of every scalar
+metric) is published on <topic>/rollup/<window>s, e.g. sensors/data/rollup/60s, with the
+"rollup" delivery class (QoS 1, see delivery.py).
+Central storage can keep these long-term and raw data only briefly.
+
+While the broker is unreachable, rollups of windows >= buffer_min_window_sec go into the
+offline buffer as rollup rows (KIND_ROLLUP), which backlog compaction never merges with the raw
+rows they summarise (they are replayed on the main topic; the receiver stores rollup records
+wherever they arrive). Shorter rollups are dropped then, since the raw data is buffered anyway.
+"""
+
+from mqtt_buffer_sqlite import buffer_message, LANE_HISTORY, KIND_ROLLUP
+from delivery import DeliveryClasses, DELIVERY_ROLLUP
+from payload_codec import encode_record, wire_format_from_config
+from rollup import RollupAccumulator, window_start
+
+DEFAULT_WINDOWS_SEC = (1, 60)
+DEFAULT_TOPIC_SUFFIX = "rollup"
+DEFAULT_BUFFER_MIN_WINDOW_SEC = 60
+
+
+def rollup_topic(mqtt_topic, suffix, window_sec):
+    return f"{mqtt_topic}/{suffix}/{window_sec:g}s"
+
+
+class EdgeRollups:
+    def __init__(self, config):
+        rollup_config = config.get('rollups', {})
+        mqtt_config = config.get('mqtt', {})
+        self.device_id = config.get('device_id', 'unknown_device')
+        self.windows_sec = sorted(rollup_config.get('windows_sec', DEFAULT_WINDOWS_SEC))
+        self.delivery = DeliveryClasses(config).get(DELIVERY_ROLLUP)
+        self.buffer_min_window_sec = rollup_config.get('buffer_min_window_sec', DEFAULT_BUFFER_MIN_WINDOW_SEC)
+        self.wire_format = wire_format_from_config(config)
+        suffix = rollup_config.get('topic_suffix', DEFAULT_TOPIC_SUFFIX)
+        self.topics = {window_sec: rollup_topic(mqtt_config.get('topic', 'sensors/data'), suffix, window_sec)
+                       for window_sec in self.windows_sec}
+        self._accumulators = {}  # window_sec -> RollupAccumulator of the current window
+
+    def add(self, payload):
+        """
+        Adds a raw payload record.
+        :return: List of (window_sec, rollup record) for the windows that were completed.
+        """
+        timestamp = payload.get("timestamp")
+        if timestamp is None:
+            return []
+        completed = []
+        for window_sec in self.windows_sec:
+            start = window_start(timestamp, window_sec)
+            accumulator = self._accumulators.get(window_sec)
+            if accumulator is not None and accumulator.window_start != start:
+                if not accumulator.is_empty():
+                    completed.append((window_sec, accumulator.to_record()))
+                accumulator = None
+            if accumulator is None:
+                accumulator = RollupAccumulator(self.device_id, start, window_sec)
+                self._accumulators[window_sec] = accumulator
+            accumulator.add(payload)
+        return completed
+
+    def process(self, payload, mqtt_client, is_connected_func):
+        """
+        Adds a payload and publishes (or buffers) the completed rollups.
+        :return: Number of bytes published.
+        """
+        published_bytes = 0
+        for window_sec, record in self.add(payload):
+            try:
+                if is_connected_func():
+                    data = encode_record(record, self.wire_format)
+                    info = self.delivery.publish(mqtt_client, self.topics[window_sec], data)
+                    if getattr(info, 'rc', 0) != 0:
+                        raise RuntimeError(f"publish rejected (rc {info.rc})")
+                    published_bytes += len(data)
+                    continue
+            except Exception as e:
+                print(f"Error publishing {window_sec:g} s rollup: {e}")
+            if window_sec >= self.buffer_min_window_sec:
+                buffer_message(record, LANE_HISTORY, KIND_ROLLUP)
+        return published_bytes
+
+
+def create_edge_rollups(config):
+    """Returns EdgeRollups, or None if rollups.enabled is not set."""
+    if not config.get('rollups', {}).get('enabled', False):
+        return None
+    return EdgeRollups(config)
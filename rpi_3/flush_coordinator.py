@@ -0,0 +1,141 @@
+# flush_coordinator.py
+# -*- coding: utf-8 -*-
+"""
+Single owner of the offline-buffer replay.
+
+One thread replays the buffer lanes while the broker is connected. The history backlog is
+drained at a configured rate (records/s and bytes/s) so replay never saturates the uplink.
+Live publishes are charged to the same budget without ever waiting: they push the buckets
+into debt, and replay only gets what is left over.
+"""
+
+import threading
+import time
+
+from delivery import DeliveryClasses, DELIVERY_REPLAY
+from mqtt_buffer_sqlite import flush_if_connected
+
+DEFAULT_DRAIN_MAX_RECORDS_PER_SEC = 100
+DEFAULT_DRAIN_MAX_BYTES_PER_SEC = 32768
+DEFAULT_FLUSH_CHECK_INTERVAL_SEC = 1.0
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at rate tokens/s up to burst tokens. A rate of 0 means unlimited.
+    consume() never blocks and may push the balance below zero (down to -burst), so a caller
+    with precedence is always served and the debt is paid by the blocking acquire() callers.
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate or 0)
+        self.burst = float(burst if burst is not None else self.rate)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def unlimited(self):
+        return self.rate <= 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def consume(self, amount):
+        """Takes amount tokens without waiting."""
+        if self.unlimited:
+            return
+        with self._lock:
+            self._refill()
+            self._tokens = max(-self.burst, self._tokens - amount)
+
+    def wait_time(self, amount):
+        """Seconds until amount tokens are available (0 if they are available now)."""
+        if self.unlimited:
+            return 0.0
+        with self._lock:
+            self._refill()
+            # A request larger than the burst is served once the bucket is full
+            needed = min(amount, self.burst) - self._tokens
+            return max(0.0, needed / self.rate)
+
+
+class DrainRateLimiter:
+    """Records/s and bytes/s limit of the backlog replay. Passed to ReplayWindow.flush()."""
+    def __init__(self, max_records_per_sec, max_bytes_per_sec, stop_event=None):
+        # One second worth of burst: a full envelope may go out right after an idle period
+        self.records = TokenBucket(max_records_per_sec)
+        self.bytes = TokenBucket(max_bytes_per_sec)
+        self.stop_event = stop_event
+
+    def charge_live(self, nbytes, records=1):
+        """Live traffic: accounted against the budget, never delayed."""
+        self.records.consume(records)
+        self.bytes.consume(nbytes)
+
+    def acquire(self, records, nbytes):
+        """
+        Waits until an envelope of records/nbytes fits into the budget and takes it.
+        :return: False if the stop event was set while waiting.
+        """
+        while True:
+            delay = max(self.records.wait_time(records), self.bytes.wait_time(nbytes))
+            if delay <= 0:
+                break
+            if self.stop_event is not None:
+                if self.stop_event.wait(min(delay, 0.5)):
+                    return False
+            else:
+                time.sleep(min(delay, 0.5))
+        self.records.consume(records)
+        self.bytes.consume(nbytes)
+        return True
+
+
+class FlushCoordinator:
+    """Replays the offline buffer from one thread, rate limited behind live traffic."""
+    def __init__(self, mqtt_client, config, is_connected_func, stop_event, led_indicator=None):
+        """
+        :param mqtt_client: Connected paho client.
+        :param config: Application config ('mqtt' and 'buffer' sections are used).
+        :param is_connected_func: Callable returning the MQTT connection state.
+        :param stop_event: Event that stops the coordinator thread.
+        """
+        mqtt_config = config.get('mqtt', {})
+        buffer_config = config.get('buffer', {})
+        self.mqtt_client = mqtt_client
+        self.topic = mqtt_config.get('topic', 'sensors/data')
+        self.qos = DeliveryClasses(config).get(DELIVERY_REPLAY).qos
+        self.is_connected_func = is_connected_func
+        self.stop_event = stop_event
+        self.led_indicator = led_indicator
+        self.check_interval_sec = buffer_config.get('flush_check_interval_sec', DEFAULT_FLUSH_CHECK_INTERVAL_SEC)
+        self.rate_limiter = DrainRateLimiter(
+            buffer_config.get('drain_max_records_per_sec', DEFAULT_DRAIN_MAX_RECORDS_PER_SEC),
+            buffer_config.get('drain_max_bytes_per_sec', DEFAULT_DRAIN_MAX_BYTES_PER_SEC),
+            stop_event
+        )
+        self._wakeup = threading.Event()
+
+    def on_live_publish(self, nbytes):
+        """Called after every live publish; charges it to the drain budget."""
+        self.rate_limiter.charge_live(nbytes)
+
+    def trigger(self):
+        """Requests a flush attempt now (e.g. right after the connection came back)."""
+        self._wakeup.set()
+
+    def run(self):
+        """Thread function."""
+        print("Buffer flush coordinator thread started.")
+        while not self.stop_event.is_set():
+            try:
+                flush_if_connected(self.mqtt_client, self.topic, self.qos, self.is_connected_func,
+                                   self.led_indicator, history_rate_limiter=self.rate_limiter,
+                                   should_stop=self.stop_event.is_set)
+            except Exception as e:
+                print(f"Flush coordinator error: {e}")
+            self._wakeup.wait(self.check_interval_sec)
+            self._wakeup.clear()
+        print("Buffer flush coordinator thread stopped.")
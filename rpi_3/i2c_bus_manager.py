@@ -0,0 +1,297 @@
+# i2c_bus_manager.py
+# -*- coding: utf-8 -*-
+"""
+I2C bus arbitration shared by the MPU6050 and ADS1115 drivers.
+
+The manager owns one smbus2.SMBus handle per bus number. Every transaction goes through
+a per-bus priority lock, so a waiting vibration read is served before a waiting current
+(ADC) read, which is served before temperature. Bus time is accounted per device, which
+gives a utilization report per bus and device.
+
+The ADS1115 driver (Adafruit) expects a busio.I2C object; BusioI2CAdapter provides that
+interface on top of the managed SMBus handle, so both drivers share the same handle and lock.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import smbus2
+except ImportError:
+    smbus2 = None
+    print("smbus2 not found. I2C bus manager disabled.")
+
+# Transaction priorities (lower value is served first)
+PRIORITY_VIBRATION = 0
+PRIORITY_CURRENT = 1
+PRIORITY_TEMPERATURE = 2
+PRIORITY_DEFAULT = PRIORITY_TEMPERATURE
+
+
+class PriorityBusLock:
+    """Mutex that grants the lock to the waiting thread with the lowest priority value (FIFO within one priority)."""
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._busy = False
+        self._waiting = []  # heap of (priority, sequence)
+        self._sequence = itertools.count()
+
+    def acquire(self, priority=PRIORITY_DEFAULT):
+        with self._cond:
+            entry = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, entry)
+            while self._busy or self._waiting[0] != entry:
+                self._cond.wait()
+            heapq.heappop(self._waiting)
+            self._busy = True
+
+    def release(self):
+        with self._cond:
+            self._busy = False
+            self._cond.notify_all()
+
+
+class _DeviceStats:
+    __slots__ = ('name', 'priority', 'transactions', 'busy_sec', 'wait_sec', 'max_wait_sec')
+
+    def __init__(self, name, priority):
+        self.name = name
+        self.priority = priority
+        self.reset()
+
+    def reset(self):
+        self.transactions = 0
+        self.busy_sec = 0.0
+        self.wait_sec = 0.0
+        self.max_wait_sec = 0.0
+
+
+class _ManagedBus:
+    """State of one I2C bus: shared handle, priority lock and per-device statistics."""
+    def __init__(self, bus_num):
+        self.bus_num = bus_num
+        self.lock = PriorityBusLock()
+        self.handle = None
+        self.devices = {}  # address -> _DeviceStats
+        self.stats_lock = threading.Lock()
+        self.window_start = time.time()
+
+
+class I2CBusManager:
+    def __init__(self):
+        self._buses = {}
+        self._lock = threading.Lock()
+
+    def _get_bus(self, bus_num):
+        with self._lock:
+            managed_bus = self._buses.get(bus_num)
+            if managed_bus is None:
+                managed_bus = _ManagedBus(bus_num)
+                self._buses[bus_num] = managed_bus
+            return managed_bus
+
+    def get_smbus(self, bus_num):
+        """Returns the shared smbus2.SMBus handle for bus_num, opening it on first use."""
+        if smbus2 is None:
+            raise RuntimeError("smbus2 is not available")
+        managed_bus = self._get_bus(bus_num)
+        with self._lock:
+            if managed_bus.handle is None:
+                managed_bus.handle = smbus2.SMBus(bus_num)
+                print(f"I2C bus manager: opened bus {bus_num}.")
+            return managed_bus.handle
+
+    def register_device(self, bus_num, address, name=None, priority=PRIORITY_DEFAULT):
+        """Registers a device so its transactions use the given priority and name in reports."""
+        managed_bus = self._get_bus(bus_num)
+        with managed_bus.stats_lock:
+            stats = managed_bus.devices.get(address)
+            if stats is None:
+                managed_bus.devices[address] = _DeviceStats(name or f"0x{address:02x}", priority)
+            else:
+                stats.name = name or stats.name
+                stats.priority = priority
+
+    def get_device_priority(self, bus_num, address):
+        managed_bus = self._get_bus(bus_num)
+        stats = managed_bus.devices.get(address)
+        return stats.priority if stats else PRIORITY_DEFAULT
+
+    @contextmanager
+    def transaction(self, bus_num, address, priority=None):
+        """
+        Context manager holding the bus for one transaction of the device at address.
+        Yields the shared SMBus handle (None if smbus2 is unavailable).
+        """
+        managed_bus = self._get_bus(bus_num)
+        if priority is None:
+            priority = self.get_device_priority(bus_num, address)
+        handle = self.get_smbus(bus_num) if smbus2 is not None else None
+
+        wait_start = time.perf_counter()
+        managed_bus.lock.acquire(priority)
+        busy_start = time.perf_counter()
+        try:
+            yield handle
+        finally:
+            busy_end = time.perf_counter()
+            managed_bus.lock.release()
+            self._account(managed_bus, address, priority, busy_start - wait_start, busy_end - busy_start)
+
+    def _account(self, managed_bus, address, priority, wait_sec, busy_sec):
+        with managed_bus.stats_lock:
+            stats = managed_bus.devices.get(address)
+            if stats is None:
+                stats = _DeviceStats(f"0x{address:02x}", priority)
+                managed_bus.devices[address] = stats
+            stats.transactions += 1
+            stats.busy_sec += busy_sec
+            stats.wait_sec += wait_sec
+            if wait_sec > stats.max_wait_sec:
+                stats.max_wait_sec = wait_sec
+
+    def get_utilization(self, reset=False):
+        """
+        Returns bus utilization since the last reset:
+        {bus_num: {"window_sec", "utilization", "devices": {name: {"address", "priority", "transactions",
+         "transactions_per_sec", "busy_sec", "utilization", "avg_wait_ms", "max_wait_ms"}}}}
+        """
+        report = {}
+        now = time.time()
+        with self._lock:
+            buses = list(self._buses.values())
+        for managed_bus in buses:
+            with managed_bus.stats_lock:
+                window_sec = max(now - managed_bus.window_start, 1e-6)
+                devices_report = {}
+                total_busy = 0.0
+                for address, stats in managed_bus.devices.items():
+                    total_busy += stats.busy_sec
+                    devices_report[stats.name] = {
+                        "address": f"0x{address:02x}",
+                        "priority": stats.priority,
+                        "transactions": stats.transactions,
+                        "transactions_per_sec": round(stats.transactions / window_sec, 1),
+                        "busy_sec": round(stats.busy_sec, 3),
+                        "utilization": round(stats.busy_sec / window_sec, 4),
+                        "avg_wait_ms": round(1000.0 * stats.wait_sec / stats.transactions, 3) if stats.transactions else 0.0,
+                        "max_wait_ms": round(1000.0 * stats.max_wait_sec, 3)
+                    }
+                    if reset:
+                        stats.reset()
+                report[managed_bus.bus_num] = {
+                    "window_sec": round(window_sec, 1),
+                    "utilization": round(total_busy / window_sec, 4),
+                    "devices": devices_report
+                }
+                if reset:
+                    managed_bus.window_start = now
+        return report
+
+    def print_utilization_report(self, reset=True):
+        for bus_num, bus_report in self.get_utilization(reset=reset).items():
+            print(f"I2C bus {bus_num}: {100.0 * bus_report['utilization']:.1f}% busy over {bus_report['window_sec']} s")
+            for name, dev in bus_report['devices'].items():
+                print(f"  {name} ({dev['address']}, prio {dev['priority']}): {dev['transactions_per_sec']} tr/s, "
+                      f"{100.0 * dev['utilization']:.1f}% busy, wait avg {dev['avg_wait_ms']} ms / max {dev['max_wait_ms']} ms")
+
+    def get_busio_adapter(self, bus_num):
+        """Returns a busio.I2C-compatible object backed by the managed handle of bus_num."""
+        return BusioI2CAdapter(self, bus_num)
+
+    def close(self):
+        with self._lock:
+            for managed_bus in self._buses.values():
+                if managed_bus.handle is not None:
+                    try:
+                        managed_bus.handle.close()
+                    except Exception as e:
+                        print(f"Error closing I2C bus {managed_bus.bus_num}: {e}")
+                    managed_bus.handle = None
+
+
+class BusioI2CAdapter:
+    """
+    Minimal busio.I2C interface (as used by adafruit_bus_device.I2CDevice) on top of the
+    manager's shared SMBus handle. Each call is one arbitrated transaction, attributed to the
+    device address it targets.
+    """
+    def __init__(self, manager, bus_num):
+        self._manager = manager
+        self._bus_num = bus_num
+        self._lock = threading.Lock()
+
+    # Locking is done per transaction by the manager; these only satisfy the busio protocol.
+    def try_lock(self):
+        return self._lock.acquire(blocking=False)
+
+    def unlock(self):
+        self._lock.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.deinit()
+
+    def deinit(self):
+        pass
+
+    def scan(self):
+        found = []
+        for address in range(0x03, 0x78):
+            try:
+                with self._manager.transaction(self._bus_num, address) as handle:
+                    handle.read_byte(address)
+                found.append(address)
+            except OSError:
+                pass
+        return found
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        data = bytes(buffer[start:end])
+        with self._manager.transaction(self._bus_num, address) as handle:
+            handle.i2c_rdwr(smbus2.i2c_msg.write(address, data))
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        end = len(buffer) if end is None else end
+        read_msg = smbus2.i2c_msg.read(address, end - start)
+        with self._manager.transaction(self._bus_num, address) as handle:
+            handle.i2c_rdwr(read_msg)
+        buffer[start:end] = bytes(read_msg)
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *, out_start=0, out_end=None, in_start=0, in_end=None):
+        in_end = len(buffer_in) if in_end is None else in_end
+        write_msg = smbus2.i2c_msg.write(address, bytes(buffer_out[out_start:out_end]))
+        read_msg = smbus2.i2c_msg.read(address, in_end - in_start)
+        with self._manager.transaction(self._bus_num, address) as handle:
+            handle.i2c_rdwr(write_msg, read_msg)  # Repeated start, one transaction
+        buffer_in[in_start:in_end] = bytes(read_msg)
+
+
+_bus_manager = None
+_bus_manager_lock = threading.Lock()
+
+
+def get_bus_manager():
+    """Returns the process-wide I2CBusManager, or None if smbus2 is not available."""
+    global _bus_manager
+    if smbus2 is None:
+        return None
+    with _bus_manager_lock:
+        if _bus_manager is None:
+            _bus_manager = I2CBusManager()
+        return _bus_manager
+
+
+def bus_utilization_report_loop(stop_event, interval_sec=60.0):
+    """Thread function printing the I2C utilization report every interval_sec."""
+    print("I2C utilization report thread started.")
+    while not stop_event.wait(interval_sec):
+        manager = get_bus_manager()
+        if manager:
+            manager.print_utilization_report(reset=True)
+    print("I2C utilization report thread stopped.")
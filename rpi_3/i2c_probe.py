@@ -0,0 +1,270 @@
+# i2c_probe.py
+# -*- coding: utf-8 -*-
+"""
+Startup I2C throughput probe and sample-rate planner.
+
+Measures the real transaction latency and achievable reads per second of every configured
+I2C device (MPU6050 accelerometer block reads, ADS1115 single-shot conversions), compares
+the bus time needed by the configured sample rates with the bus capacity, and warns about
+(or automatically reduces) configurations that cannot be sustained.
+
+Run on its own:
+    python3 i2c_probe.py --config config.json [--apply] [--save]
+or from mqtt_sender.py with --probe (or "i2c": {"probe_on_start": true} in config.json).
+"""
+
+import argparse
+import time
+import traceback
+
+from config_manager import load_config, save_config, get_adc_configs, MPU_UPDATE_CALL_INTERVAL_SEC
+from i2c_bus_manager import get_bus_manager, PRIORITY_VIBRATION
+
+try:
+    from sensors.current_sensors import init_adc, AnalogIn, DEFAULT_RMS_SAMPLES
+except ImportError:
+    init_adc = None
+    AnalogIn = None
+    DEFAULT_RMS_SAMPLES = 500
+
+# Fraction of bus time the configured load may use; the rest is headroom for jitter and retries
+DEFAULT_MAX_BUS_UTILIZATION = 0.8
+DEFAULT_PROBE_SAMPLES = 100
+# Above this rate single-sample polling of the MPU6050 is wasteful, its FIFO should be read in bursts
+MPU_FIFO_SUGGEST_RATE_HZ = 200.0
+
+
+def _time_reads(read_func, samples):
+    """Runs read_func samples times, returns average latency in seconds (None if every read failed)."""
+    durations = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        try:
+            read_func()
+        except Exception:
+            continue
+        durations.append(time.perf_counter() - start)
+    if not durations:
+        return None
+    return sum(durations) / len(durations)
+
+
+def probe_mpu(bus_manager, bus, address, samples=DEFAULT_PROBE_SAMPLES):
+    """Measures the latency of one accelerometer block read (what update_buffer() does per sample)."""
+    handle = bus_manager.get_smbus(bus)
+
+    def read_block():
+        with bus_manager.transaction(bus, address, PRIORITY_VIBRATION):
+            handle.read_i2c_block_data(address, 0x3B, 6)
+    return _time_reads(read_block, samples)
+
+
+def probe_adc(adc_cfg, samples=DEFAULT_PROBE_SAMPLES):
+    """Measures the latency of one single-shot conversion (what read_rms() does per sample)."""
+    if init_adc is None or AnalogIn is None:
+        return None
+    adc_instance = init_adc(adc_cfg)
+    if adc_instance is None:
+        return None
+    channel = AnalogIn(adc_instance, 0)
+    return _time_reads(lambda: channel.voltage, samples)
+
+
+def _collect_devices(config):
+    """Returns the list of configured I2C devices with their requested read rates (reads/s)."""
+    devices = []
+    sensors_cfg = config.get('sensors', {})
+    mpu_rate_limit = 1.0 / MPU_UPDATE_CALL_INTERVAL_SEC  # update_buffer() is called at most this often
+
+    for mpu_cfg in sensors_cfg.get('mpu6050', []):
+        if not mpu_cfg.get('address'):
+            continue
+        requested_hz = float(mpu_cfg.get('sample_rate_hz', 100.0))
+        devices.append({
+            "kind": "mpu6050",
+            "name": mpu_cfg.get('name', 'unknown_mpu'),
+            "bus": mpu_cfg.get('bus', 1),
+            "address": int(mpu_cfg['address'], 0),
+            "config": mpu_cfg,
+            "requested_reads_per_sec": min(requested_hz, mpu_rate_limit)
+        })
+
+    current_cfg = sensors_cfg.get('current', {})
+    samples_per_reading = int(current_cfg.get('samples_per_reading', DEFAULT_RMS_SAMPLES))
+    read_interval = float(config.get('intervals', {}).get('fast_sensors_sec', 0.333))
+    for adc_cfg, channels_cfg in get_adc_configs(current_cfg):
+        if not adc_cfg.get('address') or not channels_cfg:
+            continue
+        devices.append({
+            "kind": "ads1115",
+            "name": f"ads1115_{adc_cfg.get('address')}",
+            "bus": adc_cfg.get('bus', 1),
+            "address": int(adc_cfg['address'], 0),
+            "config": adc_cfg,
+            "channels": len(channels_cfg),
+            # Every channel needs samples_per_reading conversions per fast_sensors_sec cycle
+            "requested_reads_per_sec": len(channels_cfg) * samples_per_reading / read_interval
+        })
+    return devices
+
+
+def _bus_ms_per_read(bus_manager, bus, address, reads):
+    """Bus time per read of a device, from the bus manager statistics collected during its probe."""
+    if not bus_manager or not reads:
+        return None
+    bus_report = bus_manager.get_utilization().get(bus, {})
+    for dev in bus_report.get('devices', {}).values():
+        if int(dev['address'], 16) == address and dev['transactions']:
+            return round(1000.0 * dev['busy_sec'] / reads, 3)
+    return None
+
+
+def run_probe(config, samples=DEFAULT_PROBE_SAMPLES):
+    """
+    Probes every configured I2C device.
+    :return: List of device dicts with 'latency_ms' (device time per read, including ADC conversion wait),
+             'bus_ms_per_read' (time the bus is actually held per read) and 'max_reads_per_sec' added
+             (None if the probe failed).
+    """
+    bus_manager = get_bus_manager()
+    devices = _collect_devices(config)
+    for device in devices:
+        latency = None
+        if bus_manager:
+            bus_manager.get_utilization(reset=True)  # Per-device bus time is measured from here
+        try:
+            if device['kind'] == 'mpu6050' and bus_manager:
+                latency = probe_mpu(bus_manager, device['bus'], device['address'], samples)
+            elif device['kind'] == 'ads1115':
+                latency = probe_adc(device['config'], samples)
+        except Exception as e:
+            print(f"Probe error for {device['name']} (bus {device['bus']}, 0x{device['address']:02x}): {e}")
+            traceback.print_exc()
+        device['latency_ms'] = round(latency * 1000.0, 3) if latency else None
+        device['max_reads_per_sec'] = round(1.0 / latency, 1) if latency else None
+        bus_ms = _bus_ms_per_read(bus_manager, device['bus'], device['address'], samples) if latency else None
+        # Without bus statistics assume the device holds the bus for its whole read
+        device['bus_ms_per_read'] = bus_ms if bus_ms is not None else device['latency_ms']
+    return devices
+
+
+def plan_bus_load(config, devices, max_utilization=DEFAULT_MAX_BUS_UTILIZATION, apply=False):
+    """
+    Compares the requested load with the measured capacity of every device and bus.
+    Device load = requested reads/s * device latency (a sampling worker cannot read faster).
+    Bus load = sum over devices on the bus of requested reads/s * bus time per read.
+    If a device or its bus needs more than max_utilization, its rates are scaled down proportionally;
+    with apply=True the reduced values are written into config (MPU 'sample_rate_hz',
+    'sensors.current.samples_per_reading').
+    :return: Dict {bus: {"required_utilization", "overloaded", "scale", "devices", "warnings", "suggestions"}}.
+    """
+    plan = {}
+    for device in devices:
+        bus_plan = plan.setdefault(device['bus'], {"required_utilization": 0.0, "devices": [],
+                                                    "warnings": [], "suggestions": []})
+        bus_plan['devices'].append(device)
+        if device.get('latency_ms') is None:
+            bus_plan['warnings'].append(f"{device['name']}: probe failed, device not counted")
+            continue
+        device['device_utilization'] = device['requested_reads_per_sec'] * device['latency_ms'] / 1000.0
+        device['required_utilization'] = device['requested_reads_per_sec'] * device['bus_ms_per_read'] / 1000.0
+        bus_plan['required_utilization'] += device['required_utilization']
+        if device['device_utilization'] > max_utilization:
+            bus_plan['warnings'].append(
+                f"{device['name']}: requested {device['requested_reads_per_sec']:.0f} reads/s, "
+                f"device sustains ~{device['max_reads_per_sec']:.0f} reads/s")
+
+        if device['kind'] == 'mpu6050' and device['requested_reads_per_sec'] >= MPU_FIFO_SUGGEST_RATE_HZ:
+            bus_plan['suggestions'].append(
+                f"{device['name']}: {device['requested_reads_per_sec']:.0f} Hz single-sample polling; "
+                f"consider FIFO burst reads (one transaction per many samples)")
+        if device['kind'] == 'ads1115' and device['device_utilization'] > max_utilization:
+            bus_plan['suggestions'].append(
+                f"{device['name']}: {device['latency_ms']:.2f} ms per single-shot conversion; "
+                f"continuous conversion mode avoids the per-sample config write and polling")
+
+    for bus, bus_plan in plan.items():
+        required = bus_plan['required_utilization']
+        bus_plan['overloaded'] = required > max_utilization
+        bus_plan['scale'] = min(1.0, max_utilization / required) if required > 0 else 1.0
+        if bus_plan['overloaded']:
+            bus_plan['warnings'].append(
+                f"bus {bus} needs {100.0 * required:.0f}% of bus time (limit {100.0 * max_utilization:.0f}%): "
+                f"effective sample rates will be ~{100.0 * bus_plan['scale']:.0f}% of configured")
+        for device in bus_plan['devices']:
+            if device.get('latency_ms') is None:
+                continue
+            device_scale = min(1.0, max_utilization / device['device_utilization']) if device['device_utilization'] > 0 else 1.0
+            device['scale'] = min(device_scale, bus_plan['scale'])
+        if apply:
+            _apply_scale(config, bus_plan)
+    return plan
+
+
+def _apply_scale(config, bus_plan):
+    """Reduces configured rates of overloaded devices on a bus by their planned scale."""
+    current_cfg = config.get('sensors', {}).get('current', {})
+    for device in bus_plan['devices']:
+        if device.get('latency_ms') is None or device['scale'] >= 1.0:
+            continue
+        scale = device['scale']
+        if device['kind'] == 'mpu6050':
+            old_rate = float(device['config'].get('sample_rate_hz', 100.0))
+            new_rate = max(4.0, round(device['requested_reads_per_sec'] * scale, 1))
+            if new_rate < old_rate:
+                device['config']['sample_rate_hz'] = new_rate
+                print(f"Planner: {device['name']} sample_rate_hz {old_rate} -> {new_rate}")
+        elif device['kind'] == 'ads1115':
+            old_samples = int(current_cfg.get('samples_per_reading', DEFAULT_RMS_SAMPLES))
+            new_samples = max(20, int(old_samples * scale))
+            if new_samples < old_samples:
+                # samples_per_reading is shared by all ADCs, so the most overloaded bus wins
+                current_cfg['samples_per_reading'] = new_samples
+                print(f"Planner: current samples_per_reading {old_samples} -> {new_samples}")
+
+
+def print_plan(plan):
+    print("\n--- I2C Throughput Probe ---")
+    for bus, bus_plan in plan.items():
+        state = "OVERLOADED" if bus_plan['overloaded'] else "ok"
+        if not bus_plan['overloaded'] and any(d.get('scale', 1.0) < 1.0 for d in bus_plan['devices']):
+            state = "device overloaded"
+        print(f"Bus {bus}: required {100.0 * bus_plan['required_utilization']:.1f}% of bus time [{state}]")
+        for device in bus_plan['devices']:
+            if device.get('latency_ms') is None:
+                print(f"  {device['name']} (0x{device['address']:02x}): probe failed")
+                continue
+            print(f"  {device['name']} (0x{device['address']:02x}): {device['latency_ms']:.3f} ms/read "
+                  f"({device['bus_ms_per_read']:.3f} ms on bus), max {device['max_reads_per_sec']:.0f} reads/s, "
+                  f"requested {device['requested_reads_per_sec']:.0f} reads/s ({100.0 * device['required_utilization']:.1f}% of bus)")
+        for warning in bus_plan['warnings']:
+            print(f"  WARNING: {warning}")
+        for suggestion in bus_plan['suggestions']:
+            print(f"  Suggestion: {suggestion}")
+    print("----------------------------\n")
+
+
+def probe_and_plan(config, apply=None):
+    """Runs the probe and the planner with settings from the 'i2c' config section. Returns the plan."""
+    i2c_cfg = config.get('i2c', {})
+    if apply is None:
+        apply = i2c_cfg.get('auto_reduce', False)
+    devices = run_probe(config, samples=int(i2c_cfg.get('probe_samples', DEFAULT_PROBE_SAMPLES)))
+    plan = plan_bus_load(config, devices,
+                         max_utilization=float(i2c_cfg.get('max_bus_utilization', DEFAULT_MAX_BUS_UTILIZATION)),
+                         apply=apply)
+    print_plan(plan)
+    return plan
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="I2C throughput probe and sample-rate planner")
+    parser.add_argument('--config', type=str, default='config.json', help='Path to configuration file')
+    parser.add_argument('--apply', action='store_true', help='Reduce overloaded sample rates in the configuration')
+    parser.add_argument('--save', action='store_true', help='Save the reduced configuration (with --apply)')
+    args = parser.parse_args()
+
+    probe_config = load_config(args.config)
+    probe_and_plan(probe_config, apply=args.apply or None)
+    if args.apply and args.save:
+        save_config(probe_config, args.config)
@@ -1,97 +1,757 @@
 # mqtt_buffer_sqlite.py
 # -*- coding: utf-8 -*-
+"""
+Store-and-forward buffer for MQTT payloads that could not be published.
+
+SQLiteMessageQueue keeps one long-lived SQLite connection in WAL mode (synchronous=NORMAL:
+no fsync per commit, the WAL is synced at checkpoints). In front of it is a bounded RAM
+write-behind tier: new messages stay in memory and are replayed from there, and are only
+spilled to SQLite (one transaction) once the oldest of them is spill_after_sec old or
+ram_max_messages are held. A broker hiccup shorter than spill_after_sec costs no disk I/O;
+close() (and spill_buffer() on shutdown) writes the RAM tier so it is not lost.
+RAM messages get their row ids on arrival, so replay and deletion do not care which tier
+a message is in. The module-level functions keep the old interface on top of a process-wide queue.
+
+Retention is a disk byte budget (max_bytes). Before the budget is reached, BufferCompactor
+replaces the oldest raw backlog with 1-minute min/mean/max rollups (rollup.py) in the
+background, so a long outage keeps a low-resolution history instead of losing it.
+Only when the budget is exceeded anyway are the oldest rows dropped.
+
+Every row belongs to a priority lane with its own replay queue: alarm/error state changes
+(LANE_ALARM) go out first on reconnect, then the newest buffered state (LANE_LATEST, a single
+row), then the historical backlog (LANE_HISTORY).
+"""
 import sqlite3
 import json
 import time
-import os
 import threading
 
+from payload_codec import (encode_batch, encode_body, encode_record, decode_body, encoding_from_name,
+                           wire_format_from_name, ENCODING_JSON, WIRE_JSON)
+from rollup import rollup_payloads, window_start
+
 DB_FILE = "mqtt_buffer.db"
-MAX_MESSAGES = 1000  # max message
+MAX_MESSAGES = 0  # max message count (0 = only the byte budget applies)
+MAX_BYTES = 64 * 1024 * 1024  # Disk budget of the buffer database
+COMPACT_THRESHOLD = 0.75  # Start compacting old backlog at this fraction of max_bytes
+COMPACTION_WINDOW_SEC = 60  # Rollup window of compacted backlog
+COMPACTION_INTERVAL_SEC = 30.0  # How often the compactor checks the budget
+COMPACTION_CHUNK_ROWS = 1000  # Raw rows compacted per step
+RAM_MAX_MESSAGES = 500  # Messages held in the RAM tier before they are spilled to SQLite
+SPILL_AFTER_SEC = 30.0  # RAM messages older than this are spilled (the outage is not a short hiccup)
+SPILL_RETRY_SEC = 5.0  # Wait before retrying a failed spill
+SYNCHRONOUS = "NORMAL"  # PRAGMA synchronous in WAL mode: OFF, NORMAL or FULL
+REPLAY_PAGE_SIZE = 100  # Messages read per page during backlog replay
+INFLIGHT_WINDOW = 20  # Replayed messages awaiting the broker's acknowledgement
+ACK_TIMEOUT_SEC = 10.0  # Unacknowledged replayed messages are resent after this time
+REPLAY_BATCH_SIZE = 50  # Buffered records packed into one replay envelope (1 = plain JSON messages)
+REPLAY_COMPRESSION = True  # zlib-compress replay envelopes
+STORAGE_ENCODING = "zlib_json"  # Encoding of stored payloads: "json" (text) or "zlib_json" (compressed blob)
 LOCK = threading.Lock()
 
+# Row kinds
+KIND_RAW = 0
+KIND_ROLLUP = 1
 
-def init_db():
-    """create db."""
-    with LOCK:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute('''
+# Priority lanes, replayed in this order
+LANE_ALARM = 0  # Error/alarm state changes
+LANE_LATEST = 1  # Newest buffered state (one row)
+LANE_HISTORY = 2  # Backlog
+LANES = (LANE_ALARM, LANE_LATEST, LANE_HISTORY)
+LANE_NAMES = {LANE_ALARM: "alarm", LANE_LATEST: "latest", LANE_HISTORY: "history"}
+EARLY_ACK_MAX_AGE_SEC = 5.0  # Confirmations for unknown mids are kept this long
+
+
+class SQLiteMessageQueue:
+    def __init__(self, db_file=DB_FILE, max_messages=MAX_MESSAGES, ram_max_messages=RAM_MAX_MESSAGES,
+                 spill_after_sec=SPILL_AFTER_SEC, synchronous=SYNCHRONOUS, replay_page_size=REPLAY_PAGE_SIZE,
+                 storage_encoding=STORAGE_ENCODING, max_bytes=MAX_BYTES):
+        """
+        :param db_file: Path to the SQLite database.
+        :param max_messages: Oldest messages beyond this count are discarded (0 = no count limit).
+        :param ram_max_messages: Size of the RAM tier; reaching it spills the tier to SQLite.
+        :param spill_after_sec: Age of the oldest RAM message that spills the tier to SQLite.
+        :param synchronous: PRAGMA synchronous value (OFF, NORMAL or FULL).
+        :param replay_page_size: Messages per page when the backlog is replayed.
+        :param storage_encoding: Encoding of new rows ("json" or "zlib_json"); each row records its
+                                 own encoding, so rows written with another setting stay readable.
+        :param max_bytes: Disk budget; the oldest rows are dropped when it is exceeded (0 = no limit).
+        """
+        self.db_file = db_file
+        self.max_messages = max_messages
+        self.ram_max_messages = max(int(ram_max_messages), 1)
+        self.spill_after_sec = float(spill_after_sec)
+        self.replay_page_size = max(int(replay_page_size), 1)
+        self.storage_encoding = encoding_from_name(storage_encoding)
+        self.max_bytes = int(max_bytes or 0)
+        self._lock = threading.RLock()
+        self._ram = []  # RAM tier: [id, timestamp, payload, lane, kind], ids ascending and above all stored ids
+        self._wakeup = threading.Event()
+        self._closed = False
+
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        if str(synchronous).upper() not in ("OFF", "NORMAL", "FULL"):
+            synchronous = SYNCHRONOUS
+        self._conn.execute(f'PRAGMA synchronous={str(synchronous).upper()}')
+        self._conn.execute('''
             CREATE TABLE IF NOT EXISTS buffered_messages (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 timestamp REAL,
-                payload TEXT
+                payload TEXT,
+                encoding INTEGER NOT NULL DEFAULT 0,
+                kind INTEGER NOT NULL DEFAULT 0,
+                lane INTEGER NOT NULL DEFAULT 2
             )
         ''')
-        conn.commit()
-        conn.close()
+        # Buffers created by older versions: JSON text rows, raw data only
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(buffered_messages)')]
+        if 'encoding' not in columns:
+            self._conn.execute(f'ALTER TABLE buffered_messages ADD COLUMN encoding INTEGER NOT NULL DEFAULT {ENCODING_JSON}')
+        if 'kind' not in columns:
+            self._conn.execute(f'ALTER TABLE buffered_messages ADD COLUMN kind INTEGER NOT NULL DEFAULT {KIND_RAW}')
+        if 'lane' not in columns:
+            self._conn.execute(f'ALTER TABLE buffered_messages ADD COLUMN lane INTEGER NOT NULL DEFAULT {LANE_HISTORY}')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_buffered_messages_lane ON buffered_messages (lane, id)')
+        self._conn.commit()
+        latest_row = self._conn.execute('SELECT MAX(id) FROM buffered_messages WHERE lane = ?', (LANE_LATEST,)).fetchone()
+        self._latest_id = latest_row[0]  # Row currently in LANE_LATEST
+        self._page_size = self._conn.execute('PRAGMA page_size').fetchone()[0]
+        self._compact_cursor = 0  # Raw rows up to this id were already considered for compaction
+        # Rowid range of the buffer: retention deletes the id range below tail - max_messages + 1
+        # instead of counting the table, so trimming costs the same at any backlog size.
+        head_id, tail_id = self._conn.execute('SELECT MIN(id), MAX(id) FROM buffered_messages').fetchone()
+        self._head_id = head_id or 1  # Lower bound of stored ids
+        self._tail_id = tail_id or 0  # Newest stored id
+        sequence_row = self._conn.execute(
+            "SELECT seq FROM sqlite_sequence WHERE name = 'buffered_messages'").fetchone()
+        self._next_id = max(sequence_row[0] if sequence_row else 0, self._tail_id) + 1  # Id of the next message
+
+        self._writer_thread = threading.Thread(target=self._writer_loop, name="mqtt_buffer_writer", daemon=True)
+        self._writer_thread.start()
+
+    def _writer_loop(self):
+        """Spills the RAM tier once its oldest message is spill_after_sec old."""
+        while not self._closed:
+            with self._lock:
+                oldest_timestamp = self._ram[0][1] if self._ram else None
+            if oldest_timestamp is None:
+                self._wakeup.wait()  # Set by put() when the RAM tier gets its first message
+                self._wakeup.clear()
+                continue
+            delay = oldest_timestamp + self.spill_after_sec - time.time()
+            if delay > 0:
+                self._wakeup.wait(delay)
+                self._wakeup.clear()
+                continue
+            try:
+                self.spill()
+            except Exception as e:
+                print(f"[Buffer] Error writing buffered messages: {e}")
+                time.sleep(SPILL_RETRY_SEC)
+
+    def put(self, payload, lane=LANE_LATEST, kind=KIND_RAW):
+        """
+        Buffers a payload (dict) in the RAM tier.
+        :param lane: LANE_ALARM, LANE_LATEST (the previous latest row moves to LANE_HISTORY)
+                     or LANE_HISTORY.
+        :param kind: KIND_RAW, or KIND_ROLLUP for a rollup record (never compacted again).
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Message queue is closed")
+            row_id = self._next_id
+            self._next_id += 1
+            if lane == LANE_LATEST:
+                self._demote_latest()
+                self._latest_id = row_id
+            self._ram.append([row_id, time.time(), payload, lane, kind])
+            if len(self._ram) >= self.ram_max_messages:
+                self.spill()
+            elif len(self._ram) == 1:
+                self._wakeup.set()
+
+    def _demote_latest(self):
+        """Moves the current latest-lane message to LANE_HISTORY: only the newest state stays in the latest lane."""
+        if self._latest_id is None:
+            return
+        for entry in reversed(self._ram):
+            if entry[0] == self._latest_id:
+                entry[3] = LANE_HISTORY
+                return
+        # Stored row (left from a spilled outage): one UPDATE, not once per message
+        with self._conn:
+            self._conn.execute('UPDATE buffered_messages SET lane = ? WHERE id = ?', (LANE_HISTORY, self._latest_id))
+
+    def spill(self):
+        """Writes the RAM tier to SQLite in one transaction and trims the buffer."""
+        with self._lock:
+            if not self._ram or self._conn is None:
+                return
+            rows = [(row_id, timestamp, self._encode_payload(payload), self.storage_encoding, kind, lane)
+                    for row_id, timestamp, payload, lane, kind in self._ram]
+            with self._conn:  # One transaction
+                self._conn.executemany(
+                    'INSERT INTO buffered_messages (id, timestamp, payload, encoding, kind, lane) '
+                    'VALUES (?, ?, ?, ?, ?, ?)', rows)
+                self._tail_id = rows[-1][0]
+                self._trim()
+            self._ram = []  # Only after the rows were written
+
+    def ram_count(self):
+        """Messages currently held in the RAM tier."""
+        with self._lock:
+            return len(self._ram)
+
+    def _encode_payload(self, payload):
+        """Stored form of a payload: JSON text, or a compressed BLOB."""
+        if self.storage_encoding == ENCODING_JSON:
+            return json.dumps(payload)
+        return sqlite3.Binary(encode_body(payload, self.storage_encoding))
+
+    @staticmethod
+    def _decode_rows(rows):
+        """(id, payload, encoding) rows -> list of (id, payload dict). Decoding happens only on read."""
+        return [(row[0], decode_body(row[1], row[2])) for row in rows]
+
+    def used_bytes(self):
+        """Bytes of the database in use (pages minus free pages), without scanning the table."""
+        with self._lock:
+            page_count = self._conn.execute('PRAGMA page_count').fetchone()[0]
+            freelist_count = self._conn.execute('PRAGMA freelist_count').fetchone()[0]
+        return (page_count - freelist_count) * self._page_size
+
+    def _trim(self):
+        """
+        Limits the buffer size: keeps the ids in (tail - max_messages, tail] and, if the byte
+        budget is exceeded despite compaction, drops the oldest rows down to 95% of the budget
+        (row count estimated from the average row size of the id range, no table scan).
+        Rows deleted after sending leave gaps, so the buffer may hold fewer than max_messages.
+        """
+        cutoff_id = self._head_id
+        if self.max_messages:
+            cutoff_id = max(cutoff_id, self._tail_id - self.max_messages + 1)
+        used_bytes = self.used_bytes() if self.max_bytes else 0
+        if self.max_bytes and used_bytes > self.max_bytes:
+            bytes_per_id = used_bytes / max(self._tail_id - self._head_id + 1, 1)
+            ids_to_drop = int((used_bytes - 0.95 * self.max_bytes) / bytes_per_id) + 1
+            cutoff_id = max(cutoff_id, self._head_id + ids_to_drop)
+            print(f"[Buffer] Byte budget of {self.max_bytes} bytes exceeded, dropping oldest messages below id {cutoff_id}.")
+        if self._head_id < cutoff_id:
+            # Alarm rows are few and are kept
+            self._conn.execute('DELETE FROM buffered_messages WHERE id < ? AND lane != ?', (cutoff_id, LANE_ALARM))
+            self._head_id = cutoff_id
+
+    def _raw_history_rows(self, after_id, limit):
+        """Raw history rows (id, timestamp, payload, encoding) with id > after_id, oldest first."""
+        with self._lock:
+            return self._conn.execute(
+                'SELECT id, timestamp, payload, encoding FROM buffered_messages WHERE lane = ? AND id > ? AND kind = ? '
+                'ORDER BY id ASC LIMIT ?', (LANE_HISTORY, after_id, KIND_RAW, limit)).fetchall()
+
+    def compact_oldest(self, window_sec=COMPACTION_WINDOW_SEC, max_rows=COMPACTION_CHUNK_ROWS):
+        """
+        Replaces the oldest not yet compacted raw rows by one rollup row per window_sec window.
+        The rollup row takes the id of the first row of its window, so replay order is kept.
+        Windows with a single row are left as they are. The last window of a chunk is only
+        compacted once a newer row starts a later window, so each window gets one rollup row;
+        a window with more rows than max_rows is read on to its end. Decoding and aggregation
+        run without holding the queue lock; only the replacement itself is one short transaction.
+        :return: Number of raw rows that were considered (0 when nothing is left to compact).
+        """
+        rows = self._raw_history_rows(self._compact_cursor, max_rows)
+        if not rows:
+            return 0
+
+        # Contiguous runs of rows by window
+        runs = []
+        for row_id, row_timestamp, stored, encoding in rows:
+            payload = decode_body(stored, encoding)
+            start = window_start(payload.get("timestamp", row_timestamp), window_sec)
+            if runs and runs[-1][0] == start:
+                runs[-1][1].append((row_id, payload))
+            else:
+                runs.append((start, [(row_id, payload)]))
+
+        if len(runs) == 1 and len(rows) == max_rows:
+            # One window fills the whole chunk: read on until a row of a later window shows up
+            start, run = runs[0]
+            window_closed = False
+            while not window_closed:
+                more_rows = self._raw_history_rows(run[-1][0], max_rows)
+                for row_id, row_timestamp, stored, encoding in more_rows:
+                    payload = decode_body(stored, encoding)
+                    if window_start(payload.get("timestamp", row_timestamp), window_sec) != start:
+                        window_closed = True
+                        break
+                    run.append((row_id, payload))
+                if len(more_rows) < max_rows:
+                    break  # Reached the tail
+            if not window_closed:
+                return 0  # The newest window may still grow
+        else:
+            # The last window continues in the next chunk, or is the newest one and may still grow
+            runs.pop()
+            if not runs:
+                return 0
+
+        replacements = []
+        for start, run in runs:
+            if len(run) < 2:
+                continue
+            rollup_record = rollup_payloads([payload for _, payload in run], window_sec)[0]
+            replacements.append((run[0][0], run[-1][0], start, self._encode_payload(rollup_record)))
+
+        with self._lock:
+            with self._conn:
+                for first_id, last_id, start, stored in replacements:
+                    # Rollup rows inside the range (edge rollups of the previous window) are kept
+                    self._conn.execute('DELETE FROM buffered_messages WHERE id BETWEEN ? AND ? AND lane = ? AND kind = ?',
+                                       (first_id, last_id, LANE_HISTORY, KIND_RAW))
+                    self._conn.execute('INSERT INTO buffered_messages (id, timestamp, payload, encoding, kind, lane) '
+                                       'VALUES (?, ?, ?, ?, ?, ?)',
+                                       (first_id, start, stored, self.storage_encoding, KIND_ROLLUP, LANE_HISTORY))
+            self._compact_cursor = runs[-1][1][-1][0]
+        return sum(len(run) for _, run in runs)
+
+    def get_all(self):
+        """Returns a list (id, payload) of all buffered messages, including the RAM tier."""
+        with self._lock:
+            rows = self._conn.execute('SELECT id, payload, encoding FROM buffered_messages ORDER BY id ASC').fetchall()
+            ram_rows = [(entry[0], entry[2]) for entry in self._ram]
+        return self._decode_rows(rows) + ram_rows
+
+    def get_page(self, after_id=0, limit=REPLAY_PAGE_SIZE, lane=None):
+        """
+        Keyset page of the buffer: up to limit messages with id > after_id, oldest first.
+        Stored rows come first; RAM tier messages always have the higher ids.
+        :param lane: Only rows of this lane (None: all lanes).
+        :return: List of (id, payload).
+        """
+        with self._lock:
+            if lane is None:
+                rows = self._conn.execute('SELECT id, payload, encoding FROM buffered_messages WHERE id > ? '
+                                          'ORDER BY id ASC LIMIT ?', (after_id, limit)).fetchall()
+            else:
+                rows = self._conn.execute('SELECT id, payload, encoding FROM buffered_messages WHERE lane = ? AND id > ? '
+                                          'ORDER BY id ASC LIMIT ?', (lane, after_id, limit)).fetchall()
+            ram_rows = [(entry[0], entry[2]) for entry in self._ram
+                        if entry[0] > after_id and (lane is None or entry[3] == lane)][:limit - len(rows)]
+        return self._decode_rows(rows) + ram_rows
+
+    def delete_range(self, first_id, last_id, lane=None):
+        """
+        Deletes all messages with first_id <= id <= last_id (of one lane if given) with one range delete.
+        Messages still in the RAM tier are dropped from memory without touching the database.
+        """
+        with self._lock:
+            self._ram = [entry for entry in self._ram
+                         if not (first_id <= entry[0] <= last_id and lane in (None, entry[3]))]
+            if first_id <= self._tail_id:
+                with self._conn:
+                    if lane is None:
+                        self._conn.execute('DELETE FROM buffered_messages WHERE id BETWEEN ? AND ?', (first_id, last_id))
+                    else:
+                        self._conn.execute('DELETE FROM buffered_messages WHERE lane = ? AND id BETWEEN ? AND ?',
+                                           (lane, first_id, last_id))
+                if self._latest_id is not None and first_id <= self._latest_id <= last_id and lane in (None, LANE_LATEST):
+                    self._latest_id = None
+
+    def delete(self, ids):
+        """Deletes messages by ID after successful sending."""
+        if not ids:
+            return
+        with self._lock:
+            ids = set(ids)
+            self._ram = [entry for entry in self._ram if entry[0] not in ids]
+            stored_ids = [(id_,) for id_ in ids if id_ <= self._tail_id]
+            if stored_ids:
+                with self._conn:
+                    self._conn.executemany('DELETE FROM buffered_messages WHERE id = ?', stored_ids)
+            if self._latest_id in ids:
+                self._latest_id = None
+
+    def close(self):
+        """Spills the RAM tier and closes the connection."""
+        with self._lock:
+            if self._closed:
+                return
+            try:
+                self.spill()
+            except Exception as e:
+                print(f"[Buffer] Error writing buffered messages on close: {e}")
+            self._closed = True
+            self._wakeup.set()
+            self._conn.close()
+            self._conn = None
+
+
+class BufferCompactor:
+    """
+    Background compaction of old backlog: while the buffer uses more than threshold * max_bytes,
+    the oldest raw rows are replaced by rollups in small steps, with replay paused for each step.
+    """
+    def __init__(self, queue, replay_window, threshold=COMPACT_THRESHOLD, window_sec=COMPACTION_WINDOW_SEC,
+                 interval_sec=COMPACTION_INTERVAL_SEC, chunk_rows=COMPACTION_CHUNK_ROWS):
+        self.queue = queue
+        self.replay_window = replay_window
+        self.threshold = float(threshold)
+        self.window_sec = window_sec
+        self.interval_sec = float(interval_sec)
+        self.chunk_rows = max(int(chunk_rows), 2)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if not self.queue.max_bytes:
+            return  # No byte budget, nothing to compact for
+        self._thread = threading.Thread(target=self._loop, name="mqtt_buffer_compactor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _loop(self):
+        while not self._stop_event.wait(self.interval_sec):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"[Buffer] Compaction error: {e}")
+
+    def run_once(self):
+        """Compacts until the buffer is below the threshold, nothing is left or replay is active."""
+        limit = self.threshold * self.queue.max_bytes
+        compacted = 0
+        while not self._stop_event.is_set() and self.queue.used_bytes() > limit:
+            if not self.replay_window.try_pause():
+                break  # Replay in progress; the backlog is shrinking anyway
+            try:
+                considered = self.queue.compact_oldest(self.window_sec, self.chunk_rows)
+            finally:
+                self.replay_window.resume()
+            if not considered:
+                break
+            compacted += considered
+            self._stop_event.wait(0.1)  # Incremental: leave the CPU and the SD card to the sensors
+        if compacted:
+            print(f"[Buffer] Compacted {compacted} old messages into {self.window_sec} s rollups, "
+                  f"{self.queue.used_bytes()} bytes in use.")
 
 
-def buffer_message(payload):
-    """Saves the message to the database. Cuts off the old ones if the limit is exceeded."""
+_queue = None
+_replay_windows = {}  # lane -> ReplayWindow
+_compactor = None
+
+
+def init_db(config=None):
+    """Creates the process-wide message queue (settings from the 'buffer' section of config)."""
+    global _queue, _replay_windows, _compactor
+    buffer_cfg = (config or {}).get('buffer', {})
+    wire_format = wire_format_from_name((config or {}).get('mqtt', {}).get('encoding'))
+    with LOCK:
+        if _compactor is not None:
+            _compactor.stop()
+        if _queue is not None:
+            _queue.close()
+        _queue = SQLiteMessageQueue(
+            db_file=buffer_cfg.get('db_file', DB_FILE),
+            max_messages=buffer_cfg.get('max_messages', MAX_MESSAGES),
+            ram_max_messages=buffer_cfg.get('ram_max_messages', RAM_MAX_MESSAGES),
+            spill_after_sec=buffer_cfg.get('spill_after_sec', SPILL_AFTER_SEC),
+            synchronous=buffer_cfg.get('synchronous', SYNCHRONOUS),
+            replay_page_size=buffer_cfg.get('replay_page_size', REPLAY_PAGE_SIZE),
+            storage_encoding=buffer_cfg.get('storage_encoding', STORAGE_ENCODING),
+            max_bytes=buffer_cfg.get('max_bytes', MAX_BYTES)
+        )
+        _replay_windows = {lane: ReplayWindow(
+            _queue,
+            window_size=buffer_cfg.get('inflight_window', INFLIGHT_WINDOW),
+            ack_timeout_sec=buffer_cfg.get('ack_timeout_sec', ACK_TIMEOUT_SEC),
+            batch_size=buffer_cfg.get('replay_batch_size', REPLAY_BATCH_SIZE),
+            compress=buffer_cfg.get('replay_compression', REPLAY_COMPRESSION),
+            lane=lane,
+            wire_format=wire_format
+        ) for lane in LANES}
+        _compactor = BufferCompactor(
+            _queue, _replay_windows[LANE_HISTORY],  # Compaction only touches the history lane
+            threshold=buffer_cfg.get('compact_threshold', COMPACT_THRESHOLD),
+            window_sec=buffer_cfg.get('compaction_window_sec', COMPACTION_WINDOW_SEC),
+            interval_sec=buffer_cfg.get('compaction_interval_sec', COMPACTION_INTERVAL_SEC),
+            chunk_rows=buffer_cfg.get('compaction_chunk_rows', COMPACTION_CHUNK_ROWS)
+        )
+        _compactor.start()
+    return _queue
+
+
+def get_queue():
+    """Returns the process-wide queue, creating it with default settings on first use."""
+    with LOCK:
+        queue = _queue
+    return queue if queue is not None else init_db()
+
+
+def spill_buffer():
+    """Writes the RAM tier of the process-wide queue to SQLite now (e.g. when a shutdown starts)."""
+    with LOCK:
+        queue = _queue
+    if queue is not None:
+        try:
+            queue.spill()
+        except Exception as e:
+            print(f"[Buffer] Error spilling buffered messages: {e}")
+
+
+def close_db():
+    """Spills the RAM tier and closes the process-wide queue (call on shutdown)."""
+    global _queue, _replay_windows, _compactor
     with LOCK:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        timestamp = time.time()
-        payload_str = json.dumps(payload)
-        c.execute('INSERT INTO buffered_messages (timestamp, payload) VALUES (?, ?)', (timestamp, payload_str))
+        if _compactor is not None:
+            _compactor.stop()
+            _compactor = None
+        if _queue is not None:
+            _queue.close()
+            _queue = None
+        _replay_windows = {}
 
-        # Ограничим размер буфера
-        c.execute('SELECT COUNT(*) FROM buffered_messages')
-        count = c.fetchone()[0]
-        if count > MAX_MESSAGES:
-            to_delete = count - MAX_MESSAGES
-            c.execute(
-                'DELETE FROM buffered_messages WHERE id IN (SELECT id FROM buffered_messages ORDER BY id ASC LIMIT ?)',
-                (to_delete,))
 
-        conn.commit()
-        conn.close()
+def buffer_message(payload, lane=LANE_LATEST, kind=KIND_RAW):
+    """
+    Buffers the message (RAM tier first, SQLite once the outage lasts). Cuts off the old ones if the limit is exceeded.
+    :param lane: LANE_ALARM for error/alarm state changes, otherwise LANE_LATEST.
+    :param kind: KIND_ROLLUP for rollup records (edge rollups), which compaction leaves alone.
+    """
+    get_queue().put(payload, lane, kind)
 
 
 def get_all_messages():
     """Returns a list (id, payload) from the buffer."""
-    with LOCK:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute('SELECT id, payload FROM buffered_messages ORDER BY id ASC')
-        rows = c.fetchall()
-        conn.close()
-        return [(row[0], json.loads(row[1])) for row in rows]
+    return get_queue().get_all()
 
 
 def delete_messages(ids):
     """Deletes messages by ID after successful sending."""
-    if not ids:
-        return
+    get_queue().delete(ids)
+
+
+class ReplayWindow:
+    """
+    In-flight window for backlog replay. A replayed message is only deleted from the buffer
+    after the broker confirmed it (on_publish: PUBACK for QoS 1); publish() returning only means
+    that paho queued it locally. Messages without confirmation after ack_timeout_sec are resent.
+    Confirmed rows are deleted up to the low watermark (the oldest unconfirmed row) with one
+    range delete, so the buffer never loses a message that was not acknowledged.
+    Rows are replayed in batch envelopes of batch_size records (see payload_codec.py);
+    the window counts envelopes. Each priority lane has its own window.
+    """
+    def __init__(self, queue, window_size=INFLIGHT_WINDOW, ack_timeout_sec=ACK_TIMEOUT_SEC,
+                 batch_size=REPLAY_BATCH_SIZE, compress=REPLAY_COMPRESSION, lane=LANE_HISTORY,
+                 wire_format=WIRE_JSON):
+        self.queue = queue
+        self.lane = lane
+        self.window_size = max(int(window_size), 1)
+        self.ack_timeout_sec = float(ack_timeout_sec)
+        self.batch_size = max(int(batch_size), 1)
+        self.compress = bool(compress)
+        self.wire_format = wire_format  # Body format of replayed messages (mqtt.encoding)
+        self._cond = threading.Condition()
+        self._inflight = {}  # first row id -> {"mid", "last_id", "data", "sent_at", "acked"}, in id order
+        self._mid_to_row = {}
+        self._early_acks = {}  # mid -> time: confirmations that arrived before publish() returned the mid
+        self._ack_count = 0
+        self._flush_lock = threading.Lock()
+
+    def on_publish(self, mid):
+        """Publish confirmation from the MQTT network thread."""
+        with self._cond:
+            row_id = self._mid_to_row.pop(mid, None)
+            if row_id is None:
+                # Unknown mid: a live message, another lane, or publish() has not returned yet
+                now = time.time()
+                self._early_acks[mid] = now
+                if len(self._early_acks) > 64:
+                    self._early_acks = {m: t for m, t in self._early_acks.items() if now - t < EARLY_ACK_MAX_AGE_SEC}
+                return
+            entry = self._inflight.get(row_id)
+            if entry is not None:
+                entry["acked"] = True
+                self._ack_count += 1
+            self._cond.notify_all()
+
+    def _encode(self, payloads):
+        if self.batch_size == 1 and not self.compress:
+            return encode_record(payloads[0], self.wire_format)  # Single message, as published live
+        return encode_batch(payloads, compress=self.compress, wire_format=self.wire_format)
+
+    def _publish(self, mqtt_client, topic, qos, row_id, last_id, data, row_ids=None):
+        """
+        Publishes one envelope (rows row_id..last_id) and tracks it as in flight.
+        :param row_ids: Exact row ids of the envelope, kept for the latest lane (see _release_confirmed).
+        Returns False if the client rejected it.
+        """
+        info = mqtt_client.publish(topic, data, qos=qos)
+        if getattr(info, 'rc', 0) != 0:
+            return False
+        with self._cond:
+            entry = {"mid": info.mid, "last_id": last_id, "data": data, "sent_at": time.time(), "acked": False,
+                     "ids": row_ids}
+            self._inflight[row_id] = entry
+            acked_at = self._early_acks.pop(info.mid, None)
+            if acked_at is not None and time.time() - acked_at < EARLY_ACK_MAX_AGE_SEC:
+                entry["acked"] = True
+                self._ack_count += 1
+            else:
+                self._mid_to_row[info.mid] = row_id
+        return True
+
+    def _release_confirmed(self):
+        """Deletes confirmed rows below the low watermark. Returns the number of released rows."""
+        with self._cond:
+            first_id = last_id = None
+            row_ids = []
+            for row_id in list(self._inflight):
+                entry = self._inflight[row_id]
+                if not entry["acked"]:
+                    break
+                del self._inflight[row_id]
+                first_id = row_id if first_id is None else first_id
+                last_id = entry["last_id"]
+                row_ids.extend(entry["ids"] or ())
+        if first_id is None:
+            return 0
+        if self.lane == LANE_LATEST:
+            # A newer state may have moved a row in flight to the history lane (_demote_latest):
+            # the sent rows are deleted by id, whatever lane they are in now
+            self.queue.delete(row_ids)
+            return len(row_ids)
+        self.queue.delete_range(first_id, last_id, self.lane)
+        return last_id - first_id + 1
+
+    def _resend_expired(self, mqtt_client, topic, qos):
+        now = time.time()
+        with self._cond:
+            expired = [(row_id, entry) for row_id, entry in self._inflight.items()
+                       if not entry["acked"] and now - entry["sent_at"] >= self.ack_timeout_sec]
+            for _, entry in expired:
+                self._mid_to_row.pop(entry["mid"], None)
+        for row_id, entry in expired:
+            print(f"[Buffer] No acknowledgement for buffered messages {row_id}..{entry['last_id']}, resending.")
+            if not self._publish(mqtt_client, topic, qos, row_id, entry["last_id"], entry["data"], entry["ids"]):
+                return False
+        return True
+
+    def _fill(self, mqtt_client, topic, qos, rate_limiter=None):
+        """
+        Publishes the next buffered messages until the window is full. Returns False on a publish error.
+        :param rate_limiter: Optional object with acquire(records, nbytes) -> bool, called before every
+                             envelope; False (stop requested) ends filling for now.
+        """
+        with self._cond:
+            free_slots = self.window_size - len(self._inflight)
+            after_id = self._inflight[next(reversed(self._inflight))]["last_id"] if self._inflight else 0
+        if free_slots <= 0:
+            return True
+        rows = self.queue.get_page(after_id, free_slots * self.batch_size, self.lane)
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start:start + self.batch_size]
+            data = self._encode([payload for _, payload in batch])
+            if rate_limiter is not None and not rate_limiter.acquire(len(batch), len(data)):
+                return True
+            row_ids = [row_id for row_id, _ in batch] if self.lane == LANE_LATEST else None
+            if not self._publish(mqtt_client, topic, qos, batch[0][0], batch[-1][0], data, row_ids):
+                return False
+        return True
+
+    def try_pause(self):
+        """
+        Stops replay for buffer maintenance if no replay runs and nothing is in flight
+        (in-flight envelopes refer to row id ranges). Returns True if paused; call resume() after.
+        """
+        if not self._flush_lock.acquire(blocking=False):
+            return False
+        with self._cond:
+            idle = not self._inflight
+        if not idle:
+            self._flush_lock.release()
+        return idle
+
+    def resume(self):
+        self._flush_lock.release()
+
+    def flush(self, mqtt_client, topic, qos, is_connected_func, rate_limiter=None, should_stop=None):
+        """
+        Replays the buffer through the window until it is empty and confirmed,
+        the connection drops, the broker stops acknowledging or should_stop() returns True.
+        :param rate_limiter: Drain rate limit for new envelopes (see _fill).
+        :return: True if the lane was replayed completely.
+        """
+        if not self._flush_lock.acquire(blocking=False):
+            return False  # Another thread is replaying already
+        try:
+            last_progress = time.time()
+            last_ack_count = self._ack_count
+            while is_connected_func() and not (should_stop and should_stop()):
+                if not self._resend_expired(mqtt_client, topic, qos) or \
+                        not self._fill(mqtt_client, topic, qos, rate_limiter):
+                    raise RuntimeError("publish rejected by MQTT client")
+                with self._cond:
+                    if not self._inflight:
+                        return True  # Buffer replayed and confirmed
+                    if not next(iter(self._inflight.values()))["acked"]:
+                        # Wait for the oldest in-flight message (the low watermark)
+                        self._cond.wait(timeout=min(0.5, self.ack_timeout_sec))
+                self._release_confirmed()
+                if self._ack_count != last_ack_count:
+                    last_ack_count = self._ack_count
+                    last_progress = time.time()
+                elif time.time() - last_progress > 2 * self.ack_timeout_sec:
+                    print("[Buffer] Broker is not acknowledging replayed messages, pausing replay.")
+                    return False
+            return False
+        finally:
+            self._flush_lock.release()
+
+
+def get_replay_window(lane=LANE_HISTORY):
+    """Returns the replay window of a lane of the process-wide queue."""
+    queue = get_queue()
     with LOCK:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.executemany('DELETE FROM buffered_messages WHERE id = ?', [(id_,) for id_ in ids])
-        conn.commit()
-        conn.close()
+        window = _replay_windows.get(lane)
+        if window is None or window.queue is not queue:
+            window = ReplayWindow(queue, lane=lane)
+            _replay_windows[lane] = window
+    return window
 
 
-def flush_if_connected(mqtt_client, topic, qos, is_connected_func, led_indicator=None):
-    """If connected, it sends all messages from the buffer."""
-    if not is_connected_func():
-        return
+def on_publish_confirmed(mid):
+    """Publish listener for mqtt_utils.add_publish_listener: forwards confirmations to the replay windows."""
+    for window in list(_replay_windows.values()):
+        window.on_publish(mid)
 
-    messages = get_all_messages()
-    if not messages:
+
+def flush_if_connected(mqtt_client, topic, qos, is_connected_func, led_indicator=None,
+                       history_rate_limiter=None, should_stop=None):
+    """
+    If connected, it sends all messages from the buffer.
+    Lanes are replayed in priority order: alarms, the latest state, then the history backlog.
+    Each lane goes through its in-flight window (keyset pages on id); rows are removed with
+    range deletes only after the broker confirmed them.
+    :param history_rate_limiter: Drain rate limit of the history lane (alarms and latest state are not limited).
+    :param should_stop: Callable; replay ends when it returns True.
+    """
+    if not is_connected_func():
         return
 
-    success_ids = []
-    for msg_id, payload in messages:
-        try:
-            mqtt_client.publish(topic, json.dumps(payload), qos=qos)
-            success_ids.append(msg_id)
-        except Exception as e:
-            print(f"[Buffer] Error sending buffer message: {e}")
-            if led_indicator:
-                led_indicator.set_red(True)  # Indicate buffer error
-                time.sleep(0.1)
-                led_indicator.set_red(False)
-            break
-
-    delete_messages(success_ids)
+    try:
+        for lane in LANES:
+            rate_limiter = history_rate_limiter if lane == LANE_HISTORY else None
+            if not get_replay_window(lane).flush(mqtt_client, topic, qos, is_connected_func,
+                                                 rate_limiter=rate_limiter, should_stop=should_stop):
+                break  # Lower priority lanes wait until this one is through
+    except Exception as e:
+        print(f"[Buffer] Error sending buffer message: {e}")
+        if led_indicator:
+            led_indicator.set_red(True)  # Indicate buffer error
+            time.sleep(0.1)
+            led_indicator.set_red(False)
@@ -9,20 +9,27 @@ import argparse
 import signal
 import copy # For deepcopy if needed, though processing module handles its own copies
 
-from mqtt_buffer_sqlite import init_db
+from delivery import DEFAULT_PROTOCOL, max_inflight_from_config
+from mqtt_buffer_sqlite import init_db, close_db, spill_buffer, on_publish_confirmed
+from flush_coordinator import FlushCoordinator
+from payload_schema import create_payload_schema, SchemaAnnouncer
 # import gui_config_menu  # import our graphical configuration module
 
 # --- Configuration Management ---
 try:
-    from config_manager import load_config, run_config_menu, save_config, get_default_config
+    from config_manager import load_config, run_config_menu, save_config, get_default_config, get_adc_configs
     print("Config manager module loaded.")
 except ImportError:
     print("Error: config_manager.py not found. Cannot run application.")
     sys.exit(1)
 
+from calibration_store import create_calibration_store
+from i2c_bus_manager import bus_utilization_report_loop
+from i2c_probe import probe_and_plan
+
 # --- MQTT Utilities ---
 try:
-    from mqtt_utils import create_mqtt_client, connect_mqtt, is_mqtt_connected, monitor_mqtt_connection
+    from mqtt_utils import create_mqtt_client, MqttConnectionManager, add_publish_listener
     print("MQTT utilities module loaded.")
 except ImportError:
     print("Error: mqtt_utils.py not found. Cannot run application.")
@@ -32,9 +39,7 @@ except ImportError:
 try:
     # These functions will use sensor modules (MPU6050, DS18B20, current_sensors) internally
     from sensor_initializer import (
-        initialize_mpu_sensors,
-        initialize_ds18b20_sensors,
-        initialize_current_sensors,
+        initialize_all_sensors,
         MPU6050, DS18B20, CURRENT_SENSORS_AVAILABLE # Import availability flags/modules
     )
     print("Sensor initializer module loaded.")
@@ -47,8 +52,7 @@ try:
     from processing.sensor_processing import (
         mpu_processing_and_publish_loop,
         temperature_thread_loop,
-        current_thread_loop,
-        mqtt_watchdog_loop
+        current_thread_loop
     )
     print("Sensor processing module loaded.")
 except ImportError:
@@ -84,7 +88,12 @@ initialized_ds18b20_sensors = {}
 initialized_current_data = {}
 threads = []
 mqtt_client = None
+mqtt_connection = None  # MqttConnectionManager: connects and reconnects mqtt_client
+flush_coordinator = None
 led_indicator = None
+schema_announcer = None  # Publishes the retained payload schema (mqtt.schema.enabled)
+# Calibration override from command line: None (use config), True (--calibrate), False (--no-calibrate)
+calibration_override = None
 
 def parse_arguments():
     """Parses command-line arguments."""
@@ -94,25 +103,37 @@ def parse_arguments():
     parser.add_argument('--no-calibrate', dest='calibrate', action='store_false', help='Skip calibration for MPU and Current sensors')
     parser.set_defaults(calibrate=None) # None means use config setting or default True
     parser.add_argument('--config', type=str, default='config.json', help='Path to configuration file')
+    parser.add_argument('--probe', action='store_true', help='Run the I2C throughput probe and sample-rate planner before start')
     return parser.parse_args()
 
 
+def resolve_calibrate_flag(cfg, sensor_type):
+    """
+    Returns the calibrate_flag for the sensor initializers ('mpu' or 'current'):
+    None (auto: reuse fresh stored calibration profile), True (force), False (skip).
+    """
+    if calibration_override is not None:
+        return calibration_override
+    return None if cfg.get('calibration', {}).get(sensor_type, True) else False
+
+
 def signal_handler(signum, frame):
     """Handles signals (like Ctrl+C) to stop the application."""
     print(f"\nSignal {signum} received. Stopping threads...")
-    global led_indicator, stop_event, threads, mqtt_client
+    global led_indicator, stop_event, threads, mqtt_connection
     if led_indicator:
         led_indicator.cleanup()
     stop_event.set()
+    spill_buffer()  # Persist the RAM tier of the offline buffer before anything else can hang
     if LEDS_AVAILABLE:
        GPIO.cleanup() # To ensure all GPIOs are reset to default state before exiting.
     # Wait for threads to join
     for thread in threads:
         thread.join()
     # Stop MQTT client
-    if mqtt_client:
-        mqtt_client.loop_stop()
-        mqtt_client.disconnect()
+    if mqtt_connection:
+        mqtt_connection.stop()
+    close_db()  # Spill what was buffered while the threads stopped
     print("Application finished.")
     sys.exit(0)
 
@@ -151,14 +172,15 @@ def pre_populate_error_states(cfg, latest_vib_data, latest_temp_data, latest_cur
 
     # Current Sensors
     current_cfg = cfg.get('sensors', {}).get('current', {})
-    current_channels_configs = current_cfg.get('channels', [])
+    current_adc_blocks = get_adc_configs(current_cfg)
+    current_channels_configs = [ch for _, channels in current_adc_blocks for ch in channels]
     if not CURRENT_SENSORS_AVAILABLE:
         latest_curr_data["general"] = {"error": "not_found_module", "module": "current_sensors"}
-    elif not current_channels_configs:
-        latest_curr_data["general"] = {"error": "not_configured_channels"}
-    elif not current_cfg.get('adc'):
+    elif current_cfg.get('channels') and not current_cfg.get('adc'):
          # Channels might be configured, but ADC section is missing
          latest_curr_data["general"] = {"error": "not_configured_adc"}
+    elif not current_channels_configs:
+        latest_curr_data["general"] = {"error": "not_configured_channels"}
     else:
         for channel_cfg in current_channels_configs:
             name = channel_cfg.get('name')
@@ -212,11 +234,18 @@ def run_config_menu_thread(current_config, stop_event):
         print("Configuration menu exited without saving.")
 
 
-def initialize_sensors_and_threads():
-    """Initializes sensors and starts sensor processing threads based on current config."""
+def initialize_sensors_and_threads(started_at=None):
+    """
+    Initializes sensors and starts sensor processing threads based on current config.
+    :param started_at: Reference time for the "time to first published sample" report
+                       (application start on first run, otherwise the start of this call).
+    """
     global config, latest_vibration_data, latest_temperature_data, latest_current_data
     global initialized_mpu_sensors, initialized_ds18b20_sensors, initialized_current_data, threads
-    global mqtt_client, led_indicator
+    global mqtt_client, mqtt_connection, led_indicator, schema_announcer, flush_coordinator
+
+    if started_at is None:
+        started_at = time.time()
 
     # --- 4. Pre-populate shared data with initial error states ---
     print("\n--- Pre-populating sensor states... ---\n")
@@ -224,35 +253,39 @@ def initialize_sensors_and_threads():
 
     # --- 5. Initialize Sensors based on final configuration ---
     print("\n--- Initializing sensors... ---\n")
-    mpu_configs = config.get('sensors', {}).get('mpu6050', [])
-    initialized_mpu_sensors = initialize_mpu_sensors(
-        mpu_configs, latest_vibration_data, calibrate_flag=config.get('calibration', {}).get('mpu', True)
-    )
-
-    ds_configs = config.get('sensors', {}).get('ds18b20', [])
-    initialized_ds18b20_sensors = initialize_ds18b20_sensors(
-        ds_configs, latest_temperature_data
-    )
-
-    current_cfg = config.get('sensors', {}).get('current', {})
-    initialized_current_data = initialize_current_sensors(
-        current_cfg, latest_current_data, calibrate_flag=config.get('calibration', {}).get('current', True)
-    )  # Returns a dict or None
-
-    # --- Reconnect MQTT client if needed ---
-    if mqtt_client:
-        # Если клиент был отключен, переподключаем его
-        if not is_mqtt_connected():
-            device_id = config.get('device_id', 'unknown_device')
-            mqtt_broker = config.get('mqtt', {}).get('broker', '127.0.0.1')
-            mqtt_port = config.get('mqtt', {}).get('port', 1883)
-            connect_mqtt(mqtt_client, mqtt_broker, mqtt_port, device_id, stop_event, led_indicator)
-            print("MQTT client reconnected.")
+    calibration_store = create_calibration_store(config)
+    initialized_mpu_sensors, initialized_ds18b20_sensors, initialized_current_data = initialize_all_sensors(
+        config, latest_vibration_data, latest_temperature_data, latest_current_data,
+        mpu_calibrate_flag=resolve_calibrate_flag(config, 'mpu'),
+        current_calibrate_flag=resolve_calibrate_flag(config, 'current'),
+        calibration_store=calibration_store
+    )  # initialized_current_data is a dict or None
+    calibration_store.save()
+
+    # --- Announce the payload schema of this configuration (before packed data is published) ---
+    if schema_announcer:
+        mqtt_connection.remove_connect_listener(schema_announcer.on_connect)
+        schema_announcer = None
+    payload_schema = create_payload_schema(config)
+    if payload_schema and mqtt_client:
+        schema_announcer = SchemaAnnouncer(mqtt_client, config, payload_schema)
+        mqtt_connection.add_connect_listener(schema_announcer.on_connect)  # Re-announced after every reconnect
+        if mqtt_connection.is_connected():
+            schema_announcer.announce()
 
     # --- 6. Start Sensor Reading and Processing Threads ---
     print("\n--- Starting sensor processing threads... ---\n")
     threads.clear()
 
+    # Buffer Flush Coordinator Thread (the only place the offline buffer is replayed)
+    if flush_coordinator:
+        mqtt_connection.remove_connect_listener(flush_coordinator.trigger)
+    flush_coordinator = FlushCoordinator(mqtt_client, config, mqtt_connection.is_connected, stop_event, led_indicator)
+    mqtt_connection.add_connect_listener(flush_coordinator.trigger)  # Replay starts right after a reconnect
+    flush_thread = threading.Thread(target=flush_coordinator.run, daemon=True)
+    threads.append(flush_thread)
+    flush_thread.start()
+
     # MPU Processing and Publishing Thread
     # This thread now handles MPU reading, RMS calculation, data aggregation, and MQTT publishing.
     if initialized_mpu_sensors or \
@@ -269,8 +302,10 @@ def initialize_sensors_and_threads():
                 latest_vibration_data,  # To store RMS values
                 latest_temperature_data,  # To read for publishing
                 latest_current_data,  # To read for publishing
-                is_mqtt_connected,  # Function to check MQTT status
-                led_indicator
+                mqtt_connection.is_connected,  # Function to check MQTT status
+                led_indicator,
+                started_at,  # For the time-to-first-sample report
+                flush_coordinator
             ),
             daemon=True  # Daemon threads exit when main program exits
         )
@@ -293,28 +328,31 @@ def initialize_sensors_and_threads():
         # Info already provided by pre_populate_error_states and initialize_ds18b20_sensors
         pass  # print("No DS18B20 sensors initialized, temperature thread not started.")
 
-    # Current Thread (only reads and updates latest_current_data)
+    # Current Threads (one sampling worker per ADC, all updating latest_current_data)
     if initialized_current_data and initialized_current_data.get('channel_analogin_map'):
-        current_thread = threading.Thread(
-            target=current_thread_loop,
-            args=(initialized_current_data, config, stop_event, latest_current_data),
-            daemon=True
-        )
-        threads.append(current_thread)
-        current_thread.start()
+        for adc_group in initialized_current_data.get('adc_groups', []):
+            current_thread = threading.Thread(
+                target=current_thread_loop,
+                args=(adc_group, config, stop_event, latest_current_data),
+                name=f"current_{adc_group.get('adc_label', 'adc')}",
+                daemon=True
+            )
+            threads.append(current_thread)
+            current_thread.start()
     else:
         # Info already provided by pre_populate_error_states and initialize_current_sensors
         pass  # print("Current sensors not initialized/configured, current thread not started.")
 
-    # MQTT Watchdog Thread
-    watchdog_thread = threading.Thread(
-        target=mqtt_watchdog_loop,
-        args=(mqtt_client, config, stop_event, is_mqtt_connected),
-        daemon=True
-    )
-    threads.append(watchdog_thread)
-    watchdog_thread.start()
-    print("MQTT Watchdog thread started.")
+    # I2C bus utilization report thread (per bus and device)
+    i2c_report_interval = config.get('i2c', {}).get('report_interval_sec', 60.0)
+    if i2c_report_interval and i2c_report_interval > 0:
+        i2c_report_thread = threading.Thread(
+            target=bus_utilization_report_loop,
+            args=(stop_event, i2c_report_interval),
+            daemon=True
+        )
+        threads.append(i2c_report_thread)
+        i2c_report_thread.start()
 
     print("\n>>> Configuration applied successfully. Data collection is running... <<<\n")
 
@@ -335,39 +373,36 @@ def main():
     """Main function to load config, run menu, initialize sensors, and start threads."""
     global config, latest_vibration_data, latest_temperature_data, latest_current_data
     global initialized_mpu_sensors, initialized_ds18b20_sensors, initialized_current_data, threads
-    global mqtt_client, led_indicator
+    global mqtt_client, mqtt_connection, led_indicator, calibration_override
 
+    app_start_time = time.time()
     args = parse_arguments()
-    init_db()
 
     # --- 1. Load configuration ---
     config.update(load_config(args.config)) # Load into global config dict
+    init_db(config)  # Offline message buffer
 
     # --- Determine calibration flags ---
-    mpu_calibrate_flag = args.calibrate
-    if mpu_calibrate_flag is None:  # Not set by command line
-        mpu_calibrate_flag = config.get('calibration', {}).get('mpu', True)
-
-    current_calibrate_flag = args.calibrate
-    if current_calibrate_flag is None:  # Not set by command line
-        current_calibrate_flag = config.get('calibration', {}).get('current', True)
+    # --calibrate forces a fresh calibration (ignoring stored profiles), --no-calibrate skips it.
+    calibration_override = args.calibrate
 
     # --- 2. Create and Connect to MQTT broker ---
     device_id = config.get('device_id', 'unknown_device')
-    mqtt_broker = config.get('mqtt', {}).get('broker', '127.0.0.1')
-    mqtt_port = config.get('mqtt', {}).get('port', 1883)
 
     if LEDS_AVAILABLE:
         led_indicator = LEDIndicator(green_pin=5, blue_pin=6, yellow_pin=13, red_pin=19, white_pin=26)
     else:
         led_indicator = None
 
-    mqtt_client = create_mqtt_client(client_id=device_id)
-    connect_mqtt(mqtt_client, mqtt_broker, mqtt_port, device_id, stop_event, led_indicator)
-
-    monitor_thread = threading.Thread(target=monitor_mqtt_connection, args=(mqtt_client, stop_event, led_indicator))
-    monitor_thread.daemon = True
-    monitor_thread.start()
+    mqtt_client = create_mqtt_client(client_id=device_id,
+                                     protocol=config.get('mqtt', {}).get('protocol', DEFAULT_PROTOCOL),
+                                     max_inflight=max_inflight_from_config(config))  # All replay windows fit
+    add_publish_listener(on_publish_confirmed)  # Buffered messages are deleted only after PUBACK
+    # One connection thread connects and reconnects (exponential backoff with jitter)
+    mqtt_connection = MqttConnectionManager(mqtt_client, config, led_indicator)
+    mqtt_connection.start()
+    if not mqtt_connection.wait_connected(mqtt_connection.connect_timeout_sec):
+        print("MQTT broker not reachable yet; data is buffered until the connection is up.")
 
     # --- 3. Set up signal handling for clean exit ---
     signal.signal(signal.SIGINT, signal_handler)  # Handle Ctrl+C
@@ -378,18 +413,18 @@ def main():
     button_thread.start()
     print("Button monitor thread started.")
 
-    # --- Initial Sensor and Thread Setup ---
-    initialize_sensors_and_threads()
+    # --- I2C throughput probe / sample-rate planning ---
+    if args.probe or config.get('i2c', {}).get('probe_on_start', False):
+        try:
+            probe_and_plan(config)
+        except Exception as e:
+            print(f"I2C probe failed: {e}")
 
-    # --- MQTT Watchdog Thread ---
-    watchdog_thread = threading.Thread(
-        target=mqtt_watchdog_loop,
-        args=(mqtt_client, config, stop_event, is_mqtt_connected),
-        daemon=True
-    )
-    threads.append(watchdog_thread)
-    watchdog_thread.start()
-    print("MQTT Watchdog thread started.")
+    # --- Initial Sensor and Thread Setup ---
+    initialize_sensors_and_threads(started_at=app_start_time)
+    if calibration_override:
+        # Forced calibration applies to this start only; reconfigurations reuse the new profiles.
+        calibration_override = None
 
     print("\nApplication running. Press Ctrl+C to stop.")
 
@@ -397,6 +432,8 @@ def main():
     try:
         while not stop_event.is_set():
             stop_event.wait(1) # Wait indefinitely until stop_event is set
+            if schema_announcer:
+                schema_announcer.retry_pending(mqtt_connection.is_connected) # Packed data is dropped without it
 
     except KeyboardInterrupt: # Redundant if SIGINT is handled, but good fallback
         print("KeyboardInterrupt caught in main loop. Stopping...")
@@ -413,12 +450,13 @@ def main():
             print(f"Warning: Thread {thread.name or i} did not join gracefully within timeout.")
 
     # --- 10. Stop MQTT network loop and disconnect ---
-    if mqtt_client:
+    if mqtt_connection:
         print("Stopping MQTT client...")
-        mqtt_client.loop_stop() # Stop the network loop
-        mqtt_client.disconnect() # Disconnect
+        mqtt_connection.stop() # Stop the connection thread and disconnect
         print("MQTT client stopped.")
 
+    close_db()  # Spill the RAM tier of the offline buffer
+
     if led_indicator:
        led_indicator.cleanup()
 
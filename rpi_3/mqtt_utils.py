@@ -1,42 +1,70 @@
 # mqtt_utils.py
 # -*- coding: utf-8 -*-
 
+import random
+import threading
 import time
 import traceback
 import paho.mqtt.client as mqtt
 
 # --- MQTT Client Setup ---
-mqtt_connected_flag = False  # Флаг для отслеживания состояния подключения
+_publish_listeners = []  # Callbacks fn(mid) called when the broker confirmed a publish (PUBACK for QoS 1)
 
-def create_mqtt_client(client_id=""):
+# Connection states of MqttConnectionManager
+STATE_DISCONNECTED = "disconnected"  # Not started yet
+STATE_CONNECTING = "connecting"      # TCP connect sent, waiting for CONNACK
+STATE_CONNECTED = "connected"
+STATE_BACKOFF = "backoff"            # Connection failed or lost, waiting before the next attempt
+STATE_STOPPED = "stopped"
+
+DEFAULT_KEEPALIVE_SEC = 15
+DEFAULT_RECONNECT = {
+    "initial_delay_sec": 1.0,   # Upper bound of the first retry delay
+    "max_delay_sec": 60.0,      # Upper bound of the retry delay
+    "multiplier": 2.0,          # Growth of the upper bound per failed attempt
+    "connect_timeout_sec": 10.0,  # Max wait for CONNACK
+    "stable_after_sec": 30.0    # A connection that lasted this long resets the backoff
+}
+LOOP_TIMEOUT_SEC = 0.5
+MQTT_PROTOCOLS = {"3.1.1": mqtt.MQTTv311, "5": mqtt.MQTTv5}
+
+def create_mqtt_client(client_id="", protocol="3.1.1", max_inflight=None):
     """
     Создает MQTT-клиент и настраивает обработчики событий.
+    Подключением управляет MqttConnectionManager (on_connect/on_disconnect).
+    :param protocol: "3.1.1" or "5" (MQTT v5 is needed for message expiry).
+    :param max_inflight: In-flight QoS 1 messages (None = paho default of 20).
     """
-    client = mqtt.Client(client_id=client_id.encode('utf-8'))
-    client.on_connect = on_connect
-    client.on_disconnect = on_disconnect
+    client = mqtt.Client(client_id=client_id.encode('utf-8'),
+                         protocol=MQTT_PROTOCOLS.get(str(protocol), mqtt.MQTTv311))
+    if max_inflight:
+        client.max_inflight_messages_set(max_inflight)
     client.on_message = on_message  # Для обработки входящих сообщений, если нужно
+    client.on_publish = on_publish
     return client
 
-def on_connect(client, userdata, flags, rc, properties=None):
-    """
-    Обработчик события подключения к брокеру.
-    """
-    global mqtt_connected_flag
-    if rc == 0:
-        mqtt_connected_flag = True
-        print("Connected to MQTT broker")
-    else:
-        mqtt_connected_flag = False
-        print(f"Failed to connect to MQTT broker (code {rc})")
-
-def on_disconnect(client, userdata, rc, properties=None, *args):
+
+def add_publish_listener(listener):
+    """Registers listener(mid), called from the network thread for every confirmed publish."""
+    if listener not in _publish_listeners:
+        _publish_listeners.append(listener)
+
+
+def remove_publish_listener(listener):
+    if listener in _publish_listeners:
+        _publish_listeners.remove(listener)
+
+
+def on_publish(client, userdata, mid, *args):
     """
-    Обработчик события отключения от брокера.
+    Обработчик подтверждения публикации: for QoS 1 it is called on PUBACK,
+    for QoS 0 once the message has left the client.
     """
-    global mqtt_connected_flag
-    mqtt_connected_flag = False
-    print(f"Disconnected from MQTT broker (rc: {rc})")
+    for listener in list(_publish_listeners):
+        try:
+            listener(mid)
+        except Exception as e:
+            print(f"Error in MQTT publish listener: {e}")
 
 def on_message(client, userdata, message):
     """
@@ -44,71 +72,188 @@ def on_message(client, userdata, message):
     """
     print(f"Received message on topic {message.topic}: {message.payload.decode()}")
 
-def is_mqtt_connected():
-    """
-    Проверяет, подключен ли клиент к MQTT-брокеру.
-    """
-    global mqtt_connected_flag
-    return mqtt_connected_flag
 
-def connect_mqtt(client, broker, port, device_id, stop_event, led_indicator=None):
-    """
-    Подключение к MQTT-брокеру с оптимизированной обработкой разрыва соединения.
+class MqttConnectionManager:
     """
-    global mqtt_connected_flag
-    mqtt_connected_flag = False
-
-    if led_indicator:
-        led_indicator.start_mqtt_connecting()  # Медленное мигание синим
-
-    try:
-        client.connect_async(broker, port, keepalive=15)  # Уменьшен keepalive до 15 секунд
-        client.loop_start()  # Асинхронная обработка событий
-
-        # Ожидание подключения с таймаутом
-        timeout = 10  # Максимальное время ожидания подключения
-        start_time = time.time()
-        while not mqtt_connected_flag and (time.time() - start_time) < timeout and not stop_event.is_set():
-            time.sleep(0.1)
-
-        if stop_event.is_set():
-            if led_indicator:
-                led_indicator.stop_mqtt_connecting()
-            return False
-
-        if not mqtt_connected_flag:
-            if led_indicator:
-                led_indicator.stop_mqtt_connecting()
-                led_indicator.start_mqtt_error()
-            return False
-
-        if led_indicator:
-            led_indicator.start_mqtt_connected()  # Постоянный синий свет
-
-        return True
-
-    except Exception as e:
-        if led_indicator:
-            led_indicator.stop_mqtt_connecting()
-            led_indicator.start_mqtt_error()
-        print(f"MQTT connection error: {e}")
-        return False
-
-def monitor_mqtt_connection(client, stop_event, led_indicator=None):
-    """
-    Функция для мониторинга соединения с брокером. Если соединение теряется, пытается переподключиться.
+    Единственный владелец MQTT-соединения.
+
+    One thread connects, runs the paho network loop (client.loop(), not loop_start(), so paho
+    never reconnects on its own) and reconnects with exponential backoff and full jitter:
+    the n-th retry waits random(0, min(max_delay, initial_delay * multiplier**n)) seconds,
+    so stations that lost a restarted broker together do not come back together.
+
+    States: disconnected -> connecting -> connected -> backoff -> connecting -> ... -> stopped.
+    Listeners: add_state_listener(fn(old_state, new_state)) for every transition and
+    add_connect_listener(fn()) after every successful (re)connect, both called from the
+    manager thread (e.g. FlushCoordinator.trigger, SchemaAnnouncer.on_connect).
     """
-    while not stop_event.is_set():
-        if not is_mqtt_connected():
-            print("Connection lost. Attempting to reconnect...")
-            if led_indicator:
-                led_indicator.start_mqtt_error()
+    def __init__(self, client, config, led_indicator=None):
+        """
+        :param client: Client from create_mqtt_client().
+        :param config: Application config ('mqtt' section: broker, port, keepalive_sec, reconnect).
+        """
+        mqtt_config = config.get('mqtt', {})
+        reconnect_config = dict(DEFAULT_RECONNECT)
+        reconnect_config.update(mqtt_config.get('reconnect', {}))
+        self.client = client
+        self.broker = mqtt_config.get('broker', '127.0.0.1')
+        self.port = mqtt_config.get('port', 1883)
+        self.keepalive_sec = mqtt_config.get('keepalive_sec', DEFAULT_KEEPALIVE_SEC)
+        self.initial_delay_sec = float(reconnect_config['initial_delay_sec'])
+        self.max_delay_sec = float(reconnect_config['max_delay_sec'])
+        self.multiplier = float(reconnect_config['multiplier'])
+        self.connect_timeout_sec = float(reconnect_config['connect_timeout_sec'])
+        self.stable_after_sec = float(reconnect_config['stable_after_sec'])
+        self.led_indicator = led_indicator
+
+        self.state = STATE_DISCONNECTED
+        self.attempt = 0  # Failed attempts since the last stable connection
+        self._connected_since = None
+        self._refused = False
+        self._lock = threading.Lock()
+        self._connected_event = threading.Event()
+        self._stop_event = threading.Event()  # Own event: stop_threads() clears the shared one
+        self._thread = None
+        self._state_listeners = []
+        self._connect_listeners = []
+
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+
+    # --- Listeners ---
+    def add_state_listener(self, listener):
+        """Registers listener(old_state, new_state)."""
+        if listener not in self._state_listeners:
+            self._state_listeners.append(listener)
+
+    def remove_state_listener(self, listener):
+        if listener in self._state_listeners:
+            self._state_listeners.remove(listener)
+
+    def add_connect_listener(self, listener):
+        """Registers listener(), called after every successful (re)connect."""
+        if listener not in self._connect_listeners:
+            self._connect_listeners.append(listener)
+
+    def remove_connect_listener(self, listener):
+        if listener in self._connect_listeners:
+            self._connect_listeners.remove(listener)
+
+    @staticmethod
+    def _notify(listeners, *args):
+        for listener in list(listeners):
+            try:
+                listener(*args)
+            except Exception as e:
+                print(f"Error in MQTT connection listener: {e}")
+
+    # --- State ---
+    def is_connected(self):
+        """Проверяет, подключен ли клиент к MQTT-брокеру."""
+        return self.state == STATE_CONNECTED
+
+    def wait_connected(self, timeout):
+        """Waits up to timeout seconds for the connection. :return: True if connected."""
+        return self._connected_event.wait(timeout)
+
+    def _set_state(self, new_state):
+        with self._lock:
+            old_state = self.state
+            if old_state == new_state or old_state == STATE_STOPPED:
+                return
+            self.state = new_state
+        if new_state == STATE_CONNECTED:
+            self._connected_event.set()
+        else:
+            self._connected_event.clear()
+        self._update_led(old_state, new_state)
+        self._notify(self._state_listeners, old_state, new_state)
+        if new_state == STATE_CONNECTED:
+            self._notify(self._connect_listeners)
+
+    def _update_led(self, old_state, new_state):
+        if not self.led_indicator:
+            return
+        if new_state == STATE_CONNECTED:
+            self.led_indicator.start_mqtt_connected()  # Постоянный синий свет
+        elif new_state == STATE_CONNECTING and old_state == STATE_DISCONNECTED:
+            self.led_indicator.start_mqtt_connecting()  # Медленное мигание синим
+        elif new_state == STATE_BACKOFF and (old_state == STATE_CONNECTED or self.attempt == 0):
+            self.led_indicator.start_mqtt_error()  # Further retries keep the error blink running
+
+    # --- paho callbacks (network loop) ---
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc == 0:
+            print(f"Connected to MQTT broker {self.broker}:{self.port}")
+            self._connected_since = time.monotonic()
+            self._set_state(STATE_CONNECTED)
+        else:
+            self._refused = True
+            print(f"Failed to connect to MQTT broker (code {rc})")
+
+    def _on_disconnect(self, client, userdata, rc, properties=None, *args):
+        print(f"Disconnected from MQTT broker (rc: {rc})")
+        if self.state == STATE_CONNECTED:
+            self._set_state(STATE_BACKOFF)
+
+    # --- Thread ---
+    def start(self):
+        """Starts the connection thread (returns immediately)."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="mqtt-connection", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Disconnects and stops the connection thread."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._set_state(STATE_STOPPED)
+        try:
+            self.client.disconnect()
+        except Exception as e:
+            print(f"MQTT disconnect error: {e}")
+
+    def next_delay(self):
+        """Backoff before the next attempt: full jitter below an exponentially growing bound."""
+        bound = min(self.max_delay_sec, self.initial_delay_sec * self.multiplier ** self.attempt)
+        return random.uniform(0, bound)
+
+    def _connect_once(self):
+        """One connection: connect, run the network loop until it ends. :return: When it ended."""
+        self._refused = False
+        self._set_state(STATE_CONNECTING)
+        try:
+            self.client.connect(self.broker, self.port, keepalive=self.keepalive_sec)
+        except Exception as e:
+            print(f"MQTT connection error: {e}")
+            return
+        deadline = time.monotonic() + self.connect_timeout_sec
+        while not self._stop_event.is_set():
+            rc = self.client.loop(timeout=LOOP_TIMEOUT_SEC)
+            if rc != mqtt.MQTT_ERR_SUCCESS or self._refused:
+                break
+            if self.state == STATE_CONNECTING and time.monotonic() > deadline:
+                print(f"No CONNACK from MQTT broker within {self.connect_timeout_sec:g} s")
+                break
+
+    def _run(self):
+        while not self._stop_event.is_set():
             try:
-                client.reconnect()  # Попытка переподключения
-                print("Reconnected to MQTT broker.")
-                if led_indicator:
-                    led_indicator.start_mqtt_connected()
+                self._connect_once()
             except Exception as e:
-                print(f"Reconnection failed: {e}")
-                time.sleep(5)  # Задержка перед следующей попыткой
-        time.sleep(1)
+                print(f"MQTT connection thread error: {e}")
+                traceback.print_exc()
+            if self._stop_event.is_set():
+                break
+            # Connection lost or attempt failed: a connection that held resets the backoff
+            if self._connected_since is not None and \
+                    time.monotonic() - self._connected_since >= self.stable_after_sec:
+                self.attempt = 0
+            self._connected_since = None
+            delay = self.next_delay()
+            self._set_state(STATE_BACKOFF)
+            print(f"MQTT reconnect attempt {self.attempt + 1} in {delay:.1f} s")
+            self.attempt += 1
+            self._stop_event.wait(delay)
@@ -0,0 +1,193 @@
+# payload_codec.py
+# -*- coding: utf-8 -*-
+"""
+Framing of MQTT payloads sent by the station.
+
+Plain payloads are JSON objects (first byte '{'). Framed payloads start with a 4-byte header:
+
+    byte 0  FRAME_MAGIC (0xA5, never the first byte of a JSON text)
+    byte 1  FORMAT_VERSION
+    byte 2  kind      (KIND_BATCH: the body is a list of payload records,
+                       KIND_RECORD: the body is one payload record,
+                       KIND_PACKED: the body is one packed record, see payload_schema.py)
+    byte 3  encoding  (ENCODING_JSON: UTF-8 JSON, ENCODING_ZLIB_JSON: zlib-compressed UTF-8 JSON,
+                       ENCODING_MSGPACK: MessagePack, ENCODING_ZLIB_MSGPACK: zlib-compressed MessagePack)
+
+MessagePack bodies use compact keys: every well-known field name (COMPACT_KEYS) is replaced by
+its index in that table, and FFT peaks {"freq": f, "amp": a} become [f, a] pairs. Sensor and
+device names stay strings. COMPACT_KEYS is append-only; the receiver keeps the same table.
+
+The wire format of live messages is selected with mqtt.encoding in config.json: "json" sends
+plain JSON (readable by any consumer), "msgpack" sends framed compact MessagePack records, which
+are ~40% smaller than JSON and faster to encode and decode (bench/bench_payload_codec.py
+measures it). msgpack is optional; without it the sender falls back to JSON. The receiver side
+(rpi5/payload_codec.py) detects the form from the first byte.
+"""
+
+import json
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+FRAME_MAGIC = 0xA5
+FORMAT_VERSION = 1
+
+KIND_BATCH = 1
+KIND_RECORD = 2
+KIND_PACKED = 3
+
+ENCODING_JSON = 0
+ENCODING_ZLIB_JSON = 1
+ENCODING_MSGPACK = 2
+ENCODING_ZLIB_MSGPACK = 3
+
+# Names used in config.json
+ENCODING_NAMES = {"json": ENCODING_JSON, "zlib_json": ENCODING_ZLIB_JSON,
+                  "msgpack": ENCODING_MSGPACK, "zlib_msgpack": ENCODING_ZLIB_MSGPACK}
+MSGPACK_ENCODINGS = (ENCODING_MSGPACK, ENCODING_ZLIB_MSGPACK)
+
+# Field names replaced by their index in MessagePack bodies. Append only: the index is the wire code.
+COMPACT_KEYS = (
+    "device_id", "timestamp", "vibration", "temperature", "current", "general",
+    "total_rms", "rms_x", "rms_y", "rms_z", "peak_x", "peak_y", "peak_z",
+    "peak_to_peak_x", "peak_to_peak_y", "peak_to_peak_z", "fft_peaks",
+    "error", "details", "value", "age_sec", "stale",
+    "rollup", "window_sec", "count", "metrics", "min", "mean", "max",
+    "schema_id", "values", "extra",
+)
+COMPACT_KEY_CODES = {key: code for code, key in enumerate(COMPACT_KEYS)}
+FFT_PEAKS_KEY = "fft_peaks"
+
+# Wire formats (mqtt.encoding)
+WIRE_JSON = "json"
+WIRE_MSGPACK = "msgpack"
+
+DEFAULT_COMPRESSION_LEVEL = 6
+
+
+def frame_header(kind, encoding):
+    return bytes((FRAME_MAGIC, FORMAT_VERSION, kind, encoding))
+
+
+def compact_keys(obj):
+    """Replaces well-known keys by their COMPACT_KEYS index and FFT peak dicts by [freq, amp] pairs."""
+    compact = {}
+    for key, value in obj.items():
+        if value.__class__ is dict:
+            value = compact_keys(value)
+        elif value.__class__ is list:
+            if key == FFT_PEAKS_KEY:
+                value = [[peak.get("freq"), peak.get("amp")] if peak.__class__ is dict else peak for peak in value]
+            else:
+                value = [compact_keys(item) if item.__class__ is dict else item for item in value]
+        compact[COMPACT_KEY_CODES.get(key, key)] = value
+    return compact
+
+
+def _expand_pairs(pairs):
+    """msgpack object_pairs_hook: inverse of compact_keys() for one map, called bottom-up by the unpacker."""
+    expanded = {}
+    for key, value in pairs:
+        if key.__class__ is int:
+            key = COMPACT_KEYS[key]
+            if key == FFT_PEAKS_KEY and value.__class__ is list:
+                value = [{"freq": peak[0], "amp": peak[1]} if peak.__class__ is list else peak for peak in value]
+        expanded[key] = value
+    return expanded
+
+
+def _pack(obj):
+    if obj.__class__ is list:
+        return msgpack.packb([compact_keys(item) if item.__class__ is dict else item for item in obj], use_bin_type=True)
+    return msgpack.packb(compact_keys(obj) if obj.__class__ is dict else obj, use_bin_type=True)
+
+
+def encode_body(obj, encoding, level=DEFAULT_COMPRESSION_LEVEL):
+    if encoding in MSGPACK_ENCODINGS:
+        if msgpack is None:
+            raise ValueError("msgpack is not installed")
+        body = _pack(obj)
+        return zlib.compress(body, level) if encoding == ENCODING_ZLIB_MSGPACK else body
+    body = json.dumps(obj, separators=(',', ':')).encode('utf-8')
+    if encoding == ENCODING_ZLIB_JSON:
+        return zlib.compress(body, level)
+    if encoding == ENCODING_JSON:
+        return body
+    raise ValueError(f"Unknown payload encoding {encoding}")
+
+
+def decode_body(body, encoding):
+    if encoding in (ENCODING_ZLIB_JSON, ENCODING_ZLIB_MSGPACK):
+        body = zlib.decompress(body)
+    elif encoding not in (ENCODING_JSON, ENCODING_MSGPACK):
+        raise ValueError(f"Unknown payload encoding {encoding}")
+    if isinstance(body, (bytearray, memoryview)):
+        body = bytes(body)
+    if encoding in MSGPACK_ENCODINGS:
+        if msgpack is None:
+            raise ValueError("msgpack is not installed")
+        return msgpack.unpackb(body, raw=False, strict_map_key=False, object_pairs_hook=_expand_pairs)
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+    return json.loads(body)
+
+
+def encoding_from_name(name, default=ENCODING_ZLIB_JSON):
+    """Maps a config name ("json", "zlib_json", "msgpack", "zlib_msgpack") to an encoding id."""
+    if name is None:
+        return default
+    if name not in ENCODING_NAMES:
+        raise ValueError(f"Unknown payload encoding '{name}', expected one of {', '.join(ENCODING_NAMES)}")
+    encoding = ENCODING_NAMES[name]
+    if encoding in MSGPACK_ENCODINGS and msgpack is None:
+        print(f"msgpack not found. Payload encoding '{name}' falls back to JSON.")
+        return ENCODING_ZLIB_JSON if encoding == ENCODING_ZLIB_MSGPACK else ENCODING_JSON
+    return encoding
+
+
+def wire_format_from_name(name):
+    """Validates mqtt.encoding ("json" or "msgpack"); msgpack falls back to JSON if it is not installed."""
+    if name in (None, WIRE_JSON):
+        return WIRE_JSON
+    if name != WIRE_MSGPACK:
+        raise ValueError(f"Unknown MQTT encoding '{name}', expected '{WIRE_JSON}' or '{WIRE_MSGPACK}'")
+    if msgpack is None:
+        print("msgpack not found. MQTT payloads are sent as JSON.")
+        return WIRE_JSON
+    return WIRE_MSGPACK
+
+
+def wire_format_from_config(config):
+    return wire_format_from_name(config.get('mqtt', {}).get('encoding', WIRE_JSON))
+
+
+def encode_record(payload, wire_format=WIRE_JSON, schema=None):
+    """
+    Encodes one live payload record.
+    :param schema: PayloadSchema; if given, the record is sent as a packed value array (KIND_PACKED).
+    :return: Plain compact JSON for WIRE_JSON, a framed MessagePack record for WIRE_MSGPACK.
+    """
+    if schema is not None:
+        encoding = ENCODING_MSGPACK if wire_format == WIRE_MSGPACK else ENCODING_JSON
+        return frame_header(KIND_PACKED, encoding) + encode_body(schema.pack(payload), encoding)
+    if wire_format == WIRE_MSGPACK:
+        return frame_header(KIND_RECORD, ENCODING_MSGPACK) + encode_body(payload, ENCODING_MSGPACK)
+    return encode_body(payload, ENCODING_JSON)
+
+
+def encode_batch(records, compress=True, level=DEFAULT_COMPRESSION_LEVEL, wire_format=WIRE_JSON):
+    """
+    Packs payload records (dicts) into one batch envelope.
+    :param records: List of payload dicts, oldest first.
+    :param compress: zlib-compress the body.
+    :param wire_format: WIRE_JSON or WIRE_MSGPACK body.
+    :return: bytes of the framed envelope.
+    """
+    if wire_format == WIRE_MSGPACK:
+        encoding = ENCODING_ZLIB_MSGPACK if compress else ENCODING_MSGPACK
+    else:
+        encoding = ENCODING_ZLIB_JSON if compress else ENCODING_JSON
+    return frame_header(KIND_BATCH, encoding) + encode_body(list(records), encoding, level)
@@ -0,0 +1,183 @@
+# payload_schema.py
+# -*- coding: utf-8 -*-
+"""
+Schema announcement and packed payloads.
+
+The names of sensors and fields only change with the configuration, so they are announced
+once per configuration in a retained schema message on <topic>/schema/<device_id>:
+
+{
+    "device_id": "station_1",
+    "schema_id": "5d1c2a7e",            # CRC32 of the field list, changes with the sensor set
+    "format": 1,
+    "fields": [                          # Order of the values in packed records
+        {"group": "vibration", "sensor": "engine", "field": "total_rms", "unit": "g", "scale": 10000},
+        {"group": "vibration", "sensor": "engine", "field": "fft_peaks", "unit": "Hz,g",
+         "scale": [100, 100000], "count": 5},
+        {"group": "temperature", "sensor": "engine_temp", "field": "value", "unit": "C", "scale": 1000},
+        ...
+    ]
+}
+
+Data messages then carry only values (frame kind KIND_PACKED, see payload_codec.py):
+
+{"device_id": .., "timestamp": .., "schema_id": .., "values": [int or None, ...], "extra": {..}}
+
+Values are integers (value * scale). FFT peaks are a flat [freq, amp, freq, amp, ...] list.
+Sensor entries that are not plain measurements (errors, stale temperatures, "general") are
+sent unchanged in "extra", as a partial payload with the usual layout; their slots are None.
+"""
+
+import json
+import math
+import zlib
+
+from config_manager import get_all_current_channels
+from delivery import DeliveryClasses, DELIVERY_SCHEMA
+
+SCHEMA_FORMAT = 1
+SCHEMA_TOPIC_SUFFIX = "schema"
+
+VIBRATION_FIELDS = ("total_rms", "rms_x", "rms_y", "rms_z", "peak_x", "peak_y", "peak_z",
+                    "peak_to_peak_x", "peak_to_peak_y", "peak_to_peak_z")
+VIBRATION_SCALE = 10000  # Metrics are rounded to 4 decimals by the MPU6050 driver
+FFT_FREQ_SCALE = 100
+FFT_AMP_SCALE = 100000
+TEMPERATURE_SCALE = 1000
+CURRENT_SCALE = 1000
+FFT_PEAKS_FIELD = "fft_peaks"
+VALUE_FIELD = "value"
+
+
+def schema_topic(config):
+    """Retained schema topic of this device: <topic>/schema/<device_id>."""
+    mqtt_topic = config.get('mqtt', {}).get('topic', 'sensors/data')
+    return f"{mqtt_topic}/{SCHEMA_TOPIC_SUFFIX}/{config.get('device_id', 'unknown_device')}"
+
+
+def _scaled(value, scale):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        return None
+    return int(round(value * scale))
+
+
+class PayloadSchema:
+    """Field list of the configured sensors; packs payload records into value arrays."""
+    def __init__(self, config):
+        self.device_id = config.get('device_id', 'unknown_device')
+        sensors_config = config.get('sensors', {})
+        n_peaks = sensors_config.get('mpu6050_fft', {}).get('n_peaks', 5)
+
+        fields = []
+        for mpu_cfg in sensors_config.get('mpu6050', []):
+            name = mpu_cfg.get('name')
+            if not name:
+                continue
+            for field in VIBRATION_FIELDS:
+                fields.append({"group": "vibration", "sensor": name, "field": field, "unit": "g",
+                               "scale": VIBRATION_SCALE})
+            fields.append({"group": "vibration", "sensor": name, "field": FFT_PEAKS_FIELD, "unit": "Hz,g",
+                           "scale": [FFT_FREQ_SCALE, FFT_AMP_SCALE], "count": n_peaks})
+        for ds_cfg in sensors_config.get('ds18b20', []):
+            if ds_cfg.get('name'):
+                fields.append({"group": "temperature", "sensor": ds_cfg['name'], "field": VALUE_FIELD, "unit": "C",
+                               "scale": TEMPERATURE_SCALE})
+        for channel_cfg in get_all_current_channels(sensors_config.get('current', {})):
+            if channel_cfg.get('name'):
+                fields.append({"group": "current", "sensor": channel_cfg['name'], "field": VALUE_FIELD, "unit": "A",
+                               "scale": CURRENT_SCALE})
+
+        self.fields = fields
+        canonical = json.dumps(fields, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        self.schema_id = f"{zlib.crc32(canonical):08x}"
+        # Sensor -> slots, in the order of the field list
+        self._sensors = {}  # (group, sensor) -> [(index, field, scale)]
+        for index, field in enumerate(fields):
+            self._sensors.setdefault((field["group"], field["sensor"]), []).append(
+                (index, field["field"], field["scale"]))
+
+    def announcement(self):
+        """Retained schema message (dict)."""
+        return {"device_id": self.device_id, "schema_id": self.schema_id, "format": SCHEMA_FORMAT,
+                "fields": self.fields}
+
+    def pack(self, payload):
+        """
+        Packs a payload record into {"device_id", "timestamp", "schema_id", "values", "extra"}.
+        """
+        values = [None] * len(self.fields)
+        extra = {}
+        for group in ("vibration", "temperature", "current"):
+            group_data = payload.get(group)
+            if not isinstance(group_data, dict):
+                continue
+            for sensor, sensor_data in group_data.items():
+                slots = self._sensors.get((group, sensor))
+                if slots is None or (isinstance(sensor_data, dict) and "error" in sensor_data):
+                    extra.setdefault(group, {})[sensor] = sensor_data
+                    continue
+                if group == "vibration":
+                    if not isinstance(sensor_data, dict):
+                        extra.setdefault(group, {})[sensor] = sensor_data
+                        continue
+                    for index, field, scale in slots:
+                        if field == FFT_PEAKS_FIELD:
+                            peaks = sensor_data.get(FFT_PEAKS_FIELD)
+                            if isinstance(peaks, list):
+                                values[index] = [_scaled(peak.get(key), key_scale) for peak in peaks
+                                                 if isinstance(peak, dict)
+                                                 for key, key_scale in (("freq", scale[0]), ("amp", scale[1]))]
+                        else:
+                            values[index] = _scaled(sensor_data.get(field), scale)
+                else:
+                    scaled = _scaled(sensor_data, slots[0][2])
+                    if scaled is None:
+                        extra.setdefault(group, {})[sensor] = sensor_data  # Stale value dict etc.
+                    else:
+                        values[slots[0][0]] = scaled
+        record = {"device_id": payload.get("device_id", self.device_id), "timestamp": payload.get("timestamp"),
+                  "schema_id": self.schema_id, "values": values}
+        if extra:
+            record["extra"] = extra
+        return record
+
+
+def create_payload_schema(config):
+    """Returns the PayloadSchema of the config, or None if packed payloads are disabled (mqtt.schema.enabled)."""
+    if not config.get('mqtt', {}).get('schema', {}).get('enabled', False):
+        return None
+    return PayloadSchema(config)
+
+
+class SchemaAnnouncer:
+    """
+    Publishes the retained schema message on every (re)connect and when the configuration changed.
+    An announcement the client rejected stays pending and is retried by retry_pending().
+    """
+    def __init__(self, mqtt_client, config, schema):
+        self.mqtt_client = mqtt_client
+        self.topic = schema_topic(config)
+        self.schema = schema
+        self.delivery = DeliveryClasses(config).get(DELIVERY_SCHEMA)
+        self.pending = True  # Not announced yet, or the last announcement was rejected
+
+    def announce(self):
+        try:
+            data = json.dumps(self.schema.announcement(), separators=(',', ':'))
+            info = self.delivery.publish(self.mqtt_client, self.topic, data, retain=True)
+            if getattr(info, 'rc', 0) != 0:
+                raise RuntimeError(f"publish rejected (rc {info.rc})")
+            self.pending = False
+            print(f"Announced payload schema {self.schema.schema_id} on {self.topic}")
+        except Exception as e:
+            self.pending = True
+            print(f"Error announcing payload schema, retrying: {e}")
+
+    def retry_pending(self, is_connected_func):
+        """Re-announces if the last announcement failed (called periodically)."""
+        if self.pending and is_connected_func():
+            self.announce()
+
+    def on_connect(self):
+        """Connect listener (MqttConnectionManager.add_connect_listener)."""
+        self.announce()
@@ -3,16 +3,28 @@
 
 import threading
 import time
-import json
 import copy
 import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
 
 # from mqtt_buffer import append_to_buffer, read_and_clear_buffer
-from mqtt_buffer_sqlite import buffer_message, flush_if_connected
+from mqtt_buffer_sqlite import buffer_message, LANE_ALARM, LANE_LATEST
+from config_manager import get_all_current_channels, MPU_UPDATE_CALL_INTERVAL_SEC
+from payload_codec import encode_record, wire_format_from_config
+from payload_schema import create_payload_schema
+from sensor_topics import create_sensor_topic_publisher
+from deadband import create_deadband_filter
+from edge_rollups import create_edge_rollups
+from delivery import DeliveryClasses, DELIVERY_LIVE, DELIVERY_DEADBAND, DELIVERY_ALARM
 
 # Assuming these are imported in sensor_initializer and passed if needed,
 # or imported here if directly used.
 # For measure_all_currents, it's cleaner to import it here if this module handles current reading.
+try:
+    from sensors.ds18b20 import W1BulkReader
+except ImportError:
+    W1BulkReader = None
+
 try:
     from sensors.current_sensors import measure_all_currents
     CURRENT_SENSORS_MEASUREMENT_AVAILABLE = True
@@ -24,6 +36,54 @@ except ImportError:
 EARTBEAT_TIMEOUT = 30
 
 
+class AlarmStateTracker:
+    """
+    Tracks the set of sensors in error or above their alarm threshold across consecutive payloads.
+    A payload in which this set changes (a new error or breach, or a recovery) belongs to the
+    alarm lane of the offline buffer; all others to the latest-state lane.
+    Thresholds come from config 'alarm_thresholds' ({group: {sensor: value}}, compared with
+    total_rms for vibration and the value for temperature/current) and the 'alarm_c' of DS18B20 entries.
+    """
+    def __init__(self, config):
+        self.thresholds = copy.deepcopy(config.get('alarm_thresholds', {}))
+        for ds_cfg in config.get('sensors', {}).get('ds18b20', []):
+            if ds_cfg.get('name') and ds_cfg.get('alarm_c') is not None:
+                self.thresholds.setdefault('temperature', {}).setdefault(ds_cfg['name'], float(ds_cfg['alarm_c']))
+        self._active = set()
+
+    @staticmethod
+    def _level(group, sensor_data):
+        if group == 'vibration' and isinstance(sensor_data, dict):
+            return sensor_data.get('total_rms')
+        if isinstance(sensor_data, dict):
+            return sensor_data.get('value')  # Stale temperature
+        return sensor_data
+
+    def _alarm_keys(self, payload):
+        keys = set()
+        for group in ('vibration', 'temperature', 'current'):
+            group_data = payload.get(group)
+            if not isinstance(group_data, dict):
+                continue
+            group_thresholds = self.thresholds.get(group, {})
+            for sensor, sensor_data in group_data.items():
+                if isinstance(sensor_data, dict) and 'error' in sensor_data:
+                    keys.add((group, sensor, sensor_data.get('error')))
+                    continue
+                threshold = group_thresholds.get(sensor)
+                level = self._level(group, sensor_data)
+                if threshold is not None and isinstance(level, (int, float)) and level >= threshold:
+                    keys.add((group, sensor, 'threshold'))
+        return keys
+
+    def lane_for(self, payload):
+        """Updates the alarm state with a payload and returns its buffer lane."""
+        keys = self._alarm_keys(payload)
+        changed = keys != self._active
+        self._active = keys
+        return LANE_ALARM if changed else LANE_LATEST
+
+
 def mpu_processing_and_publish_loop(
         mpu_sensors,  # dict of {name: MPU6050_object}
         config,
@@ -33,13 +93,23 @@ def mpu_processing_and_publish_loop(
         latest_temperature_data_ref,
         latest_current_data_ref,
         is_mqtt_connected_func,
-        led_indicator=None
+        led_indicator=None,
+        startup_time=None,  # Time the startup/reconfiguration began, for time-to-first-sample reporting
+        flush_coordinator=None  # Replays the buffer; live publishes are charged to its drain budget
 ):
     print("MPU processing and publishing thread started.")
 
     device_id = config.get('device_id', 'unknown_device')
     mqtt_topic = config.get('mqtt', {}).get('topic', 'sensors/data')
-    mqtt_qos = config.get('mqtt', {}).get('qos', 1)
+    wire_format = wire_format_from_config(config)  # "json" or compact "msgpack"
+    payload_schema = create_payload_schema(config)  # Packed value arrays if mqtt.schema.enabled
+    sensor_topics = create_sensor_topic_publisher(config)  # Retained per-sensor topics if mqtt.sensor_topics.enabled
+    deadband = create_deadband_filter(config)  # Change-based reporting if deadband.enabled
+    delivery = DeliveryClasses(config)
+    # QoS 0 with a short expiry by default; QoS 1 with the deadband, which sends a changed value only once
+    live_delivery = delivery.get(DELIVERY_DEADBAND if deadband else DELIVERY_LIVE)
+    alarm_delivery = delivery.get(DELIVERY_ALARM)  # QoS 1
+    edge_rollups = create_edge_rollups(config)  # 1 s / 1 min aggregates if rollups.enabled
 
     # Interval for computing metrics and publishing
     publish_interval_sec = config.get('intervals', {}).get('fast_sensors_sec', 0.333)
@@ -49,7 +119,7 @@ def mpu_processing_and_publish_loop(
     n_fft_peaks_to_report = fft_config.get('n_peaks', 5)  # Default if not in config
 
     # Interval for calling sensor.update_buffer()
-    update_call_interval_sec = 0.004  # ~4ms (250Hz call rate for update_buffer)
+    update_call_interval_sec = MPU_UPDATE_CALL_INTERVAL_SEC
 
     # Heartbeat monitoring
     HEARTBEAT_TIMEOUT = 30  # seconds without data = connection lost
@@ -59,6 +129,8 @@ def mpu_processing_and_publish_loop(
     if not mpu_sensors:
         print("No MPU sensors configured or initialized. MPU processing loop will not run effectively.")
 
+    alarm_tracker = AlarmStateTracker(config)
+
     while not stop_event.is_set():
         loop_start_time = time.time()
 
@@ -110,30 +182,67 @@ def mpu_processing_and_publish_loop(
                 "current": copy.deepcopy(latest_current_data_ref)
             }
 
+            # Alarm/error state changes go to the high-priority lane if they have to be buffered
+            buffer_lane = alarm_tracker.lane_for(payload)
+
+            # Values inside their deadband are left out (the receiver holds them);
+            # a payload that changes the alarm/error state is sent whole.
+            outgoing = deadband.filter(payload, current_time, force=(buffer_lane == LANE_ALARM)) if deadband else payload
+
+            # Rollups aggregate every value (before the deadband) and go on their own topics
+            if edge_rollups:
+                try:
+                    rollup_bytes = edge_rollups.process(payload, mqtt_client, is_mqtt_connected_func)
+                    if rollup_bytes and flush_coordinator:
+                        flush_coordinator.on_live_publish(rollup_bytes)
+                except Exception as e_rollup:
+                    print(f"Error processing rollups: {e_rollup}")
+
             # --- Publish Data ---
+            delivered = False  # outgoing was published or buffered
             try:
                 if is_mqtt_connected_func():
-                    # First flush any buffered messages
-                    flush_if_connected(mqtt_client, mqtt_topic, mqtt_qos, is_mqtt_connected_func)
-
-                    # Publish current data
-                    mqtt_client.publish(mqtt_topic, json.dumps(payload), qos=mqtt_qos)
+                    # Live data is never delayed; the buffer is replayed by the flush coordinator thread
+                    live_bytes = 0
+                    if outgoing is not None:
+                        data = encode_record(outgoing, wire_format, payload_schema)
+                        delivery_class = alarm_delivery if buffer_lane == LANE_ALARM else live_delivery
+                        info = delivery_class.publish(mqtt_client, mqtt_topic, data)
+                        if getattr(info, 'rc', 0) != 0:
+                            raise RuntimeError(f"publish rejected (rc {info.rc})")
+                        delivered = True
+                        live_bytes += len(data)
+                    if sensor_topics:
+                        # Per-sensor topics have their own rates and get every value
+                        live_bytes += sensor_topics.publish_due(mqtt_client, payload, current_time)
+                    if flush_coordinator:
+                        flush_coordinator.on_live_publish(live_bytes)
 
                     # Update last data time and indicate success
                     last_data_time = current_time
+                    if startup_time is not None:
+                        print(f"Time to first published sample: {time.time() - startup_time:.2f} s")
+                        startup_time = None
                     if led_indicator:
                         led_indicator.data_sent_success()  # Short yellow flash
                 else:
                     # Save to buffer and indicate failure
-                    buffer_message(payload)
+                    if outgoing is not None:
+                        buffer_message(outgoing, buffer_lane)
+                        delivered = True
                     if led_indicator:
                         led_indicator.data_sent_failed()  # Short red flash
             except Exception as e_pub:
                 print(f"Error sending MQTT, save to buffer: {e_pub}")
-                buffer_message(payload)
+                if outgoing is not None and not delivered:
+                    buffer_message(outgoing, buffer_lane)
+                    delivered = True
                 if led_indicator:
                     led_indicator.data_sent_failed()
 
+            if deadband and delivered:
+                deadband.commit(outgoing, current_time)  # Deadbands restart only from delivered values
+
             last_publish_time = loop_start_time
 
         # --- Heartbeat Monitoring ---
@@ -153,21 +262,186 @@ def mpu_processing_and_publish_loop(
     print("MPU processing and publishing thread stopped.")
 
 
-def mqtt_watchdog_loop(mqtt_client, config, stop_event, is_connected_func):
-    """Periodically checks the connection and sends the buffer."""
-    print("MQTT Watchdog thread started.")
-    mqtt_topic = config.get("mqtt", {}).get("topic", "sensors/data")
-    mqtt_qos = config.get("mqtt", {}).get("qos", 1)
-    interval = 10  # second
+class AdaptiveInterval:
+    """
+    Polling interval for slow sensors: drops to min_interval while any value changes by more than
+    change_threshold per cycle or is within alarm_margin of its alarm level, and backs off by
+    backoff_factor per stable cycle up to max_interval.
+    """
+    def __init__(self, base_interval, min_interval, max_interval, change_threshold,
+                 backoff_factor=1.5, alarm_margin=5.0, alarm_levels=None):
+        self.min_interval = float(min_interval)
+        self.max_interval = max(float(max_interval), self.min_interval)
+        self.change_threshold = float(change_threshold)
+        self.backoff_factor = max(float(backoff_factor), 1.0)
+        self.alarm_margin = float(alarm_margin)
+        self.alarm_levels = alarm_levels or {}  # {name: alarm value}
+        self.interval = min(max(float(base_interval), self.min_interval), self.max_interval)
+        self._last_values = {}
+
+    def update(self, readings):
+        """
+        :param readings: Dict {name: value} of this cycle (non-numeric values, e.g. error dicts, are ignored).
+        :return: Interval until the next poll.
+        """
+        urgent = False
+        for name, value in readings.items():
+            if not isinstance(value, (int, float)):
+                continue
+            last_value = self._last_values.get(name)
+            if last_value is not None and abs(value - last_value) >= self.change_threshold:
+                urgent = True
+            alarm_level = self.alarm_levels.get(name)
+            if alarm_level is not None and value >= alarm_level - self.alarm_margin:
+                urgent = True
+            self._last_values[name] = value
+
+        if urgent:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff_factor, self.max_interval)
+        return self.interval
 
-    while not stop_event.is_set():
-        try:
-            flush_if_connected(mqtt_client, mqtt_topic, mqtt_qos, is_connected_func)
-        except Exception as e:
-            print(f"Watchdog error: {e}")
-        stop_event.wait(interval)
 
-    print("MQTT Watchdog thread stopped.")
+class TemperatureReadPool:
+    """
+    Runs DS18B20 reads in a bounded thread pool with a per-read deadline.
+    A read that misses its deadline is not resubmitted while it is still pending (a hung kernel
+    read of a disconnected probe would otherwise eat up the pool); in the meantime the last good
+    value is published with its age. Read latency is tracked per probe.
+    """
+    BULK_KEY = "__bulk__"
+
+    def __init__(self, max_workers=4, read_timeout=2.0, max_stale_age=60.0):
+        self.read_timeout = float(read_timeout)
+        self.max_stale_age = float(max_stale_age)
+        self._executor = ThreadPoolExecutor(max_workers=max(int(max_workers), 1), thread_name_prefix="ds18b20-read")
+        self._pending = {}  # key -> Future still running
+        self._last_good = {}  # name -> (value, timestamp)
+        self._stats = {}  # key -> {"reads", "errors", "timeouts", "total_sec", "max_sec", "last_sec"}
+        self._lock = threading.Lock()
+
+    def _timed_call(self, key, func):
+        start = time.perf_counter()
+        try:
+            return func()
+        finally:
+            self._record_latency(key, time.perf_counter() - start)
+
+    def _stats_for(self, key):
+        """Stats dict of key, created on first use. Caller holds self._lock."""
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = {"reads": 0, "errors": 0, "timeouts": 0,
+                                        "total_sec": 0.0, "max_sec": 0.0, "last_sec": 0.0}
+        return stats
+
+    def _record_latency(self, key, duration_sec):
+        with self._lock:
+            stats = self._stats_for(key)
+            stats["reads"] += 1
+            stats["total_sec"] += duration_sec
+            stats["last_sec"] = duration_sec
+            if duration_sec > stats["max_sec"]:
+                stats["max_sec"] = duration_sec
+
+    def _count(self, key, counter):
+        with self._lock:
+            stats = self._stats_for(key)
+            stats[counter] += 1
+
+    def _submit(self, key, func):
+        """Submits func unless a read for key is still pending. Returns the (new or pending) future."""
+        future = self._pending.get(key)
+        if future is not None and not future.done():
+            return future
+        future = self._executor.submit(self._timed_call, key, func)
+        self._pending[key] = future
+        return future
+
+    def _collect(self, futures_by_key, timeout):
+        """Waits up to timeout for the futures. Returns {key: result or Exception} for finished ones."""
+        wait(list(futures_by_key.values()), timeout=timeout)
+        results = {}
+        for key, future in futures_by_key.items():
+            if not future.done():
+                self._count(key, "timeouts")
+                continue
+            self._pending.pop(key, None)
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                self._count(key, "errors")
+                results[key] = e
+        return results
+
+    def _remember(self, results):
+        now = time.time()
+        for name, value in results.items():
+            if isinstance(value, float):
+                self._last_good[name] = (value, now)
+
+    def read_bulk(self, bulk_reader):
+        """
+        Runs one W1BulkReader.read_all() in the pool.
+        :return: Dict {name: temperature or Exception}, empty if the bulk read missed its deadline.
+        """
+        results = self._collect({self.BULK_KEY: self._submit(self.BULK_KEY, bulk_reader.read_all)}, self.read_timeout)
+        bulk_results = results.get(self.BULK_KEY)
+        if isinstance(bulk_results, Exception):
+            print(f"Bulk temperature read error: {bulk_results}")
+            return {}
+        if bulk_results is None:
+            print(f"Bulk temperature read did not finish within {self.read_timeout} s.")
+            return {}
+        self._remember(bulk_results)
+        return bulk_results
+
+    def read_individual(self, sensors):
+        """
+        Reads every sensor of {name: DS18B20} concurrently with get_temperature().
+        :return: Dict {name: temperature or Exception}; sensors that missed the deadline are absent.
+        """
+        futures = {name: self._submit(name, sensor.get_temperature) for name, sensor in sensors.items()}
+        results = self._collect(futures, self.read_timeout)
+        self._remember(results)
+        return results
+
+    def get_cached(self, name):
+        """
+        Returns the last good value as {"value", "age_sec", "stale": True},
+        or None if there is none or it is older than max_stale_age.
+        """
+        cached = self._last_good.get(name)
+        if cached is None:
+            return None
+        value, timestamp = cached
+        age_sec = time.time() - timestamp
+        if age_sec > self.max_stale_age:
+            return None
+        return {"value": round(value, 3), "age_sec": round(age_sec, 1), "stale": True}
+
+    def get_latency_stats(self):
+        """Returns {key: {"reads", "errors", "timeouts", "avg_ms", "max_ms", "last_ms"}}."""
+        with self._lock:
+            return {key: {
+                "reads": stats["reads"],
+                "errors": stats["errors"],
+                "timeouts": stats["timeouts"],
+                "avg_ms": round(1000.0 * stats["total_sec"] / stats["reads"], 1) if stats["reads"] else 0.0,
+                "max_ms": round(1000.0 * stats["max_sec"], 1),
+                "last_ms": round(1000.0 * stats["last_sec"], 1)
+            } for key, stats in self._stats.items()}
+
+    def print_latency_report(self):
+        for key, stats in self.get_latency_stats().items():
+            label = "bulk conversion" if key == self.BULK_KEY else key
+            print(f"DS18B20 {label}: {stats['reads']} reads, avg {stats['avg_ms']} ms, max {stats['max_ms']} ms, "
+                  f"last {stats['last_ms']} ms, {stats['errors']} errors, {stats['timeouts']} timeouts")
+
+    def shutdown(self):
+        # Do not wait for hung reads; pending futures are cancelled
+        self._executor.shutdown(wait=False, cancel_futures=True)
 
 
 def temperature_thread_loop(temp_sensors_dict, config, stop_event, latest_temperature_data_ref, led_indicator=None):
@@ -178,28 +452,92 @@ def temperature_thread_loop(temp_sensors_dict, config, stop_event, latest_temper
     # Get the set of all configured temperature sensor names from config
     configured_names = {cfg.get('name') for cfg in config.get('sensors', {}).get('ds18b20', []) if cfg.get('name')}
     read_interval = config.get('intervals', {}).get('temperature_sec', 5.0)
+    ds_settings = config.get('sensors', {}).get('ds18b20_settings', {})
+
+    # Adaptive polling: fast while temperatures change or approach their alarm level, slow when stable
+    adaptive_cfg = ds_settings.get('adaptive', {})
+    adaptive_interval = None
+    if adaptive_cfg.get('enabled', False):
+        alarm_levels = {cfg.get('name'): float(cfg['alarm_c'])
+                        for cfg in config.get('sensors', {}).get('ds18b20', [])
+                        if cfg.get('name') and cfg.get('alarm_c') is not None}
+        adaptive_interval = AdaptiveInterval(
+            base_interval=read_interval,
+            min_interval=adaptive_cfg.get('min_interval_sec', 1.0),
+            max_interval=adaptive_cfg.get('max_interval_sec', 30.0),
+            change_threshold=adaptive_cfg.get('change_threshold_c', 0.25),
+            backoff_factor=adaptive_cfg.get('backoff_factor', 1.5),
+            alarm_margin=adaptive_cfg.get('alarm_margin_c', 5.0),
+            alarm_levels=alarm_levels
+        )
+
+    # Bulk conversion: one conversion for all sensors of a w1 bus master instead of one per sensor
+    bulk_reader = None
+    if ds_settings.get('bulk_read', True) and W1BulkReader is not None:
+        try:
+            bulk_reader = W1BulkReader(temp_sensors_dict)
+            if bulk_reader.masters:
+                print(f"Temperature thread: bulk conversion for {sum(len(s) for s in bulk_reader.masters.values())} "
+                      f"sensor(s) on {len(bulk_reader.masters)} bus master(s).")
+            else:
+                print("Temperature thread: w1 bus master has no therm_bulk_read support, reading sensors one by one.")
+                bulk_reader = None
+        except Exception as e:
+            print(f"Temperature thread: bulk read setup failed ({e}), reading sensors one by one.")
+            bulk_reader = None
+
+    # Reads run in a small I/O pool with a deadline, so a hung probe never delays the others
+    read_pool = TemperatureReadPool(
+        max_workers=ds_settings.get('read_workers', 4),
+        read_timeout=ds_settings.get('read_timeout_sec', 2.0),
+        max_stale_age=ds_settings.get('max_stale_age_sec', 60.0)
+    )
+    latency_report_interval = ds_settings.get('latency_report_interval_sec', 300.0)
+    last_latency_report = time.time()
 
     while not stop_event.is_set():
         start_time = time.time()
         current_reads_this_cycle = {} # Store reads for this cycle
 
-        # Read from successfully initialized sensors
-        for name, sensor in temp_sensors_dict.items():
-            try:
-                temp = sensor.get_temperature() # DS18B20 class method
-                # Round if it's a float, else keep as is (e.g. if it returns error dict)
-                current_reads_this_cycle[name] = round(temp, 3) if isinstance(temp, float) else temp
-            except Exception as e:
-                print(f"Temperature read error for '{name}': {e}")
-                current_reads_this_cycle[name] = {"error": "read_failed", "details": str(e)}
-                if led_indicator:
-                    # Indicate sensor read failure, maybe blink yellow and red
-                    led_indicator.set_yellow(True)
-                    time.sleep(0.05)
-                    led_indicator.set_yellow(False)
-                    led_indicator.set_red(True)
-                    time.sleep(0.05)
-                    led_indicator.set_red(False)
+        bulk_results = {}
+        if bulk_reader:
+            bulk_results = read_pool.read_bulk(bulk_reader)
+
+        # Not on a bulk-capable master, or the bulk read failed: individual conversions
+        individual_sensors = {name: sensor for name, sensor in temp_sensors_dict.items()
+                              if not isinstance(bulk_results.get(name), float)}
+        individual_results = read_pool.read_individual(individual_sensors) if individual_sensors else {}
+
+        for name in temp_sensors_dict:
+            temp = bulk_results.get(name)
+            if not isinstance(temp, float):
+                temp = individual_results.get(name)
+            if isinstance(temp, float):
+                current_reads_this_cycle[name] = round(temp, 3)
+                continue
+            # Read failed or missed its deadline: publish the last good value while it is fresh enough
+            cached = read_pool.get_cached(name)
+            if cached is not None:
+                current_reads_this_cycle[name] = cached
+                continue
+            if isinstance(temp, Exception):
+                print(f"Temperature read error for '{name}': {temp}")
+                current_reads_this_cycle[name] = {"error": "read_failed", "details": str(temp)}
+            else:
+                current_reads_this_cycle[name] = {"error": "read_timeout",
+                                                  "details": f"No result within {read_pool.read_timeout} s"}
+            if led_indicator:
+                # Indicate sensor read failure, maybe blink yellow and red
+                led_indicator.set_yellow(True)
+                time.sleep(0.05)
+                led_indicator.set_yellow(False)
+                led_indicator.set_red(True)
+                time.sleep(0.05)
+                led_indicator.set_red(False)
+
+        if latency_report_interval and time.time() - last_latency_report >= latency_report_interval:
+            read_pool.print_latency_report()
+            last_latency_report = time.time()
 
         # Update shared data for *all* configured sensors.
         # If a sensor wasn't in temp_sensors_dict (failed init), its state remains as set by init.
@@ -214,6 +552,8 @@ def temperature_thread_loop(temp_sensors_dict, config, stop_event, latest_temper
                      # This case should ideally be covered by main's pre-population
                      latest_temperature_data_ref[name] = {"error": "sensor_not_polled"}
 
+        if adaptive_interval:
+            read_interval = adaptive_interval.update(current_reads_this_cycle)
 
         # Calculate sleep time and wait
         elapsed_time = time.time() - start_time
@@ -221,15 +561,18 @@ def temperature_thread_loop(temp_sensors_dict, config, stop_event, latest_temper
         if sleep_time > 0:
             stop_event.wait(sleep_time)
 
+    read_pool.shutdown()
     print("Temperature thread stopped.")
 
 
 def current_thread_loop(current_sensor_data, config, stop_event, latest_current_data_ref, led_indicator=None):
     """
     Thread function to read current sensors periodically and update shared data.
-    current_sensor_data should be the dict returned by initialize_current_sensors.
+    current_sensor_data should be the dict returned by initialize_current_sensors,
+    or one of its 'adc_groups' entries (one thread per ADC, all writing into the same shared dict).
     """
-    print("Current thread started.")
+    adc_label = current_sensor_data.get('adc_label', '') if current_sensor_data else ''
+    print(f"Current thread started{f' for ADC {adc_label}' if adc_label else ''}.")
 
     if not CURRENT_SENSORS_MEASUREMENT_AVAILABLE:
         print("Current sensor measurement function not available. Current thread exiting.")
@@ -253,9 +596,13 @@ def current_thread_loop(current_sensor_data, config, stop_event, latest_current_
         # Errors should already be set.
         return
 
-    # Get the set of all configured current channel names from config
-    configured_names = {cfg.get('name') for cfg in config.get('sensors', {}).get('current', {}).get('channels', []) if cfg.get('name')}
+    # Channel names this worker is responsible for (per-ADC group), falling back to all configured channels
+    if current_sensor_data.get('configured_names') is not None:
+        configured_names = set(current_sensor_data['configured_names'])
+    else:
+        configured_names = {cfg.get('name') for cfg in get_all_current_channels(config.get('sensors', {}).get('current', {})) if cfg.get('name')}
     read_interval = config.get('intervals', {}).get('fast_sensors_sec', 0.333) # Using fast_sensors_sec for current
+    samples_per_reading = int(config.get('sensors', {}).get('current', {}).get('samples_per_reading', 500))
 
     while not stop_event.is_set():
         start_time = time.time()
@@ -264,7 +611,8 @@ def current_thread_loop(current_sensor_data, config, stop_event, latest_current_
         try:
             # measure_all_currents should take channel_analogin_map and channel_offset_map
             # and return a dictionary like { 'channel_name1': value1, 'channel_name2': value2_or_error_dict }
-            measured_data = measure_all_currents(channel_analogin_map, channel_offset_map, channel_scale_map)
+            measured_data = measure_all_currents(channel_analogin_map, channel_offset_map, channel_scale_map,
+                                                 samples=samples_per_reading)
 
             if not isinstance(measured_data, dict):
                 # This indicates a problem with measure_all_currents implementation
@@ -301,4 +649,4 @@ def current_thread_loop(current_sensor_data, config, stop_event, latest_current_
         if sleep_time > 0:
             stop_event.wait(sleep_time)
 
-    print("Current thread stopped.")
+    print(f"Current thread stopped{f' for ADC {adc_label}' if adc_label else ''}.")
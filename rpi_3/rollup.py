@@ -0,0 +1,178 @@
+# rollup.py
+# -*- coding: utf-8 -*-
+"""
+min/mean/max rollups of the scalar metrics of sensor payloads.
+
+Used by the offline buffer to compact old backlog into coarse history, and by the
+edge aggregators that publish rollups on their own topics.
+
+Rollup record layout (a normal payload record with a "rollup" section instead of raw data):
+{
+    "device_id": "station_1",
+    "timestamp": 1700000040.0,          # Window start
+    "rollup": {
+        "window_sec": 60,
+        "count": 180,                   # Payloads aggregated
+        "metrics": {
+            "vibration": {"engine": {"total_rms": {"min": .., "mean": .., "max": .., "count": ..}, ...}},
+            "temperature": {"engine_temp": {"value": {"min": .., "mean": .., "max": .., "count": ..}}},
+            "current": {"phase_a": {"value": {...}}}
+        }
+    }
+}
+"""
+
+import math
+
+ROLLUP_GROUPS = ("vibration", "temperature", "current")
+SCALAR_FIELD = "value"  # Field name of single-value sensors (temperature, current)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def iter_scalar_metrics(payload):
+    """
+    Yields (group, sensor, field, value) for every numeric metric of a payload record.
+    Error entries, FFT peak lists and other non-scalar values are skipped; a stale temperature
+    ({"value": .., "age_sec": .., "stale": true}) counts with its value.
+    """
+    for group in ROLLUP_GROUPS:
+        group_data = payload.get(group)
+        if not isinstance(group_data, dict):
+            continue
+        for sensor, sensor_data in group_data.items():
+            if _is_number(sensor_data):
+                yield group, sensor, SCALAR_FIELD, sensor_data
+            elif isinstance(sensor_data, dict):
+                if "error" in sensor_data:
+                    continue
+                if "value" in sensor_data and group != "vibration":
+                    if _is_number(sensor_data["value"]):
+                        yield group, sensor, SCALAR_FIELD, sensor_data["value"]
+                    continue
+                for field, value in sensor_data.items():
+                    if _is_number(value):
+                        yield group, sensor, field, value
+
+
+class _FieldStats:
+    __slots__ = ('min', 'max', 'total', 'count')
+
+    def __init__(self, value):
+        self.min = value
+        self.max = value
+        self.total = value
+        self.count = 1
+
+    def add(self, value):
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.total += value
+        self.count += 1
+
+    def merge(self, stats):
+        """Merges another rollup field {"min", "mean", "max", "count"}."""
+        count = stats.get("count", 1)
+        self.min = min(self.min, stats["min"])
+        self.max = max(self.max, stats["max"])
+        self.total += stats["mean"] * count
+        self.count += count
+
+    def as_dict(self, digits):
+        return {"min": round(self.min, digits), "mean": round(self.total / self.count, digits),
+                "max": round(self.max, digits), "count": self.count}
+
+
+class RollupAccumulator:
+    """Streaming min/mean/max/count per metric for one time window."""
+    def __init__(self, device_id, window_start, window_sec, digits=4):
+        self.device_id = device_id
+        self.window_start = window_start
+        self.window_sec = window_sec
+        self.digits = digits
+        self.count = 0
+        self._fields = {}  # (group, sensor, field) -> _FieldStats
+
+    def add(self, payload):
+        """Adds one payload record (raw, or a rollup record of a finer window)."""
+        if "rollup" in payload:
+            self._merge_rollup(payload["rollup"])
+            return
+        self.count += 1
+        for group, sensor, field, value in iter_scalar_metrics(payload):
+            key = (group, sensor, field)
+            stats = self._fields.get(key)
+            if stats is None:
+                self._fields[key] = _FieldStats(value)
+            else:
+                stats.add(value)
+
+    def add_value(self, group, sensor, field, value):
+        """Adds a single value without counting a payload."""
+        if not _is_number(value):
+            return
+        key = (group, sensor, field)
+        stats = self._fields.get(key)
+        if stats is None:
+            self._fields[key] = _FieldStats(value)
+        else:
+            stats.add(value)
+
+    def _merge_rollup(self, rollup):
+        self.count += rollup.get("count", 0)
+        for group, sensors in rollup.get("metrics", {}).items():
+            for sensor, fields in sensors.items():
+                for field, stats in fields.items():
+                    key = (group, sensor, field)
+                    if key in self._fields:
+                        self._fields[key].merge(stats)
+                    else:
+                        merged = _FieldStats(stats["min"])
+                        merged.max = stats["max"]
+                        merged.count = stats.get("count", 1)
+                        merged.total = stats["mean"] * merged.count
+                        self._fields[key] = merged
+
+    def is_empty(self):
+        return self.count == 0 and not self._fields
+
+    def to_record(self):
+        """Returns the rollup record of this window."""
+        metrics = {}
+        for (group, sensor, field), stats in self._fields.items():
+            metrics.setdefault(group, {}).setdefault(sensor, {})[field] = stats.as_dict(self.digits)
+        return {
+            "device_id": self.device_id,
+            "timestamp": self.window_start,
+            "rollup": {
+                "window_sec": self.window_sec,
+                "count": self.count,
+                "metrics": metrics
+            }
+        }
+
+
+def window_start(timestamp, window_sec):
+    """Start of the window of length window_sec that contains timestamp."""
+    return math.floor(timestamp / window_sec) * window_sec
+
+
+def rollup_payloads(payloads, window_sec, device_id=None):
+    """
+    Aggregates payload records into one rollup record per window.
+    :param payloads: Payload records, oldest first.
+    :return: List of rollup records, oldest first.
+    """
+    accumulators = {}
+    for payload in payloads:
+        start = window_start(payload.get("timestamp", 0.0), window_sec)
+        accumulator = accumulators.get(start)
+        if accumulator is None:
+            accumulator = RollupAccumulator(device_id or payload.get("device_id", "unknown_device"), start, window_sec)
+            accumulators[start] = accumulator
+        accumulator.add(payload)
+    return [accumulators[start].to_record() for start in sorted(accumulators)]
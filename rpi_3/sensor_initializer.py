@@ -3,9 +3,20 @@
 
 import traceback
 import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import board # Import board if needed for I2C initialization (depends on current_sensors.py)
 
+from config_manager import get_adc_configs
+from calibration_store import mpu_profile_key, current_profile_key
+
 # --- Sensor Modules (Import with try-except) ---
+try:
+    from i2c_bus_manager import get_bus_manager
+except ImportError:
+    get_bus_manager = None
+
 try:
     from sensors.mpu6050 import MPU6050
     print("MPU6050 module loaded.")
@@ -33,13 +44,14 @@ except ImportError:
     print("current_sensors module/functions not found. Current data features will be limited.")
 
 
-def initialize_mpu_sensors(mpu_config_list, latest_vibration_data_ref, calibrate_flag=None):
+def initialize_mpu_sensors(mpu_config_list, latest_vibration_data_ref, calibrate_flag=None, calibration_store=None):
     """
     Initializes MPU6050 sensors.
     Updates latest_vibration_data_ref with specific errors or removes error on success.
     :param mpu_config_list: List of MPU sensor configurations.
     :param latest_vibration_data_ref: Reference to the shared vibration data dictionary.
-    :param calibrate_flag: None (auto), True (force), False (skip).
+    :param calibrate_flag: None (auto: reuse a fresh stored profile, otherwise calibrate), True (force), False (skip).
+    :param calibration_store: Optional CalibrationStore for persisted calibration profiles.
     :return: Dictionary of {name: MPU6050_object}.
     """
     initialized_sensors = {}
@@ -74,13 +86,24 @@ def initialize_mpu_sensors(mpu_config_list, latest_vibration_data_ref, calibrate
 
             # Pass configured sample_rate and buffer_size to constructor
             sensor = MPU6050(bus=bus, address=address,
-                             sample_rate_hz=sample_rate, buffer_size=buffer_size_cfg)
+                             sample_rate_hz=sample_rate, buffer_size=buffer_size_cfg,
+                             bus_manager=get_bus_manager() if get_bus_manager else None, name=name)
 
-            if calibrate_flag is not False:  # calibrate_flag can be None (use default), True, or False
+            profile_key = mpu_profile_key(bus, address)
+            stored_profile = None
+            if calibrate_flag is None and calibration_store:
+                stored_profile = calibration_store.get(profile_key)
+
+            if calibrate_flag is False:
+                print(f"Skipping calibration for MPU6050 '{name}'.")
+            elif stored_profile and 'accel_offset' in stored_profile:
+                sensor.set_accel_offset(stored_profile['accel_offset'])
+                print(f"Using stored calibration profile for MPU6050 '{name}' ({profile_key}).")
+            else:  # calibrate_flag is True (force) or no fresh stored profile
                 print(f"Calibrating MPU6050 '{name}'...")
                 sensor.calibrate(samples=200)  # You can make 'samples' configurable too
-            else:
-                print(f"Skipping calibration for MPU6050 '{name}'.")
+                if calibration_store:
+                    calibration_store.put(profile_key, {"accel_offset": dict(sensor.accel_offset), "samples": 200})
 
             print(f"MPU6050 '{name}' initialized successfully.")
             initialized_sensors[name] = sensor
@@ -130,6 +153,14 @@ def initialize_ds18b20_sensors(ds_config_list, latest_temperature_data_ref):
         try:
             print(f"Initializing DS18B20 '{name}' ({sensor_id})...")
             sensor = DS18B20(sensor_id=sensor_id)
+            resolution = sensor_cfg.get('resolution')
+            if resolution is not None:
+                try:
+                    sensor.set_resolution(resolution)
+                    print(f"DS18B20 '{name}' resolution set to {resolution} bit.")
+                except Exception as e_res:
+                    # Not fatal: the sensor keeps working at its current resolution
+                    print(f"Warning: could not set resolution {resolution} for DS18B20 '{name}': {e_res}")
             # Optional: Test read, but can be slow. Assume constructor success implies basic functionality.
             # temp = sensor.get_temperature()
             print(f"DS18B20 '{name}' initialized successfully.")
@@ -148,15 +179,159 @@ def initialize_ds18b20_sensors(ds_config_list, latest_temperature_data_ref):
     return initialized_sensors
 
 
-def initialize_current_sensors(current_config_data, latest_current_data_ref, calibrate_flag=None):
+def _initialize_adc_group(adc_cfg, channels_cfg, latest_current_data_ref, calibrate_flag=None, claimed_names=None,
+                          calibration_store=None):
     """
-    Initializes current sensors (ADC, calibration, individual offsets/scales).
+    Initializes one ADS1115 device and its channels (AnalogIn objects, offsets, scales, calibration).
+    Updates latest_current_data_ref with per-channel errors or removes errors on success.
+    :param claimed_names: Set of channel names already used by other ADCs (names must be unique
+                          because all channels are merged into one 'current' payload section).
+    :param calibration_store: Optional CalibrationStore; with calibrate_flag None, channels with a fresh
+                              stored offset are not recalibrated.
+    :return: Group dict {'adc_label', 'adc_instance', 'channel_analogin_map', 'channel_offset_map',
+             'channel_scale_map', 'configured_names'} or None if nothing usable was initialized.
+    """
+    claimed_names = claimed_names if claimed_names is not None else set()
+    adc_label = f"bus{adc_cfg.get('bus', 1)}_{adc_cfg.get('address')}"
+    configured_names = [ch.get('name') for ch in channels_cfg if ch.get('name')]
+
+    print(f"Initializing ADC {adc_label} for current sensors...")
+    adc_instance = init_adc(adc_cfg)
+    if not adc_instance:
+        raise Exception(f"ADC initialization via init_adc() failed for {adc_label}.")
+    print(f"ADC {adc_label} initialized successfully.")
+
+    # --- Prepare channel maps and calibration lists ---
+    channel_analogin_map_temp = {}
+    channel_offset_map_temp = {}
+    channel_scale_map_temp = {}
+    channels_to_calibrate_list = []
+    channel_name_order = []
+    channel_profile_keys = {}
+    adc_bus = adc_cfg.get('bus', 1)
+    adc_address = int(adc_cfg.get('address'), 0)
+
+    for channel_cfg in channels_cfg:
+        name = channel_cfg.get('name')
+        adc_channel_index = channel_cfg.get('adc_channel')
+        offset = channel_cfg.get('offset', 0.0)
+        scale = channel_cfg.get('scale', 1.0)
+
+        if not name or adc_channel_index is None:
+            print(f"Current channel config missing name or adc_channel: {channel_cfg}, skipping.")
+            if name:
+                latest_current_data_ref[name] = {"error": "config_incomplete", "details": "Missing name or adc_channel"}
+            continue
+
+        if name in claimed_names:
+            print(f"Duplicate current channel name '{name}' on ADC {adc_label}. Channel names must be unique across ADCs. Skipping.")
+            latest_current_data_ref[name] = {"error": "duplicate_channel_name", "details": f"Name already used, ADC {adc_label}"}
+            continue
+
+        if not isinstance(adc_channel_index, int) or not (0 <= adc_channel_index <= 3):
+            print(f"Invalid ADC channel index {adc_channel_index} for channel '{name}'. Must be 0-3. Skipping.")
+            latest_current_data_ref[name] = {"error": "invalid_channel_index", "details": f"Index {adc_channel_index} out of range"}
+            continue
+
+        try:
+            analog_in_obj = AnalogIn(adc_instance, adc_channel_index)
+            channel_analogin_map_temp[name] = analog_in_obj
+            channel_offset_map_temp[name] = offset
+            channel_scale_map_temp[name] = scale
+            claimed_names.add(name)
+            profile_key = current_profile_key(adc_bus, adc_address, adc_channel_index)
+            channel_profile_keys[name] = profile_key
+
+            stored_profile = None
+            if calibrate_flag is None and calibration_store:
+                stored_profile = calibration_store.get(profile_key)
+            if stored_profile and 'offset_v' in stored_profile:
+                channel_offset_map_temp[name] = stored_profile['offset_v']
+                channel_cfg['offset'] = stored_profile['offset_v']
+                print(f"Using stored calibration profile for current channel '{name}' ({profile_key}).")
+            else:
+                channels_to_calibrate_list.append(analog_in_obj)
+                channel_name_order.append(name)
+            if name in latest_current_data_ref and isinstance(latest_current_data_ref[name], dict) and "error" in latest_current_data_ref[name]:
+                del latest_current_data_ref[name]
+            if name not in latest_current_data_ref:
+                latest_current_data_ref[name] = 0.0
+        except Exception as e_analog:
+            print(f"Error creating AnalogIn for channel '{name}' (ADC {adc_label}, index {adc_channel_index}): {e_analog}")
+            traceback.print_exc()
+            latest_current_data_ref[name] = {"error": "analogin_creation_failed", "details": str(e_analog)}
+
+    if not channel_analogin_map_temp:
+        print(f"No valid current sensor channels configured or initialized on ADC {adc_label}.")
+        return None
+
+    # --- Calibration ---
+    if not channels_to_calibrate_list:
+        print(f"All channels on ADC {adc_label} use stored calibration profiles.")
+    elif calibrate_flag is False:
+        print(f"Calibration skipped (--no-calibrate or config) for ADC {adc_label}. Using offset from config.")
+    else:
+        print(f"Calibrating current sensors on ADC {adc_label} (zero current expected)...")
+        offset_voltages_list = calibrate_current_sensors(channels_to_calibrate_list)
+        if not offset_voltages_list or len(offset_voltages_list) != len(channels_to_calibrate_list):
+            print(f"Current sensor calibration failed or returned incorrect number of offsets on ADC {adc_label}.")
+            for name in channel_name_order:
+                if name not in latest_current_data_ref or not (isinstance(latest_current_data_ref[name], dict) and "error" in latest_current_data_ref[name]):
+                    latest_current_data_ref[name] = {
+                        "error": "calibration_failed_group",
+                        "details": "Mismatch in offset count or calibration process error"
+                    }
+            return None
+        # Update offset maps and config with new offsets
+        for i, name in enumerate(channel_name_order):
+            channel_offset_map_temp[name] = offset_voltages_list[i]
+            # Update config for this channel
+            for ch_cfg in channels_cfg:
+                if ch_cfg.get('name') == name:
+                    ch_cfg['offset'] = offset_voltages_list[i]
+            if calibration_store:
+                calibration_store.put(channel_profile_keys[name], {"offset_v": offset_voltages_list[i]})
+
+    return {
+        'adc_label': adc_label,
+        'adc_instance': adc_instance,
+        'channel_analogin_map': channel_analogin_map_temp,
+        'channel_offset_map': channel_offset_map_temp,
+        'channel_scale_map': channel_scale_map_temp,
+        'configured_names': configured_names
+    }
+
+
+def _initialize_adc_group_safe(adc_cfg, channels_cfg, latest_current_data_ref, **kwargs):
+    """Runs _initialize_adc_group, marking the ADC's channels as failed on a critical error."""
+    try:
+        return _initialize_adc_group(adc_cfg, channels_cfg, latest_current_data_ref, **kwargs)
+    except Exception as e_group:
+        print(f"Critical error during current sensor initialization: {e_group}")
+        traceback.print_exc()
+        for channel_cfg in channels_cfg:
+            name = channel_cfg.get('name')
+            if name and (name not in latest_current_data_ref or not (isinstance(latest_current_data_ref[name], dict) and "error" in latest_current_data_ref[name])):
+                latest_current_data_ref[name] = {"error": "initialization_failed_due_to_critical_error", "details": str(e_group)}
+        return None
+
+
+def initialize_current_sensors(current_config_data, latest_current_data_ref, calibrate_flag=None, calibration_store=None,
+                               runner=None):
+    """
+    Initializes current sensors on one or more ADS1115 devices (ADC, calibration, individual offsets/scales).
     Updates latest_current_data_ref with errors or removes errors on success.
-    Returns a dictionary with initialized ADC instance, channel_analogin_map, channel_offset_map, channel_scale_map.
-    Updates config (current_config_data['channels']) with new offsets after calibration.
+    Returns a dictionary with merged channel_analogin_map, channel_offset_map, channel_scale_map
+    (all ADCs together, as published in the 'current' payload section) and 'adc_groups':
+    a list of per-ADC dicts, each of which is sampled by its own worker thread.
+    'adc_instance' holds the first ADC for backward compatibility.
+    Updates config (channel 'offset' values) with new offsets after calibration.
+    calibrate_flag: None (auto: reuse fresh stored profiles), True (force), False (skip).
+    runner: Optional BusAwareInitRunner to initialize the ADCs concurrently.
     """
     initialized_cs_data = {
         'adc_instance': None,
+        'adc_groups': [],
         'channel_analogin_map': {},
         'channel_offset_map': {},
         'channel_scale_map': {}
@@ -165,110 +340,131 @@ def initialize_current_sensors(current_config_data, latest_current_data_ref, cal
     if not CURRENT_SENSORS_AVAILABLE:
         return None
 
-    adc_cfg = current_config_data.get('adc')
-    channels_cfg = current_config_data.get('channels')  # List of dicts
-
-    if not adc_cfg:
-        print("Current sensor ADC configuration missing.")
-        return None
-    if not channels_cfg:
-        print("Current sensor channel configurations missing.")
+    adc_blocks = get_adc_configs(current_config_data)
+    if not adc_blocks:
+        if not current_config_data.get('adc') and not current_config_data.get('adcs'):
+            print("Current sensor ADC configuration missing.")
+        else:
+            print("Current sensor channel configurations missing.")
         return None
 
-    try:
-        print("Initializing ADC for current sensors...")
-        adc_instance = init_adc(adc_cfg)
-        if not adc_instance:
-            raise Exception("ADC initialization via init_adc() failed.")
-        initialized_cs_data['adc_instance'] = adc_instance
-        print("ADC initialized successfully.")
-
-        # --- Prepare channel maps and calibration lists ---
-        channel_analogin_map_temp = {}
-        channel_offset_map_temp = {}
-        channel_scale_map_temp = {}
-        channels_to_calibrate_list = []
-        channel_name_order = []
-
-        for channel_cfg in channels_cfg:
-            name = channel_cfg.get('name')
-            adc_channel_index = channel_cfg.get('adc_channel')
-            offset = channel_cfg.get('offset', 0.0)
-            scale = channel_cfg.get('scale', 1.0)
-
-            if not name or adc_channel_index is None:
-                print(f"Current channel config missing name or adc_channel: {channel_cfg}, skipping.")
-                if name:
-                    latest_current_data_ref[name] = {"error": "config_incomplete", "details": "Missing name or adc_channel"}
-                continue
-
-            if not isinstance(adc_channel_index, int) or not (0 <= adc_channel_index <= 3):
-                print(f"Invalid ADC channel index {adc_channel_index} for channel '{name}'. Must be 0-3. Skipping.")
-                latest_current_data_ref[name] = {"error": "invalid_channel_index", "details": f"Index {adc_channel_index} out of range"}
-                continue
-
-            try:
-                analog_in_obj = AnalogIn(adc_instance, adc_channel_index)
-                channel_analogin_map_temp[name] = analog_in_obj
-                channel_offset_map_temp[name] = offset
-                channel_scale_map_temp[name] = scale
-                channels_to_calibrate_list.append(analog_in_obj)
-                channel_name_order.append(name)
-                if name in latest_current_data_ref and isinstance(latest_current_data_ref[name], dict) and "error" in latest_current_data_ref[name]:
-                    del latest_current_data_ref[name]
-                if name not in latest_current_data_ref:
-                    latest_current_data_ref[name] = 0.0
-            except Exception as e_analog:
-                print(f"Error creating AnalogIn for channel '{name}' (ADC index {adc_channel_index}): {e_analog}")
-                traceback.print_exc()
-                latest_current_data_ref[name] = {"error": "analogin_creation_failed", "details": str(e_analog)}
-
-        if not channels_to_calibrate_list:
-            print("No valid current sensor channels configured or initialized to proceed with ADC.")
-            if "general" not in latest_current_data_ref:
-                latest_current_data_ref["general"] = {"error": "no_valid_channels_for_adc"}
-            return None
+    # Names used by earlier ADC blocks, computed up front so groups can be initialized independently
+    group_kwargs = []
+    names_seen = set()
+    for adc_cfg, channels_cfg in adc_blocks:
+        group_kwargs.append(dict(calibrate_flag=calibrate_flag, claimed_names=set(names_seen),
+                                 calibration_store=calibration_store))
+        names_seen.update(ch.get('name') for ch in channels_cfg if ch.get('name'))
+
+    if runner is None:
+        groups = [_initialize_adc_group_safe(adc_cfg, channels_cfg, latest_current_data_ref, **kwargs)
+                  for (adc_cfg, channels_cfg), kwargs in zip(adc_blocks, group_kwargs)]
+    else:
+        # One task per ADC: channels of one ADC share its multiplexer and are calibrated in sequence,
+        # different ADCs are calibrated concurrently.
+        futures = [runner.submit(f"i2c{adc_cfg.get('bus', 1)}", _initialize_adc_group_safe,
+                                 adc_cfg, channels_cfg, latest_current_data_ref, **kwargs)
+                   for (adc_cfg, channels_cfg), kwargs in zip(adc_blocks, group_kwargs)]
+        groups = [future.result() for future in futures]
+
+    for group in groups:
+        if not group:
+            continue
+        initialized_cs_data['adc_groups'].append(group)
+        initialized_cs_data['channel_analogin_map'].update(group['channel_analogin_map'])
+        initialized_cs_data['channel_offset_map'].update(group['channel_offset_map'])
+        initialized_cs_data['channel_scale_map'].update(group['channel_scale_map'])
 
-        # --- Calibration ---
-        if calibrate_flag is False:
-            print("Calibration skipped (--no-calibrate or config). Using offset from config for all channels.")
-        else:
-            print("Calibrating current sensors (zero current expected)...")
-            offset_voltages_list = calibrate_current_sensors(channels_to_calibrate_list)
-            if not offset_voltages_list or len(offset_voltages_list) != len(channels_to_calibrate_list):
-                print("Current sensor calibration failed or returned incorrect number of offsets.")
-                for name in channel_name_order:
-                    if name not in latest_current_data_ref or not (isinstance(latest_current_data_ref[name], dict) and "error" in latest_current_data_ref[name]):
-                        latest_current_data_ref[name] = {
-                            "error": "calibration_failed_group",
-                            "details": "Mismatch in offset count or calibration process error"
-                        }
-                if "general" not in latest_current_data_ref:
-                    latest_current_data_ref["general"] = {"error": "calibration_process_failed"}
-                return None
-            # Update offset maps and config with new offsets
-            for i, name in enumerate(channel_name_order):
-                channel_offset_map_temp[name] = offset_voltages_list[i]
-                # Update config for this channel
-                for ch_cfg in channels_cfg:
-                    if ch_cfg.get('name') == name:
-                        ch_cfg['offset'] = offset_voltages_list[i]
-
-        initialized_cs_data['channel_analogin_map'] = channel_analogin_map_temp
-        initialized_cs_data['channel_offset_map'] = channel_offset_map_temp
-        initialized_cs_data['channel_scale_map'] = channel_scale_map_temp
-
-        print("Current sensors initialized successfully (ADC and channels).")
-        return initialized_cs_data
-
-    except Exception as e_main:
-        print(f"Critical error during current sensor initialization: {e_main}")
-        traceback.print_exc()
+    if not initialized_cs_data['adc_groups']:
+        print("No valid current sensor channels configured or initialized to proceed with ADC.")
         if "general" not in latest_current_data_ref:
-            latest_current_data_ref["general"] = {"error": "initialization_failed_critical", "details": str(e_main)}
-        if channels_cfg:
-            for channel_cfg in channels_cfg:
-                name = channel_cfg.get('name')
-                if name and (name not in latest_current_data_ref or not (isinstance(latest_current_data_ref[name], dict) and "error" in latest_current_data_ref[name])):
-                    latest_current_data_ref[name] = {"error": "initialization_failed_due_to_critical_error"}
+            latest_current_data_ref["general"] = {"error": "no_valid_channels_for_adc"}
         return None
+
+    initialized_cs_data['adc_instance'] = initialized_cs_data['adc_groups'][0]['adc_instance']
+    print(f"Current sensors initialized successfully ({len(initialized_cs_data['adc_groups'])} ADC(s), "
+          f"{len(initialized_cs_data['channel_analogin_map'])} channel(s)).")
+    return initialized_cs_data
+
+
+class BusAwareInitRunner:
+    """
+    Runs sensor initialization tasks concurrently in a thread pool.
+    Tasks on different buses run in parallel. Tasks on the same bus also run concurrently
+    (up to max_tasks_per_bus at a time): every I2C/1-Wire transfer is atomic in the kernel driver,
+    so their transactions interleave while the waits between calibration samples overlap.
+    """
+    def __init__(self, max_workers=8, max_tasks_per_bus=4):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(max_workers)), thread_name_prefix="sensor_init")
+        self._max_tasks_per_bus = max(1, int(max_tasks_per_bus))
+        self._bus_slots = {}
+        self._lock = threading.Lock()
+
+    def _get_bus_slot(self, bus_key):
+        with self._lock:
+            if bus_key not in self._bus_slots:
+                self._bus_slots[bus_key] = threading.BoundedSemaphore(self._max_tasks_per_bus)
+            return self._bus_slots[bus_key]
+
+    def submit(self, bus_key, fn, *args, **kwargs):
+        """Submits fn(*args, **kwargs) as a task using the given bus (e.g. 'i2c1', 'w1'). Returns a Future."""
+        bus_slot = self._get_bus_slot(bus_key)
+
+        def task():
+            with bus_slot:
+                return fn(*args, **kwargs)
+        return self._executor.submit(task)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+def initialize_all_sensors(config, latest_vibration_data_ref, latest_temperature_data_ref, latest_current_data_ref,
+                           mpu_calibrate_flag=None, current_calibrate_flag=None, calibration_store=None):
+    """
+    Initializes (and calibrates) all configured sensors as concurrent per-device tasks.
+    With 'startup.parallel_init' set to false, sensors are initialized one after another as before.
+    :return: Tuple (initialized_mpu_sensors, initialized_ds18b20_sensors, initialized_current_data).
+    """
+    sensors_cfg = config.get('sensors', {})
+    mpu_configs = sensors_cfg.get('mpu6050', [])
+    ds_configs = sensors_cfg.get('ds18b20', [])
+    current_cfg = sensors_cfg.get('current', {})
+    startup_cfg = config.get('startup', {})
+    init_start_time = time.time()
+
+    if not startup_cfg.get('parallel_init', True):
+        initialized_mpu = initialize_mpu_sensors(mpu_configs, latest_vibration_data_ref,
+                                                 calibrate_flag=mpu_calibrate_flag, calibration_store=calibration_store)
+        initialized_ds = initialize_ds18b20_sensors(ds_configs, latest_temperature_data_ref)
+        initialized_current = initialize_current_sensors(current_cfg, latest_current_data_ref,
+                                                         calibrate_flag=current_calibrate_flag,
+                                                         calibration_store=calibration_store)
+        print(f"Sensor initialization finished in {time.time() - init_start_time:.2f} s (sequential).")
+        return initialized_mpu, initialized_ds, initialized_current
+
+    runner = BusAwareInitRunner(max_workers=startup_cfg.get('max_workers', 8),
+                                max_tasks_per_bus=startup_cfg.get('max_tasks_per_bus', 4))
+    try:
+        # One task per MPU6050 (calibration sleeps between samples overlap across devices)
+        mpu_futures = [
+            runner.submit(f"i2c{mpu_cfg.get('bus', 1)}", initialize_mpu_sensors, [mpu_cfg], latest_vibration_data_ref,
+                          calibrate_flag=mpu_calibrate_flag, calibration_store=calibration_store)
+            for mpu_cfg in mpu_configs
+        ]
+        # DS18B20 sensors only check their sysfs entries, one task for the whole 1-Wire bus
+        ds_future = runner.submit("w1", initialize_ds18b20_sensors, ds_configs, latest_temperature_data_ref)
+        # Current sensors: one task per ADC, submitted from here and awaited inside
+        initialized_current = initialize_current_sensors(current_cfg, latest_current_data_ref,
+                                                         calibrate_flag=current_calibrate_flag,
+                                                         calibration_store=calibration_store, runner=runner)
+
+        initialized_mpu = {}
+        for future in mpu_futures:  # Keep config order
+            initialized_mpu.update(future.result())
+        initialized_ds = ds_future.result()
+    finally:
+        runner.shutdown()
+
+    print(f"Sensor initialization finished in {time.time() - init_start_time:.2f} s (parallel).")
+    return initialized_mpu, initialized_ds, initialized_current
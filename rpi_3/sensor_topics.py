@@ -0,0 +1,81 @@
+# sensor_topics.py
+# -*- coding: utf-8 -*-
+"""
+Optional per-sensor topic layout: <prefix>/<device_id>/<group>/<sensor>.
+
+Besides the combined payload on mqtt.topic, every sensor entry is published on its own
+topic at a per-group rate (intervals_sec) or its own rate (sensor_intervals_sec), retained, so a consumer can subscribe to just what it needs
+(e.g. sensors/+/temperature/#) and gets the current state as soon as it subscribes.
+Messages are small JSON objects, readable by Grafana live panels and other tools:
+
+    {"timestamp": 1700000000.1, "value": 41.25}                    # temperature, current
+    {"timestamp": 1700000000.1, "total_rms": 0.99, ..., "fft_peaks": [...]}   # vibration
+    {"timestamp": 1700000000.1, "error": "read_failed", ...}       # error states
+
+Per-sensor topics are live-only: while the broker is unreachable they are skipped (the
+combined payload is buffered as before) and the retained values catch up on reconnect.
+"""
+
+import json
+
+from delivery import DeliveryClasses, DELIVERY_SENSOR_TOPIC
+
+SENSOR_GROUPS = ("vibration", "temperature", "current")
+DEFAULT_PREFIX = "sensors"
+DEFAULT_INTERVALS_SEC = {"vibration": 1.0, "temperature": 5.0, "current": 1.0}
+
+
+def sensor_topic(prefix, device_id, group, sensor):
+    return f"{prefix}/{device_id}/{group}/{sensor}"
+
+
+class SensorTopicPublisher:
+    """Publishes the entries of a payload record on per-sensor topics, each sensor at its own rate."""
+    def __init__(self, config):
+        topics_config = config.get('mqtt', {}).get('sensor_topics', {})
+        self.device_id = config.get('device_id', 'unknown_device')
+        self.prefix = topics_config.get('prefix', DEFAULT_PREFIX)
+        self.retain = topics_config.get('retain', True)
+        self.delivery = DeliveryClasses(config).get(DELIVERY_SENSOR_TOPIC)  # QoS/expiry: mqtt.delivery.sensor_topic
+        intervals = dict(DEFAULT_INTERVALS_SEC)
+        intervals.update(topics_config.get('intervals_sec', {}))
+        self.intervals_sec = intervals  # group -> seconds (0 = every record)
+        self.sensor_intervals_sec = topics_config.get('sensor_intervals_sec', {})  # sensor -> seconds, before the group
+        self._last_sent = {}  # (group, sensor) -> time of the last publish
+
+    def publish_due(self, mqtt_client, payload, now):
+        """
+        Publishes the sensors whose interval has elapsed.
+        :return: Number of bytes published.
+        """
+        timestamp = payload.get("timestamp", now)
+        published_bytes = 0
+        for group in SENSOR_GROUPS:
+            group_data = payload.get(group)
+            if not isinstance(group_data, dict) or not group_data:
+                continue
+            group_interval = self.intervals_sec.get(group, 0)
+            for sensor, sensor_data in group_data.items():
+                interval = self.sensor_intervals_sec.get(sensor, group_interval)
+                last_sent = self._last_sent.get((group, sensor))
+                if last_sent is not None and now - last_sent < interval:
+                    continue
+                if isinstance(sensor_data, dict):
+                    message = dict(sensor_data, timestamp=timestamp)
+                else:
+                    message = {"timestamp": timestamp, "value": sensor_data}
+                data = json.dumps(message, separators=(',', ':'))
+                info = self.delivery.publish(mqtt_client, sensor_topic(self.prefix, self.device_id, group, sensor),
+                                             data, retain=self.retain)
+                if getattr(info, 'rc', 0) != 0:
+                    continue  # Retried with the next record instead of after a full interval
+                self._last_sent[(group, sensor)] = now
+                published_bytes += len(data)
+        return published_bytes
+
+
+def create_sensor_topic_publisher(config):
+    """Returns a SensorTopicPublisher, or None if mqtt.sensor_topics.enabled is not set."""
+    if not config.get('mqtt', {}).get('sensor_topics', {}).get('enabled', False):
+        return None
+    return SensorTopicPublisher(config)
@@ -36,6 +36,22 @@ except ImportError as e:
 
     print("Adafruit ADS1x15 library not found. Current sensing disabled.")
 
+# Optional: shared I2C bus manager (arbitrates ADC transactions with the MPU6050 reads on the same bus)
+try:
+    from i2c_bus_manager import get_bus_manager, PRIORITY_CURRENT
+except ImportError:
+    get_bus_manager = None
+    PRIORITY_CURRENT = 1
+
+# Optional: adafruit-extended-bus allows opening /dev/i2c-N by number (needed for ADCs on buses other than 1)
+try:
+    from adafruit_extended_bus import ExtendedI2C
+except ImportError:
+    ExtendedI2C = None
+
+# One I2C object per bus number, shared by all ADS1115 devices on that bus
+_i2c_bus_cache = {}
+
 # === Calibration and parameters ===
 # These parameters define how raw voltage readings are converted to current
 # Adjust these based on your specific current sensor (e.g., SCT-013 30A/1V)
@@ -48,16 +64,45 @@ VOLTAGE_TO_CURRENT = BASE_VOLTAGE_TO_CURRENT * CALIBRATION_FACTOR # Final conver
 # Adjust these based on your sensor's noise floor
 CURRENT_THRESHOLD_AMPS = 0.5 # Minimum current (RMS) to report (below this is considered zero)
 
+# Default number of ADC conversions per channel for one RMS reading
+DEFAULT_RMS_SAMPLES = 500
+
 # Optional: Define plausible raw voltage range for filtering (depends on sensor and ADC connection)
 # SENSOR_MIN_RAW_VOLTAGE = 0.1
 # SENSOR_MAX_RAW_VOLTAGE = 4.9 # Example for 5V powered sensor measured by ADC
 
+def _get_i2c_bus(bus):
+    """Returns a cached I2C object for the given bus number, creating it on first use."""
+    if bus in _i2c_bus_cache:
+        return _i2c_bus_cache[bus]
+
+    i2c = None
+    bus_manager = get_bus_manager() if get_bus_manager else None
+    try:
+        if bus_manager is not None:
+            i2c = bus_manager.get_busio_adapter(bus)  # Shares the manager's handle and priority lock
+        elif ExtendedI2C is not None:
+            i2c = ExtendedI2C(bus)  # Opens /dev/i2c-<bus> directly
+        else:
+            if bus != 1:
+                print(f"Warning: adafruit_extended_bus not installed, I2C bus {bus} may fall back to default pins.")
+            # Use getattr to dynamically get the correct SCL/SDA pin based on bus number
+            i2c = busio.I2C(getattr(board, f'SCL_{bus}', board.SCL), getattr(board, f'SDA_{bus}', board.SDA))
+    except Exception as e:
+        print(f"Failed to initialize I2C bus {bus}: {e}")
+        traceback.print_exc() # Print detailed error
+        return None
+
+    _i2c_bus_cache[bus] = i2c
+    return i2c
+
+
 # --- init_adc function ---
 def init_adc(adc_config):
     """Initializes the ADS1115 ADC using config and returns the instance."""
     # Check if necessary components were successfully imported at the module level
     # Include _ADS1X15_CONFIG_GAIN in the check
-    if ADS1115 is None or AnalogIn is None or busio is None or board is None or _ADS1X15_CONFIG_GAIN is None:
+    if ADS1115 is None or AnalogIn is None or _ADS1X15_CONFIG_GAIN is None:
         print("ADS1x15 library components or gain configuration not available, cannot initialize ADC.")
         return None
 
@@ -77,24 +122,11 @@ def init_adc(adc_config):
         ads_gain = _ADS1X15_CONFIG_GAIN.get(gain_value)
 
 
-        # Initialize the I2C interface using the configured bus
-        try:
-            # Use getattr to dynamically get the correct SCL/SDA pin based on bus number
-            i2c = busio.I2C(getattr(board, f'SCL_{bus}', board.SCL), getattr(board, f'SDA_{bus}', board.SDA))
-        except AttributeError:
-            # Fallback for systems where pins are not named SCL_1, SDA_1 etc.
-            print(f"Warning: board definition does not have SCL_{bus}/SDA_{bus}. Falling back to default pins.")
-            try:
-                i2c = busio.I2C(board.SCL, board.SDA)  # Fallback to default pins
-            except Exception as e:
-                print(f"Failed to initialize I2C bus {bus}: {e}")
-                traceback.print_exc() # Print detailed error
-                return None
-        except Exception as e:
-             print(f"Failed to initialize I2C bus {bus}: {e}")
-             traceback.print_exc() # Print detailed error
-             return None
-
+        i2c = _get_i2c_bus(bus)
+        if i2c is None:
+            return None
+        if get_bus_manager and get_bus_manager():
+            get_bus_manager().register_device(bus, address, name=f"ads1115_0x{address:02x}", priority=PRIORITY_CURRENT)
 
         # Create an ADS1115 object
         adc_instance = ADS1115(i2c, address=address)
@@ -204,10 +236,11 @@ def calibrate_current_sensors(analogin_list, samples=500):
     
 
 # --- measure_all_currents function (keep as is, but handle read_rms error dict) ---
-def measure_all_currents(channel_analogin_map, channel_offset_map, channel_scale_map=None):
+def measure_all_currents(channel_analogin_map, channel_offset_map, channel_scale_map=None, samples=DEFAULT_RMS_SAMPLES):
     """
     Measures current for all calibrated channels using name maps.
     Accepts dicts: channel_analogin_map (name->AnalogIn), channel_offset_map (name->offset), channel_scale_map (name->scale).
+    samples: ADC conversions per channel for one RMS value ('sensors.current.samples_per_reading').
     """
     if AnalogIn is None or not channel_analogin_map or not channel_offset_map or set(channel_analogin_map.keys()) != set(channel_offset_map.keys()):
         return {"general": {"error": "calibration_maps_invalid"}}
@@ -218,7 +251,7 @@ def measure_all_currents(channel_analogin_map, channel_offset_map, channel_scale
         scale = 1.0
         if channel_scale_map and name in channel_scale_map:
             scale = channel_scale_map[name]
-        current_reading = read_rms(chan, offset_voltage, samples=500, scale=scale)
+        current_reading = read_rms(chan, offset_voltage, samples=samples, scale=scale)
         if isinstance(current_reading, dict) and "error" in current_reading:
             currents[name] = current_reading
         elif isinstance(current_reading, (int, float)):
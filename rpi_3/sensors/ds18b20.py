@@ -1,9 +1,18 @@
 import glob
+import os
 import time
 
+W1_DEVICES_DIR = '/sys/bus/w1/devices/'
+# Max DS18B20 conversion time per resolution (bits -> seconds)
+CONVERSION_TIME_SEC = {9: 0.094, 10: 0.188, 11: 0.375, 12: 0.75}
+DEFAULT_RESOLUTION = 12
+# Max conversion time at 12-bit resolution is 750 ms, allow some margin
+BULK_CONVERSION_TIMEOUT_SEC = 1.5
+
+
 class DS18B20:
     def __init__(self, sensor_id=None):
-        base_dir = '/sys/bus/w1/devices/'
+        base_dir = W1_DEVICES_DIR
         if sensor_id:
             self.device_file = f"{base_dir}{sensor_id}/w1_slave"
         else:
@@ -11,26 +20,155 @@ class DS18B20:
             if not folders:
                 raise RuntimeError("DS18B20 sensor not found")
             self.device_file = folders[0] + '/w1_slave'
+        self.sensor_dir = os.path.dirname(self.device_file)
+        self.resolution = DEFAULT_RESOLUTION
+
+    def set_resolution(self, bits):
+        """
+        Sets the conversion resolution (9-12 bit) via the sysfs 'resolution' attribute
+        (written to the sensor scratchpad by the w1_therm driver; needs write access to sysfs).
+        Lower resolution means shorter conversions: 9 bit ~94 ms, 12 bit ~750 ms.
+        """
+        bits = int(bits)
+        if bits not in CONVERSION_TIME_SEC:
+            raise ValueError(f"Invalid DS18B20 resolution {bits}, must be 9-12")
+        with open(os.path.join(self.sensor_dir, 'resolution'), 'w') as f:
+            f.write(f"{bits}\n")
+        self.resolution = self.get_resolution()
+        if self.resolution != bits:
+            raise RuntimeError(f"Resolution readback {self.resolution} does not match requested {bits}")
+
+    def get_resolution(self):
+        """Reads the current resolution from sysfs (falls back to the last known value)."""
+        try:
+            with open(os.path.join(self.sensor_dir, 'resolution'), 'r') as f:
+                self.resolution = int(f.read().strip())
+        except (OSError, ValueError):
+            pass
+        return self.resolution
+
+    @property
+    def conversion_time_sec(self):
+        return CONVERSION_TIME_SEC.get(self.resolution, CONVERSION_TIME_SEC[DEFAULT_RESOLUTION])
+
+    @property
+    def master_dir(self):
+        """sysfs directory of the w1 bus master this sensor is attached to (e.g. /sys/devices/w1_bus_master1)."""
+        return os.path.dirname(os.path.realpath(self.sensor_dir))
 
     def read_temp_raw(self):
         with open(self.device_file, 'r') as f:
             return f.readlines()
 
+    @staticmethod
+    def parse_w1_slave(lines):
+        """Returns the temperature in °C from w1_slave contents, or None if the CRC check failed."""
+        if len(lines) >= 2 and lines[0].strip()[-3:] == 'YES':
+            equals_pos = lines[1].find('t=')
+            if equals_pos != -1:
+                temp_string = lines[1][equals_pos + 2:]
+                try:
+                    return float(temp_string) / 1000.0
+                except ValueError:
+                    pass
+        return None
+
     def get_temperature(self):
         max_attempts = 3
         attempt = 0
         while attempt < max_attempts:
-            lines = self.read_temp_raw()
-            if len(lines) >= 2 and lines[0].strip()[-3:] == 'YES':
-                equals_pos = lines[1].find('t=')
-                if equals_pos != -1:
-                    temp_string = lines[1][equals_pos + 2:]
-                    try:
-                        temp_c = float(temp_string) / 1000.0
-                        return temp_c
-                    except ValueError:
-                        pass  # Если преобразование не удалось, пробуем заново.
+            temp_c = self.parse_w1_slave(self.read_temp_raw())
+            if temp_c is not None:
+                return temp_c
+            # Если преобразование не удалось, пробуем заново.
             attempt += 1
             time.sleep(0.3)  # Задержка перед повторной попыткой
         # Если не удалось получить корректное значение за несколько попыток – можно вернуть ошибку или None.
         raise RuntimeError("Не удалось получить корректное значение температуры")
+
+    def read_converted_temperature(self):
+        """
+        Reads the result of a conversion started by trigger_bulk_conversion().
+        The kernel returns the converted value without starting a new conversion.
+        """
+        temp_c = self.parse_w1_slave(self.read_temp_raw())
+        if temp_c is None:
+            raise RuntimeError("CRC check failed after bulk conversion")
+        return temp_c
+
+
+def supports_bulk_read(master_dir):
+    return os.path.exists(os.path.join(master_dir, 'therm_bulk_read'))
+
+
+def trigger_bulk_conversion(master_dir):
+    """Starts a temperature conversion on every sensor of the bus master at once."""
+    with open(os.path.join(master_dir, 'therm_bulk_read'), 'w') as f:
+        f.write('trigger\n')
+
+
+def wait_bulk_conversion(master_dir, timeout=BULK_CONVERSION_TIMEOUT_SEC):
+    """
+    Waits until the bulk conversion finished. therm_bulk_read reads -1 while a conversion
+    is in progress, 1 when results are ready and 0 if no conversion was triggered.
+    :return: True if results are ready.
+    """
+    deadline = time.time() + timeout
+    bulk_read_file = os.path.join(master_dir, 'therm_bulk_read')
+    while True:
+        with open(bulk_read_file, 'r') as f:
+            state = f.read().strip()
+        if state != '-1':
+            return state == '1'
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.05)
+
+
+class W1BulkReader:
+    """
+    Reads all DS18B20 sensors with one conversion per bus master: trigger a conversion on every
+    sensor of the bus at once, wait one conversion time, then read the results.
+    A cycle takes one conversion time regardless of the number of sensors.
+    Sensors on masters without therm_bulk_read support are left to individual reads.
+    """
+    def __init__(self, sensors):
+        """:param sensors: Dict {name: DS18B20}."""
+        self.masters = {}  # master_dir -> {name: sensor}
+        self.unsupported = {}
+        for name, sensor in sensors.items():
+            master_dir = sensor.master_dir
+            if supports_bulk_read(master_dir):
+                self.masters.setdefault(master_dir, {})[name] = sensor
+            else:
+                self.unsupported[name] = sensor
+
+    def read_all(self):
+        """
+        :return: Dict {name: temperature °C or Exception} for every sensor on a bulk-capable master.
+        """
+        results = {}
+        for master_dir in self.masters:
+            try:
+                trigger_bulk_conversion(master_dir)
+            except Exception as e:
+                for name in self.masters[master_dir]:
+                    results[name] = e
+        for master_dir, sensors in self.masters.items():
+            if any(name in results for name in sensors):
+                continue  # Trigger failed for this master
+            # Wait as long as the slowest (highest resolution) sensor on this master needs
+            timeout = max(sensor.conversion_time_sec for sensor in sensors.values()) * 1.5 + 0.2
+            try:
+                ready = wait_bulk_conversion(master_dir, timeout=timeout)
+            except Exception as e:
+                ready = False
+                print(f"Error waiting for bulk conversion on {master_dir}: {e}")
+            for name, sensor in sensors.items():
+                try:
+                    if not ready:
+                        raise RuntimeError("Bulk conversion did not complete in time")
+                    results[name] = sensor.read_converted_temperature()
+                except Exception as e:
+                    results[name] = e
+        return results
@@ -4,12 +4,18 @@ import smbus2
 import time
 import math
 import numpy as np
+from contextlib import nullcontext
+
+try:
+    from i2c_bus_manager import PRIORITY_VIBRATION
+except ImportError:
+    PRIORITY_VIBRATION = 0
 # For FFT, if scipy is available and preferred for peak finding:
 # from scipy.signal import find_peaks # Example: for more advanced peak finding
 # from scipy.fft import rfft, rfftfreq # Alternative to numpy.fft if using scipy
 
 class MPU6050:
-    def __init__(self, bus=1, address=0x68, buffer_size=100, sample_rate_hz=100):
+    def __init__(self, bus=1, address=0x68, buffer_size=100, sample_rate_hz=100, bus_manager=None, name=None):
         """
         Initialize MPU6050 sensor.
         :param bus: I2C bus number (e.g., 1 for Raspberry Pi default).
@@ -17,9 +23,14 @@ class MPU6050:
         :param buffer_size: Number of samples to store for RMS, Peak, and FFT calculations.
         :param sample_rate_hz: Desired sample rate in Hz (e.g., 100, 200, 500, 1000).
                                Actual rate may vary slightly based on hardware limits.
+        :param bus_manager: Optional I2CBusManager. When given, the shared bus handle is used and
+                            every read is an arbitrated transaction with vibration priority.
+        :param name: Optional sensor name for bus utilization reports.
         """
         self.bus_num = bus # Store bus number for SMBus initialization
         self.address = address
+        self.bus_manager = bus_manager
+        self.bus = None
         self.buffer_size = int(buffer_size) # Ensure integer
         self.configured_sample_rate_hz = float(sample_rate_hz) # Store user-requested rate
         self.actual_sample_rate_hz = self.configured_sample_rate_hz # Will be updated after sensor init
@@ -43,20 +54,33 @@ class MPU6050:
         # Gyroscope sensitivity (LSB/deg/s for +/- 250 deg/s range by default)
         self.gyro_sensitivity = 131.0
 
+        if self.bus_manager:
+            self.bus_manager.register_device(self.bus_num, self.address,
+                                             name=name or f"mpu6050_0x{self.address:02x}", priority=PRIORITY_VIBRATION)
+
         self._initialize_sensor()
         print(f"MPU6050 '{self.address:02x}' initialized on bus {self.bus_num}.")
 
+    def _transaction(self):
+        """Context for one bus transaction: arbitrated by the bus manager if present."""
+        if self.bus_manager:
+            return self.bus_manager.transaction(self.bus_num, self.address, PRIORITY_VIBRATION)
+        return nullcontext()
 
     def _initialize_sensor(self):
         try:
-            self.bus = smbus2.SMBus(self.bus_num) # Initialize SMBus here
+            if self.bus_manager:
+                self.bus = self.bus_manager.get_smbus(self.bus_num) # Shared handle owned by the manager
+            else:
+                self.bus = smbus2.SMBus(self.bus_num) # Initialize SMBus here
         except FileNotFoundError:
             print(f"Error: I2C bus {self.bus_num} not found. Check Raspberry Pi I2C configuration.")
             raise
 
         # Check WHO_AM_I register
         try:
-            who_am_i = self.bus.read_byte_data(self.address, 0x75)
+            with self._transaction():
+                who_am_i = self.bus.read_byte_data(self.address, 0x75)
             # Common MPU6050 WHO_AM_I values are 0x68. Some clones might differ.
             # Address itself might be read on some boards.
             if who_am_i not in [0x68, 0x72, self.address]: # 0x72 for MPU6000, 0x68 for MPU6050
@@ -64,17 +88,19 @@ class MPU6050:
             # print(f"MPU6050 connection successful at address 0x{self.address:02x}")
         except Exception as e:
             print(f"Error: MPU6050 not found or connection failed at 0x{self.address:02x} on bus {self.bus_num}. {e}")
-            if self.bus: self.bus.close()
+            if self.bus and not self.bus_manager: self.bus.close()
             raise ConnectionError(f"MPU6050 communication error at 0x{self.address:02x}") from e
 
         # Wake up MPU6050 (clear sleep bit)
-        self.bus.write_byte_data(self.address, 0x6B, 0) # PWR_MGMT_1 register
+        with self._transaction():
+            self.bus.write_byte_data(self.address, 0x6B, 0) # PWR_MGMT_1 register
         time.sleep(0.1) # Wait for sensor to stabilize
 
         # Set Digital Low Pass Filter (DLPF)
         # 0x01: Accel BW 184Hz, Gyro BW 188Hz. Internal sample rate becomes 1kHz.
         # Other values offer different bandwidths. 184Hz is a good starting point.
-        self.bus.write_byte_data(self.address, 0x1A, 0x01) # CONFIG register
+        with self._transaction():
+            self.bus.write_byte_data(self.address, 0x1A, 0x01) # CONFIG register
 
         # Set Sample Rate Divider (SMPLRT_DIV)
         # Sample Rate = Gyroscope Output Rate / (1 + SMPLRT_DIV)
@@ -90,28 +116,35 @@ class MPU6050:
 
         if smplrt_div < 0: smplrt_div = 0      # Max sample rate is 1kHz
         if smplrt_div > 255: smplrt_div = 255  # Min sample rate approx 3.9Hz
-        self.bus.write_byte_data(self.address, 0x19, smplrt_div)
+        with self._transaction():
+            self.bus.write_byte_data(self.address, 0x19, smplrt_div)
         self.actual_sample_rate_hz = 1000.0 / (1 + smplrt_div)
 
         print(f"MPU6050 at 0x{self.address:02x}: Configured DLPF Accel BW ~184Hz. Actual SampleRate ~{self.actual_sample_rate_hz:.2f}Hz.")
 
 
-    def read_raw_data(self, reg):
-        # Read two bytes (high and low) and combine them
-        high = self.bus.read_byte_data(self.address, reg)
-        low = self.bus.read_byte_data(self.address, reg + 1)
+    @staticmethod
+    def _to_signed(high, low):
         value = (high << 8) + low
         # Convert to signed 16-bit integer
         if value >= 0x8000: # or value > 32767
             value -= 65536
         return value
 
+    def read_raw_data(self, reg):
+        # Read two bytes (high and low) and combine them
+        with self._transaction():
+            high = self.bus.read_byte_data(self.address, reg)
+            low = self.bus.read_byte_data(self.address, reg + 1)
+        return self._to_signed(high, low)
+
     def get_accel_data_raw(self):
-        """Reads raw 16-bit accelerometer data for X, Y, Z axes."""
-        ax_raw = self.read_raw_data(0x3B) # ACCEL_XOUT_H
-        ay_raw = self.read_raw_data(0x3D) # ACCEL_YOUT_H
-        az_raw = self.read_raw_data(0x3F) # ACCEL_ZOUT_H
-        return {'x': ax_raw, 'y': ay_raw, 'z': az_raw}
+        """Reads raw 16-bit accelerometer data for X, Y, Z axes (one 6-byte block read from ACCEL_XOUT_H)."""
+        with self._transaction():
+            data = self.bus.read_i2c_block_data(self.address, 0x3B, 6)
+        return {'x': self._to_signed(data[0], data[1]),
+                'y': self._to_signed(data[2], data[3]),
+                'z': self._to_signed(data[4], data[5])}
 
     def get_accel_data(self):
         """
@@ -176,6 +209,16 @@ class MPU6050:
         self._buffer_index = 0
         self._buffer_filled_once = False
 
+    def set_accel_offset(self, offset):
+        """
+        Applies previously stored accelerometer offsets (in 'g') instead of calibrating.
+        :param offset: Dict with 'x', 'y', 'z' keys, as produced by calibrate().
+        """
+        for axis in ('x', 'y', 'z'):
+            self.accel_offset[axis] = float(offset.get(axis, 0.0))
+        print(f"MPU6050 at 0x{self.address:02x} offsets restored (g): x={self.accel_offset['x']:.4f}, "
+              f"y={self.accel_offset['y']:.4f}, z={self.accel_offset['z']:.4f}")
+
     def update_buffer(self):
         """
         Reads corrected acceleration data (in 'g's) and updates cyclic buffers.
@@ -311,7 +354,10 @@ class MPU6050:
         return metrics
 
     def close(self):
-        """Closes the I2C bus connection."""
+        """Closes the I2C bus connection (a handle shared through the bus manager is left open)."""
+        if self.bus_manager:
+            self.bus = None
+            return
         if hasattr(self, 'bus') and self.bus:
             try:
                 self.bus.close()
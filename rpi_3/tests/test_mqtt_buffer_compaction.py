@@ -0,0 +1,63 @@
+# test_mqtt_buffer_compaction.py
+# -*- coding: utf-8 -*-
+"""
+Backlog compaction of the offline buffer (SQLiteMessageQueue.compact_oldest).
+
+Run from rpi_3:
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mqtt_buffer_sqlite import SQLiteMessageQueue, LANE_HISTORY  # noqa: E402
+
+
+class CompactOldestTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.queue = SQLiteMessageQueue(os.path.join(self._dir.name, "buffer.db"), ram_max_messages=100000)
+
+    def tearDown(self):
+        self.queue.close()
+        self._dir.cleanup()
+
+    def _buffer(self, start_ts, count, rate_hz=3.0):
+        for i in range(count):
+            self.queue.put({"device_id": "station_1", "timestamp": start_ts + i / rate_hz,
+                            "temperature": {"engine_temp": 40.0 + i * 0.01}}, LANE_HISTORY)
+        self.queue.spill()
+
+    def _rollups(self):
+        return [(row_id, payload["timestamp"], payload["rollup"]["count"])
+                for row_id, payload in self.queue.get_all() if "rollup" in payload]
+
+    def _compact_all(self, window_sec, chunk_rows):
+        while self.queue.compact_oldest(window_sec, chunk_rows):
+            pass
+
+    def test_window_larger_than_chunk_is_compacted(self):
+        # 600 s windows at 3 Hz hold 1800 rows, more than a 1000-row chunk
+        self._buffer(1200, 3000)
+        self._compact_all(600, 1000)
+        self.assertEqual([(1, 1200, 1800)], self._rollups())
+        # The newest window (1800..2400) may still grow and stays raw
+        self.assertEqual(1 + 1200, len(self.queue.get_all()))
+
+    def test_growing_window_gets_one_rollup_row(self):
+        self._buffer(1200, 30, rate_hz=1.0)
+        self._compact_all(60, 1000)
+        self._buffer(1230, 30, rate_hz=1.0)
+        self._compact_all(60, 1000)
+        self.assertEqual([], self._rollups())  # Window 1200 is still the newest one
+        self._buffer(1260, 5, rate_hz=1.0)
+        self._compact_all(60, 1000)
+        self.assertEqual([(1, 1200, 60)], self._rollups())
+
+
+if __name__ == '__main__':
+    unittest.main()